@@ -0,0 +1,38 @@
+import argparse
+import json
+import pathlib
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the results of two benchmark runs")
+    parser.add_argument("reference", type=pathlib.Path)
+    parser.add_argument("candidate", type=pathlib.Path)
+    arguments = parser.parse_args()
+    
+    with arguments.reference.open() as fd:
+        reference = json.load(fd)
+    with arguments.candidate.open() as fd:
+        candidate = json.load(fd)
+    
+    if reference["tree"] != candidate["tree"]:
+        print("WARNING: the trees are different", file=sys.stderr)
+    if reference["options"] != candidate["options"]:
+        print("WARNING: the options are different", file=sys.stderr)
+    
+    print("{:<10}{:<16}{:>12}{:>12}{:>8}".format(
+        "Backend", "Step", reference["version"] or "reference",
+        candidate["version"] or "candidate", "Ratio"))
+    for backend, steps in reference["results"].items():
+        for step, durations in steps.items():
+            other = candidate["results"].get(backend, {}).get(step)
+            if not other:
+                continue
+            # NOTE: the fastest run is the least affected by external load
+            before, after = min(durations), min(other)
+            print("{:<10}{:<16}{:>11.3f}s{:>11.3f}s{:>8.2f}".format(
+                backend, step, before, after,
+                after/before if before > 0 else float("nan")))
+
+if __name__ == "__main__":
+    sys.exit(main())
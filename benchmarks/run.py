@@ -0,0 +1,185 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest.mock
+
+import sneakersync
+
+import tree
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the transfers of sneakersync on a synthetic tree")
+    parser.add_argument(
+        "--root", type=pathlib.Path,
+        help="Directory of the benchmark data "
+            "(default: temporary directory in $SNEAKERSYNC_ROOT or $TMPDIR)")
+    parser.add_argument(
+        "--backend", action="append", choices=["rsync", "native"],
+        help="Backend to benchmark, may be repeated "
+            "(default: all available backends)")
+    parser.add_argument(
+        "--option", action="append", default=[], metavar="KEY=VALUE",
+        help="Configuration option of sneakersync, may be repeated")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of runs (default: 3)")
+    parser.add_argument(
+        "--drop-caches", action="store_true",
+        help="Drop the page cache before each step (requires root)")
+    parser.add_argument(
+        "--output", "-o", type=pathlib.Path,
+        help="JSON results file (default: standard output)")
+    tree.add_arguments(parser)
+    arguments = parser.parse_args()
+    
+    backends = arguments.backend
+    if not backends:
+        backends = ["native"]
+        if shutil.which("rsync"):
+            backends.insert(0, "rsync")
+    options = dict(x.split("=", 1) for x in arguments.option)
+    
+    logging.basicConfig(level="ERROR")
+    
+    root = pathlib.Path(tempfile.mkdtemp(
+        dir=arguments.root or os.environ.get("SNEAKERSYNC_ROOT")))
+    try:
+        parameters = tree.get_parameters(arguments)
+        print("Generating tree in {}".format(root), file=sys.stderr)
+        summary = tree.generate(root / "source", parameters)
+        
+        results = {}
+        for backend in backends:
+            results[backend] = {}
+            for run in range(arguments.repeat):
+                print(
+                    "Running {} ({}/{})".format(
+                        backend, 1+run, arguments.repeat),
+                    file=sys.stderr)
+                durations = benchmark(
+                    root, getattr(sneakersync, backend), options,
+                    arguments.drop_caches)
+                if backend == "native" and parameters["scattered_files"]:
+                    durations.update(
+                        benchmark_order(
+                            root, options, arguments.drop_caches))
+                for name, duration in durations.items():
+                    results[backend].setdefault(name, []).append(duration)
+    finally:
+        shutil.rmtree(root)
+    
+    data = {
+        "version": get_version(),
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "drop_caches": arguments.drop_caches,
+        "tree": dict(parameters, **summary),
+        "results": results,
+    }
+    if arguments.output:
+        with arguments.output.open("w") as fd:
+            json.dump(data, fd, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+
+def benchmark(root, backend, options, drop_caches=False):
+    """Time a full send and receive, then a re-send of unchanged modules.
+    Return the durations, in seconds. If drop_caches is True, each step
+    starts with a cold page cache.
+    """
+    
+    drive = root / "drive"
+    target = root / "target"
+    for path in [drive, target]:
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir()
+    
+    source = root / "source"
+    with (drive / "sneakersync.cfg").open("w") as fd:
+        fd.write("modules:\n")
+        for module in sorted(source.iterdir()):
+            fd.write("  - root:\n")
+            fd.write("      first.host: {}\n".format(module))
+            fd.write("      second.host: {}\n".format(target / module.name))
+        for key, value in options.items():
+            fd.write("{}: {}\n".format(key, value))
+    
+    def run(function, host):
+        if drop_caches:
+            drop_page_cache()
+        with unittest.mock.patch("socket.gethostname", lambda: host):
+            start = time.perf_counter()
+            function(drive, progress=False, backend=backend)
+            return time.perf_counter() - start
+    
+    durations = {}
+    durations["send"] = run(sneakersync.operations.send, "first.host")
+    durations["receive"] = run(sneakersync.operations.receive, "second.host")
+    durations["round_trip"] = durations["send"]+durations["receive"]
+    durations["resend"] = run(sneakersync.operations.send, "first.host")
+    return durations
+
+def benchmark_order(root, options, drop_caches=False):
+    """Time a send of the scattered files of the tree with the native
+    backend, in directory order and in physical order. Return the durations,
+    in seconds.
+    """
+    
+    drive = root / "drive"
+    durations = {}
+    for order in ["directory", "physical"]:
+        if drive.exists():
+            shutil.rmtree(drive)
+        drive.mkdir()
+        with (drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(root / "source" / "scattered"))
+            fd.write("    profile: {{order: {}}}\n".format(order))
+            for key, value in options.items():
+                fd.write("{}: {}\n".format(key, value))
+        
+        if drop_caches:
+            drop_page_cache()
+        start = time.perf_counter()
+        sneakersync.operations.send(
+            drive, progress=False, backend=sneakersync.native)
+        durations["{}_order".format(order)] = time.perf_counter() - start
+    return durations
+
+def drop_page_cache():
+    """Write the dirty pages and drop the page cache, or warn if it is not
+    possible.
+    """
+    
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as fd:
+            fd.write("3\n")
+    except OSError as e:
+        print("Could not drop the page cache: {}".format(e), file=sys.stderr)
+
+def get_version():
+    """Return the git revision of sneakersync, if available."""
+    
+    directory = pathlib.Path(sneakersync.__file__).parent
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=directory,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import pathlib
+import random
+import sys
+
+# Default parameters of the generated tree, overridden by the command line
+defaults = {
+    "seed": 0,
+    "tiny_files": 10000,
+    "tiny_size": 512,
+    "files_per_directory": 100,
+    "huge_files": 2,
+    "huge_size": 256*2**20,
+    "depth": 64,
+    "hard_links": 1000,
+    "xattrs": 1000,
+    "sparse_files": 4,
+    "sparse_size": 256*2**20,
+    "scattered_files": 10000,
+}
+
+def generate(root, parameters):
+    """Generate a synthetic tree in root, with one sub-directory per kind of
+    content (tiny files, huge files, deep nesting, hard links, extended
+    attributes, sparse files and scattered files). Return the number of
+    files and their total (apparent) size.
+    """
+    
+    parameters = dict(defaults, **parameters)
+    random_ = random.Random(parameters["seed"])
+    summary = {"files": 0, "bytes": 0}
+    
+    def write(path, size):
+        with path.open("wb") as fd:
+            while size > 0:
+                chunk = min(size, 2**20)
+                fd.write(random_.randbytes(chunk))
+                size -= chunk
+        summary["files"] += 1
+        summary["bytes"] += path.stat().st_size
+    
+    # Many tiny files, spread over several directories
+    tiny = root / "tiny"
+    for index in range(parameters["tiny_files"]):
+        directory = tiny / "{:06d}".format(
+            index // parameters["files_per_directory"])
+        directory.mkdir(parents=True, exist_ok=True)
+        write(
+            directory / "{:06d}".format(index),
+            random_.randint(0, 2*parameters["tiny_size"]))
+    
+    # A few huge files
+    huge = root / "huge"
+    huge.mkdir(parents=True)
+    for index in range(parameters["huge_files"]):
+        write(huge / "{:03d}".format(index), parameters["huge_size"])
+    
+    # Deep nesting, with one file per level
+    directory = root / "deep"
+    for level in range(parameters["depth"]):
+        directory = directory / "{:03d}".format(level)
+        directory.mkdir(parents=True)
+        write(directory / "file", parameters["tiny_size"])
+    
+    # Groups of hard links
+    links = root / "links"
+    links.mkdir(parents=True)
+    for index in range(parameters["hard_links"]):
+        path = links / "{:06d}".format(index)
+        if index % 4 == 0:
+            write(path, parameters["tiny_size"])
+            target = path
+        else:
+            os.link(target, path)
+    
+    # Extended attributes, on platforms and file systems which support them
+    xattrs = root / "xattrs"
+    xattrs.mkdir(parents=True)
+    for index in range(parameters["xattrs"]):
+        path = xattrs / "{:06d}".format(index)
+        write(path, parameters["tiny_size"])
+        try:
+            os.setxattr(
+                path, "user.sneakersync.benchmark",
+                random_.randbytes(random_.randint(1, 256)))
+        except (AttributeError, OSError) as e:
+            print(
+                "Extended attributes not supported: {}".format(e),
+                file=sys.stderr)
+            break
+    
+    # Sparse files, with a few data blocks
+    sparse = root / "sparse"
+    sparse.mkdir(parents=True)
+    for index in range(parameters["sparse_files"]):
+        path = sparse / "{:03d}".format(index)
+        with path.open("wb") as fd:
+            for offset in range(0, parameters["sparse_size"], 2**24):
+                fd.seek(offset)
+                fd.write(random_.randbytes(4096))
+            fd.truncate(parameters["sparse_size"])
+        summary["files"] += 1
+        summary["bytes"] += parameters["sparse_size"]
+    
+    # Tiny files written in random order across directories, so that their
+    # directory order differs from the order of their data on disk
+    scattered = root / "scattered"
+    paths = [
+        scattered / "{:06d}".format(
+            index // parameters["files_per_directory"]) / "{:06d}".format(index)
+        for index in range(parameters["scattered_files"])]
+    random_.shuffle(paths)
+    for path in paths:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write(path, random_.randint(0, 2*parameters["tiny_size"]))
+    
+    return summary
+
+def add_arguments(parser):
+    """Add the tree parameters to an argument parser."""
+    
+    for name, value in defaults.items():
+        parser.add_argument(
+            "--{}".format(name.replace("_", "-")), type=int, default=value,
+            help="(default: {})".format(value))
+
+def get_parameters(arguments):
+    return {name: getattr(arguments, name) for name in defaults}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic tree for benchmarks")
+    parser.add_argument("root", type=pathlib.Path)
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    
+    summary = generate(arguments.root, get_parameters(arguments))
+    print(json.dumps(summary))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -43,6 +43,7 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=["pyyaml"],
+    extras_require={"zstd": ["zstandard"]},
     
     entry_points={ "console_scripts": [ "sneakersync=sneakersync.main:main"] },
 )
@@ -1,6 +1,8 @@
+import hashlib
 import logging
 import socket
 import sys
+import threading
 
 def get_module_root(module, host=None):
     if host is None:
@@ -12,11 +14,37 @@ def get_module_root(module, host=None):
     
     return module["root"][host]
 
+def get_module_id(module):
+    """Return an identifier of the module which is the same on all hosts."""
+    
+    # NOTE: host names are not used, since a module with a single root is
+    # associated to the current host name.
+    roots = sorted(set(str(x) for x in module["root"].values()))
+    return hashlib.sha1(repr(roots).encode()).hexdigest()[:16]
+
+# Serialize the output of modules processed in parallel
+output_lock = threading.Lock()
+
+def write_output(module, text):
+    """Write text on stdout. When modules are processed in parallel, each line
+    is prefixed by the module root.
+    """
+    
+    if threading.current_thread() is not threading.main_thread():
+        prefix = "{}: ".format(get_module_root(module))
+        text = "".join(
+            prefix+line for line in text.splitlines(True))
+    with output_lock:
+        sys.stdout.write(text)
+
 from .exception import SneakersyncException
 import sys
 sys.modules["sneakersync"].Exception = SneakersyncException
 
 logger = logging.getLogger(__name__)
 
-from . import operations, rsync
+from . import (
+    bundles, catalog, checksums, compression, filters, generations, manifest,
+    metrics, native, operations, ordering, packs, plan, profiles, progress,
+    rsync, scan, sparse, store, volumes, watch)
 from .state import State
@@ -0,0 +1,220 @@
+import copy
+import datetime
+import gzip
+import os
+import socket
+import sys
+
+import yaml
+
+sneakersync = sys.modules["sneakersync"]
+
+class Bundle(object):
+    """Changes of the modules sent in a given generation, in incremental
+    mode. The changed files are stored with the same layout as in mirror mode,
+    and the deleted paths of each module are stored in a separate list.
+    """
+    
+    def __init__(self, path, generation, host, date, modules=None):
+        self.path = path
+        self.generation = generation
+        self.host = host
+        self.date = date
+        # Module identifier -> {"full": whether the whole module was sent}
+        self.modules = modules or {}
+    
+    def save(self):
+        data = {
+            "host": self.host, "date": self.date, "modules": self.modules}
+        with (self.path / "sneakersync.bundle").open("w") as fd:
+            yaml.dump(data, fd)
+    
+    @staticmethod
+    def load(path):
+        """Load a bundle, return None if it is incomplete."""
+        
+        if not (path / "sneakersync.bundle").is_file():
+            return None
+        with (path / "sneakersync.bundle").open() as fd:
+            data = yaml.load(fd, Loader=yaml.BaseLoader)
+        modules = {
+            module: {"full": sneakersync.operations.get_boolean(x["full"])}
+            for module, x in data["modules"].items()}
+        return Bundle(
+            path, int(path.name), data["host"], data["date"], modules)
+    
+    def get_deleted(self, module):
+        """Return the deleted paths of a module, relative to its root."""
+        
+        path = self.path / "deleted.{}".format(
+            sneakersync.get_module_id(module))
+        if not path.is_file():
+            return []
+        with gzip.open(path, "rb") as fd:
+            return [os.fsdecode(x) for x in fd.read().split(b"\0") if x]
+    
+    def set_deleted(self, module, paths):
+        path = self.path / "deleted.{}".format(
+            sneakersync.get_module_id(module))
+        with gzip.open(path, "wb") as fd:
+            for entry in sorted(paths):
+                fd.write(os.fsencode(entry)+b"\0")
+
+def get_directory(drive):
+    return drive / "sneakersync.bundles"
+
+def get_generations(drive):
+    """Return the generations of the complete bundles stored on the drive."""
+    
+    directory = get_directory(drive)
+    if not directory.is_dir():
+        return []
+    return sorted(
+        int(x.name) for x in directory.iterdir()
+        if x.name.isdigit() and (x / "sneakersync.bundle").is_file())
+
+def create(drive, generation):
+    """Create an empty bundle, removing any incomplete previous attempt."""
+    
+    path = get_directory(drive) / "{:08d}".format(generation)
+    if path.exists():
+        sneakersync.native.remove(path)
+    path.mkdir(parents=True)
+    return Bundle(
+        path, generation, socket.gethostname(), datetime.datetime.now())
+
+def send(
+        destination, configuration, module, state, progress, backend, bundle,
+        callback=None, prepared=None):
+    """Store the changes of a module since the previous send from this host in
+    the bundle. Return the new manifest of the module, to be saved once all
+    modules are sent. prepared is the result of sneakersync.manifest.prepare,
+    if the module was already scanned.
+    """
+    
+    if prepared is None:
+        prepared = sneakersync.manifest.prepare(
+            destination, configuration, module, state)
+    manifest, files = prepared
+    
+    if files is None:
+        backend.send(
+            bundle.path, configuration, module, state, progress,
+            callback=callback)
+    elif files:
+        backend.send(
+            bundle.path, configuration, module, state, progress, files,
+            callback=callback)
+        bundle.set_deleted(
+            module, [x for x in files if x not in manifest.entries])
+    else:
+        return manifest
+    
+    bundle.modules[sneakersync.get_module_id(module)] = {
+        "full": files is None}
+    return manifest
+
+def receive(
+        source, configuration, module, state, progress, backend,
+        callback=None):
+    """Apply the bundles which were not yet received by this host."""
+    
+    acknowledged = state.generations.get(socket.gethostname(), 0)
+    generations = get_generations(source)
+    module_id = sneakersync.get_module_id(module)
+    
+    bundles = [
+        Bundle.load(get_directory(source) / "{:08d}".format(x))
+        for x in generations if x > acknowledged]
+    bundles = [x for x in bundles if module_id in x.modules]
+    
+    # Start from the most recent bundle containing the whole module, if any.
+    # This is mandatory if some of the required bundles have been removed.
+    full = [
+        index for index, bundle in enumerate(bundles)
+        if bundle.modules[module_id]["full"]]
+    if full:
+        bundles = bundles[full[-1]:]
+    elif generations and generations[0] > acknowledged+1:
+        raise Exception(
+            "Bundles {} to {} are missing for {}: "
+            "a full send is required".format(
+                acknowledged+1, generations[0]-1,
+                sneakersync.get_module_root(module)))
+    
+    root = sneakersync.get_module_root(module)
+    for bundle in bundles:
+        full = bundle.modules[module_id]["full"]
+        if not full:
+            for path in bundle.get_deleted(module):
+                sneakersync.native.remove(root / path)
+        
+        bundle_state = copy.copy(state)
+        bundle_state.previous_host = bundle.host
+        backend.receive(
+            bundle.path, configuration, module, bundle_state, progress,
+            delete=full, callback=callback)
+    
+    update_manifest(source, configuration, module, bundles)
+
+def update_manifest(drive, configuration, module, bundles):
+    """Record the received paths in the manifest of this host, so that its
+    next bundle does not send them back. If the first bundle contains the
+    whole module, the manifest describes the received module.
+    """
+    
+    if not bundles:
+        return
+    
+    host = socket.gethostname()
+    path = sneakersync.manifest.get_path(drive, module, host)
+    checksum = sneakersync.manifest.get_checksum(configuration, module)
+    root = sneakersync.get_module_root(module)
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    relative = "/".join(root.relative_to(root.anchor).parts)
+    
+    if bundles[0].modules[sneakersync.get_module_id(module)]["full"]:
+        sneakersync.manifest.Manifest(
+            path, host, checksum,
+            sneakersync.manifest.scan(root, filter_, relative)).save()
+        return
+    
+    # NOTE: without a manifest, the next bundle contains the whole module
+    manifest = sneakersync.manifest.Manifest.load(path)
+    if (
+            manifest is None or manifest.host != host
+            or manifest.checksum != checksum):
+        return
+    
+    received = set()
+    for bundle in bundles:
+        remote_root = sneakersync.get_module_root(module, bundle.host)
+        received.update(
+            x.path for x in sneakersync.scan.walk(
+                bundle.path / remote_root.relative_to(remote_root.anchor),
+                filter_, relative))
+        received.update(bundle.get_deleted(module))
+    
+    for received_path in received:
+        try:
+            manifest.entries[received_path] = sneakersync.manifest.get_entry(
+                os.lstat(root / received_path))
+        except FileNotFoundError:
+            manifest.entries.pop(received_path, None)
+            prefix = received_path+"/"
+            for child in [x for x in manifest.entries if x.startswith(prefix)]:
+                del manifest.entries[child]
+    manifest.save()
+
+def prune(drive, state):
+    """Remove the bundles which have been received by all other hosts."""
+    
+    host = socket.gethostname()
+    others = [x for h, x in state.generations.items() if h != host]
+    if not others:
+        return
+    for generation in get_generations(drive):
+        if generation <= min(others):
+            sneakersync.native.remove(
+                get_directory(drive) / "{:08d}".format(generation))
@@ -0,0 +1,255 @@
+import contextlib
+import datetime
+import os
+import socket
+import sqlite3
+import stat
+import sys
+import threading
+
+sneakersync = sys.modules["sneakersync"]
+
+# Modules sent in parallel update the catalog one after the other
+_lock = threading.Lock()
+
+_schema = """
+    CREATE TABLE IF NOT EXISTS modules (
+        module TEXT PRIMARY KEY, root TEXT NOT NULL, host TEXT NOT NULL,
+        date TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS entries (
+        module TEXT NOT NULL, path TEXT NOT NULL, parent TEXT NOT NULL,
+        name TEXT NOT NULL, mode INTEGER NOT NULL, size INTEGER NOT NULL,
+        mtime INTEGER NOT NULL, hash TEXT,
+        PRIMARY KEY (module, path)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS entries_parent ON entries (module, parent);
+    CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+"""
+
+def get_path(drive):
+    return drive / "sneakersync.catalog"
+
+@contextlib.contextmanager
+def connect(drive):
+    """Open the catalog of a drive, commit the changes when leaving the
+    context.
+    """
+    
+    connection = sqlite3.connect(str(get_path(drive)))
+    try:
+        connection.executescript(_schema)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def to_text(path):
+    """Return a path which can be stored in the catalog: undecodable bytes
+    are replaced by escape sequences.
+    """
+    
+    return os.fsencode(path).decode("utf-8", "backslashreplace")
+
+def update(drive, configuration, module, files=None, checksums=None):
+    """Record the entries of a module after it has been sent. If files is
+    specified and the module was last recorded from this host, only these
+    paths are updated. The hashes are taken from the checksums of the
+    module, if any.
+    """
+    
+    source = sneakersync.get_module_root(module)
+    module_id = sneakersync.get_module_id(module)
+    digests = checksums.entries if checksums is not None else {}
+    
+    def get_row(entry):
+        path = to_text(entry.path)
+        parent, _, name = path.rpartition("/")
+        digest = digests.get(entry.path)
+        if digest is not None and digest[:2] != (entry.size, entry.mtime):
+            digest = None
+        return (
+            module_id, path, parent, name, entry.mode, entry.size,
+            entry.mtime, digest[2].hex() if digest is not None else None)
+    
+    with _lock, connect(drive) as connection:
+        if files is not None and not connection.execute(
+                "SELECT 1 FROM modules WHERE module = ? AND host = ?",
+                (module_id, socket.gethostname())).fetchone():
+            files = None
+        
+        if files is None:
+            filter_ = sneakersync.filters.get_filter(
+                configuration["filters"]+module["filters"])
+            connection.execute(
+                "DELETE FROM entries WHERE module = ?", (module_id,))
+            entries = sneakersync.scan.walk(
+                source, filter_,
+                "/".join(source.relative_to(source.anchor).parts))
+        else:
+            entries = []
+            for path in files:
+                try:
+                    entry = sneakersync.scan.Entry.from_stat(
+                        path, os.lstat(source / path))
+                    entries.append(entry)
+                except FileNotFoundError:
+                    entry = None
+                
+                text = to_text(path)
+                connection.execute(
+                    "DELETE FROM entries WHERE module = ? AND path = ?",
+                    (module_id, text))
+                # Forget the content of deleted directories
+                if text and (entry is None or not stat.S_ISDIR(entry.mode)):
+                    connection.execute(
+                        "DELETE FROM entries "
+                        "WHERE module = ? AND path >= ? AND path < ?",
+                        (module_id, text+"/", text+"0"))
+        
+        connection.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (get_row(x) for x in entries))
+        connection.execute(
+            "INSERT OR REPLACE INTO modules VALUES (?, ?, ?, ?)",
+            (
+                module_id, str(source), socket.gethostname(),
+                datetime.datetime.now().isoformat(" ", "seconds")))
+
+def prune(drive, configuration):
+    """Remove the modules which are not in the configuration anymore."""
+    
+    modules = set(
+        sneakersync.get_module_id(x) for x in configuration["modules"])
+    with _lock, connect(drive) as connection:
+        for (module_id,) in connection.execute(
+                "SELECT module FROM modules").fetchall():
+            if module_id not in modules:
+                connection.execute(
+                    "DELETE FROM entries WHERE module = ?", (module_id,))
+                connection.execute(
+                    "DELETE FROM modules WHERE module = ?", (module_id,))
+
+def get_modules(drive):
+    """Return the recorded modules, by identifier: their root on the sender,
+    the sender and the date of the send, and their number of entries and
+    total size.
+    """
+    
+    with connect(drive) as connection:
+        rows = connection.execute(
+            "SELECT modules.module, root, host, date, COUNT(path), "
+                "COALESCE(SUM(size), 0) "
+            "FROM modules LEFT JOIN entries USING (module) "
+            "GROUP BY modules.module ORDER BY root").fetchall()
+    return {
+        x[0]: {
+            "root": x[1], "host": x[2], "date": x[3], "entries": x[4],
+            "size": x[5]}
+        for x in rows}
+
+def resolve(configuration, path):
+    """Return the module containing a local path (or a path on one of the
+    other hosts), and the path relative to the module root.
+    """
+    
+    path = os.path.normpath(os.path.abspath(path))
+    for module in configuration["modules"]:
+        for root in module["root"].values():
+            relative = os.path.relpath(path, root)
+            if relative == ".":
+                return module, ""
+            elif not relative.startswith(".."):
+                return module, relative.replace(os.sep, "/")
+    raise Exception("{} is not in a module".format(path))
+
+def list_directory(drive, module, path):
+    """Return the entries of a directory of a module, as rows of name, mode,
+    size, modification time and hash.
+    """
+    
+    with connect(drive) as connection:
+        rows = connection.execute(
+            "SELECT name, mode, size, mtime, hash FROM entries "
+            "WHERE module = ? AND parent = ? AND path != '' ORDER BY name",
+            (sneakersync.get_module_id(module), to_text(path))).fetchall()
+        if not rows and not connection.execute(
+                "SELECT 1 FROM entries WHERE module = ? AND path = ?",
+                (sneakersync.get_module_id(module), to_text(path))).fetchone():
+            raise Exception(
+                "No such entry in the catalog: {}".format(path or "."))
+    return rows
+
+def find(drive, pattern):
+    """Return the entries whose name (or path, if pattern contains a "/")
+    matches a glob pattern, as rows of module, path, mode, size, modification
+    time and hash.
+    """
+    
+    column = "path" if "/" in pattern else "name"
+    with connect(drive) as connection:
+        return connection.execute(
+            "SELECT module, path, mode, size, mtime, hash FROM entries "
+            "WHERE {} GLOB ? AND path != '' "
+            "ORDER BY module, path".format(column),
+            (pattern,)).fetchall()
+
+def diff(drive, configuration, module):
+    """Compare the entries of a module in the catalog with the local tree,
+    using the quick check of rsync (type, size and modification time), and
+    yield the paths which differ: ("+", path) for the entries which are
+    only in the local tree, ("-", path) for the entries which are only in
+    the catalog, and ("M", path) for the modified entries.
+    
+    Both sides are iterated in path order, so that they are not kept in
+    memory.
+    """
+    
+    root = sneakersync.get_module_root(module)
+    module_id = sneakersync.get_module_id(module)
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    
+    def get_local():
+        for entry in sneakersync.scan.walk(
+                root, filter_, "/".join(root.relative_to(root.anchor).parts)):
+            entry.path = to_text(entry.path)
+            yield entry
+    
+    with connect(drive) as connection, sneakersync.scan.Spill() as local:
+        if not connection.execute(
+                "SELECT 1 FROM modules WHERE module = ?",
+                (module_id,)).fetchone():
+            raise Exception("Module {} is not in the catalog".format(root))
+        local.extend(get_local())
+        
+        cursor = connection.execute(
+            "SELECT path, mode, size, mtime FROM entries WHERE module = ? "
+            "ORDER BY path", (module_id,))
+        local_entries = iter(local)
+        remote = next(cursor, None)
+        entry = next(local_entries, None)
+        while remote is not None or entry is not None:
+            if entry is None or (
+                    remote is not None and remote[0] < entry.path):
+                yield "-", remote[0]
+                remote = next(cursor, None)
+            elif remote is None or entry.path < remote[0]:
+                yield "+", entry.path
+                entry = next(local_entries, None)
+            else:
+                if is_modified(remote, entry):
+                    yield "M", entry.path
+                remote = next(cursor, None)
+                entry = next(local_entries, None)
+
+def is_modified(row, entry):
+    """Quick check of rsync between a row of the catalog and a local entry.
+    The modification time of directories is ignored, since it changes with
+    their content.
+    """
+    
+    _, mode, size, mtime = row
+    if stat.S_IFMT(mode) != stat.S_IFMT(entry.mode):
+        return True
+    if stat.S_ISDIR(mode):
+        return False
+    return size != entry.size or mtime//10**9 != entry.mtime//10**9
@@ -0,0 +1,231 @@
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import stat
+import struct
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+# NOTE: hashlib releases the GIL while hashing large buffers, files are hashed
+# by a pool of threads.
+algorithm = "blake2b"
+digest_size = 32
+chunk_size = 2**20
+
+class Checksums(object):
+    """Hash of each regular file of a module, computed from the source when
+    sending, along with the size and modification time of the file when it
+    was hashed. The checksums describe the drive content identified by
+    token.
+    """
+    
+    _magic = b"sneakersync-checksums-1\n"
+    _record = struct.Struct("<IQq{}s".format(digest_size))
+    
+    def __init__(self, path, token, entries):
+        self.path = path
+        self.token = token
+        # Path relative to the module root -> (size, mtime, digest)
+        self.entries = entries
+    
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with gzip.open(temporary, "wb") as fd:
+            fd.write(Checksums._magic)
+            header = {"algorithm": algorithm, "token": self.token}
+            fd.write(json.dumps(header).encode()+b"\n")
+            for path, entry in sorted(self.entries.items()):
+                path = os.fsencode(path)
+                fd.write(Checksums._record.pack(len(path), *entry))
+                fd.write(path)
+        os.replace(temporary, self.path)
+    
+    @staticmethod
+    def load(path):
+        """Load checksums, return None if they do not exist or are invalid."""
+        
+        if not path.is_file():
+            return None
+        
+        entries = {}
+        try:
+            with gzip.open(path, "rb") as fd:
+                if fd.readline() != Checksums._magic:
+                    return None
+                header = json.loads(fd.readline().decode())
+                if header["algorithm"] != algorithm:
+                    return None
+                record_size = Checksums._record.size
+                while True:
+                    record = fd.read(record_size)
+                    if not record:
+                        break
+                    length, *entry = Checksums._record.unpack(record)
+                    entries[os.fsdecode(fd.read(length))] = tuple(entry)
+        except (OSError, EOFError, ValueError, KeyError, struct.error):
+            sneakersync.logger.warning("Invalid checksums: {}".format(path))
+            return None
+        
+        return Checksums(path, header["token"], entries)
+
+def get_path(destination, module):
+    return (
+        destination / "sneakersync.checksums"
+        / sneakersync.get_module_id(module))
+
+def start(*args, **kwargs):
+    """Call compute in the background, so that the files are hashed while
+    they are transferred. Return a future; if the transfer fails, the
+    cancelled event of compute must be set and the future waited for.
+    """
+    
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    future = executor.submit(compute, *args, **kwargs)
+    executor.shutdown(wait=False)
+    return future
+
+def compute(
+        destination, configuration, module, previous_token, token,
+        files=None, digests=None, cancelled=None):
+    """Hash the files of a module and return the new checksums of the drive
+    content identified by token. If files is specified, only these paths
+    are hashed again, provided that the previous checksums describe the
+    drive content identified by previous_token. Files whose size and
+    modification time did not change keep their previous hash, as well as
+    the files in digests, which were hashed while they were copied. If the
+    cancelled event is set, the hashing stops with an exception.
+    """
+    
+    def check_cancelled():
+        if cancelled is not None and cancelled.is_set():
+            raise Exception(
+                "Checksums cancelled: {}".format(
+                    sneakersync.get_module_root(module)))
+    
+    source = sneakersync.get_module_root(module)
+    path = get_path(destination, module)
+    previous = Checksums.load(path)
+    previous_entries = previous.entries if previous is not None else {}
+    
+    if files is not None and (
+            previous is None or previous.token != previous_token):
+        files = None
+    
+    if files is None:
+        filter_ = sneakersync.filters.get_filter(
+            configuration["filters"]+module["filters"])
+        relative = "/".join(source.relative_to(source.anchor).parts)
+        stats = (
+            (x.path, x.get_manifest_entry())
+            for x in sneakersync.scan.walk(source, filter_, relative))
+        entries = {}
+    else:
+        stats = []
+        entries = dict(previous_entries)
+        for changed in files:
+            try:
+                stats.append(
+                    (changed, sneakersync.manifest.get_entry(
+                        os.lstat(source / changed))))
+            except FileNotFoundError:
+                # Forget the content of deleted directories
+                prefix = changed+"/"
+                for x in [x for x in entries if x.startswith(prefix)]:
+                    del entries[x]
+            entries.pop(changed, None)
+    
+    # NOTE: the content of hard-linked files is only hashed once
+    pending = {}
+    for relative_path, entry in stats:
+        check_cancelled()
+        if not stat.S_ISREG(entry[4]):
+            continue
+        previous_entry = previous_entries.get(relative_path)
+        if (
+                previous_entry is not None
+                and previous_entry[:2] == (entry[0], entry[1])):
+            entries[relative_path] = previous_entry
+        else:
+            pending.setdefault(entry[3], []).append((relative_path, entry))
+    
+    for inode, paths in list(pending.items()):
+        for relative_path, entry in paths:
+            digest = (digests or {}).get(relative_path)
+            if digest is not None and digest[:2] == (entry[0], entry[1]):
+                entries.update((x, (y[0], y[1], digest[2])) for x, y in paths)
+                del pending[inode]
+                break
+    
+    def hash_inode(paths):
+        check_cancelled()
+        relative_path, entry = paths[0]
+        digest = hash_file(source / relative_path)
+        return [(x, (y[0], y[1], digest)) for x, y in paths]
+    
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+        for result in executor.map(hash_inode, pending.values()):
+            entries.update(result)
+    
+    return Checksums(path, token, entries)
+
+def verify(root, checksums, compressed=False):
+    """Hash the files of a module in root (a copy on the drive, possibly
+    compressed, or a received module), and return the list of problems.
+    """
+    
+    def verify_entry(item):
+        relative_path, (size, mtime, digest) = item
+        path = root / relative_path
+        try:
+            path_stat = os.lstat(path)
+        except FileNotFoundError:
+            return "{}: missing".format(relative_path)
+        if compressed:
+            path_size = sneakersync.compression.get_size(path)
+        else:
+            path_size = path_stat.st_size
+        if (
+                not stat.S_ISREG(path_stat.st_mode) or path_size != size
+                or path_stat.st_mtime_ns//10**9 != mtime//10**9):
+            return "{}: modified since it was sent".format(relative_path)
+        try:
+            if hash_file(path, compressed) != digest:
+                return "{}: corrupted".format(relative_path)
+        except Exception as e:
+            # NOTE: corrupted compressed files may not be decompressed
+            return "{}: corrupted ({})".format(relative_path, e)
+        return None
+    
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+        problems = executor.map(
+            verify_entry, sorted(checksums.entries.items()))
+        return [x for x in problems if x is not None]
+
+def hash_file(path, compressed=False):
+    """Return the digest of a file. Compressed files are hashed as their
+    original content.
+    """
+    
+    hash_ = new_hash()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as fd:
+        reader = fd
+        if compressed:
+            method = sneakersync.compression.read_header(fd)[0]
+            if method == sneakersync.compression.ZSTD:
+                reader = sneakersync.compression.zstandard.ZstdDecompressor(
+                    ).stream_reader(fd)
+        while True:
+            size = reader.readinto(buffer)
+            if not size:
+                break
+            hash_.update(view[:size])
+    return hash_.digest()
+
+def new_hash():
+    return hashlib.blake2b(digest_size=digest_size)
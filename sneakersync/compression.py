@@ -0,0 +1,124 @@
+import collections
+import math
+import os
+import struct
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+sneakersync = sys.modules["sneakersync"]
+
+# Compressed files start with a header containing the compression method and
+# the original size. Other files are stored as-is.
+_header = struct.Struct("<8sBQ")
+_magic = b"\x89SNS\r\n\x1a\n"
+STORED, ZSTD = 0, 1
+
+# Files which are already compressed
+compressed_extensions = {
+    ".7z", ".apk", ".avi", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz",
+    ".heic", ".jar", ".jpeg", ".jpg", ".lz4", ".lzma", ".mkv", ".mov",
+    ".mp3", ".mp4", ".odp", ".ods", ".odt", ".ogg", ".png", ".pptx", ".rar",
+    ".tbz2", ".tgz", ".txz", ".webm", ".webp", ".xlsx", ".xz", ".zip", ".zst"
+}
+
+# Files smaller than this are not worth compressing
+minimum_size = 4096
+
+# Size of the sample used to estimate the entropy of a file
+sample_size = 2**16
+
+# Files whose sample has a higher entropy (in bits per byte) are stored
+maximum_entropy = 7.5
+
+# Files at least this large are compressed using several threads
+threaded_size = 2**23
+
+def check(method):
+    """Check that a compression method is valid and available."""
+    
+    if method not in ["none", "zstd"]:
+        raise Exception("Invalid compression: {}".format(method))
+    if method == "zstd" and zstandard is None:
+        raise Exception(
+            "The zstandard package is required for zstd compression")
+
+def get_entropy(data):
+    """Return the entropy of data, in bits per byte."""
+    
+    if not data:
+        return 0
+    return -sum(
+        x/len(data)*math.log2(x/len(data))
+        for x in collections.Counter(data).values())
+
+def is_compressible(path, sample):
+    """Test whether a file should be compressed, given its beginning."""
+    
+    suffix = os.path.splitext(path)[1].lower()
+    return (
+        suffix not in compressed_extensions
+        and len(sample) >= minimum_size
+        and get_entropy(sample) <= maximum_entropy)
+
+def compress(path, source_fd, target_fd, size):
+    """Copy the content of source_fd to target_fd (unbuffered file objects),
+    compressed if it is worth it. Return the number of bytes written.
+    """
+    
+    sample = source_fd.read(sample_size)
+    source_fd.seek(0)
+    if is_compressible(path, sample):
+        target_fd.write(_header.pack(_magic, ZSTD, size))
+        compressor = zstandard.ZstdCompressor(
+            threads=-1 if size >= threaded_size else 0)
+        compressor.copy_stream(source_fd, target_fd, size=size)
+    elif sample.startswith(_magic):
+        # NOTE: a file starting like a header must not be stored as-is
+        target_fd.write(_header.pack(_magic, STORED, size))
+        sneakersync.native.copy_contents(
+            source_fd.fileno(), target_fd.fileno())
+    else:
+        sneakersync.native.copy_contents(
+            source_fd.fileno(), target_fd.fileno())
+    return target_fd.tell()
+
+def decompress(source_fd, target_fd):
+    """Copy the content of source_fd to target_fd (unbuffered file objects),
+    decompressing it if needed. Return the original size.
+    """
+    
+    method = read_header(source_fd)[0]
+    if method == ZSTD:
+        zstandard.ZstdDecompressor().copy_stream(source_fd, target_fd)
+    else:
+        sneakersync.native.copy_contents(
+            source_fd.fileno(), target_fd.fileno())
+    return target_fd.tell()
+
+def read_header(fd):
+    """Return the method and original size of a stored file, and leave fd at
+    the beginning of its content. Files stored as-is have no method.
+    """
+    
+    header = fd.read(_header.size)
+    if len(header) == _header.size and header.startswith(_magic):
+        return _header.unpack(header)[1:]
+    fd.seek(0, os.SEEK_END)
+    size = fd.tell()
+    fd.seek(0)
+    return None, size
+
+def get_size(path):
+    """Return the original size of a stored file, or None if it does not
+    exist.
+    """
+    
+    try:
+        with open(path, "rb", buffering=0) as fd:
+            return read_header(fd)[1]
+    except (FileNotFoundError, IsADirectoryError):
+        return None
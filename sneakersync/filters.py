@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+class Filter(object):
+    """Include/exclude rules, matched with the semantics of rsync: the first
+    matching rule wins, "*" does not match "/" while "**" does, a leading "/"
+    anchors the pattern to the root of the transfer and a trailing "/" only
+    matches directories.
+    
+    All rules are compiled in a single regular expression, so that the cost
+    of matching a path does not grow with the number of rules as fast as
+    when testing them one by one.
+    """
+    
+    def __init__(self, filters):
+        # (pattern, included, directory_only)
+        self.rules = []
+        for filter_ in filters:
+            if len(filter_) > 1:
+                raise Exception(
+                    "Filter must contain only one entry: {}".format(filter_))
+            if "exclude" in filter_:
+                included, pattern = False, filter_["exclude"]
+            elif "include" in filter_:
+                included, pattern = True, filter_["include"]
+            else:
+                raise Exception(
+                    "Filter must contain include or exclude: {}".format(
+                        filter_))
+            if "\n" in pattern or "\r" in pattern:
+                raise Exception(
+                    "Filter must not contain line breaks: {!r}".format(
+                        pattern))
+            self.rules.append((pattern, included, pattern.endswith("/")))
+        
+        # NOTE: all alternatives are anchored at the start of the path, so
+        # that the first matching alternative is the first matching rule.
+        self._regexes = {}
+        for is_directory in [False, True]:
+            alternatives = []
+            for index, (pattern, _, directory_only) in enumerate(self.rules):
+                if directory_only and not is_directory:
+                    continue
+                pattern = pattern.rstrip("/")
+                if pattern.startswith("/"):
+                    prefix = ""
+                    pattern = pattern[1:]
+                else:
+                    prefix = "(?:.*/)?"
+                alternatives.append("(?P<r{}>{}{})".format(
+                    index, prefix, Filter._translate(pattern)))
+            self._regexes[is_directory] = (
+                re.compile("(?s:{})".format("|".join(alternatives)))
+                if alternatives else None)
+    
+    def excluded(self, path, is_directory):
+        """Test whether path, relative to the root of the transfer, is
+        excluded. When a directory is excluded, its content does not need to
+        be scanned.
+        """
+        
+        regex = self._regexes[is_directory]
+        if regex is None:
+            return False
+        match = regex.fullmatch(path)
+        if match is None:
+            return False
+        return not self.rules[int(match.lastgroup[1:])][1]
+    
+    def to_rsync(self):
+        """Return the rules in the format of rsync merge files."""
+        
+        return "".join(
+            "{} {}\n".format("+" if included else "-", pattern)
+            for pattern, included, _ in self.rules)
+    
+    @staticmethod
+    def _translate(pattern):
+        """Translate an rsync wildcard pattern to a regular expression."""
+        
+        result = []
+        index = 0
+        while index < len(pattern):
+            character = pattern[index]
+            if pattern.startswith("**", index):
+                result.append(".*")
+                index += 2
+                continue
+            elif character == "*":
+                result.append("[^/]*")
+            elif character == "?":
+                result.append("[^/]")
+            elif character == "[":
+                end = pattern.find("]", index+2)
+                if end == -1:
+                    result.append(re.escape(character))
+                else:
+                    class_ = pattern[index+1:end]
+                    if class_.startswith("!"):
+                        class_ = "^"+class_[1:]
+                    result.append("["+class_.replace("\\", "\\\\")+"]")
+                    index = end
+            else:
+                result.append(re.escape(character))
+            index += 1
+        return "".join(result)
+
+# Filters and merge files compiled during this run
+_cache = {}
+_merge_files = {}
+_directory = None
+_lock = threading.Lock()
+
+def get_filter(filters):
+    """Return the Filter object of the given rules, compiling it only once
+    per run.
+    """
+    
+    key = repr(filters)
+    with _lock:
+        filter_ = _cache.get(key)
+    if filter_ is None:
+        filter_ = Filter(filters)
+        with _lock:
+            _cache[key] = filter_
+    return filter_
+
+def get_merge_file(filters):
+    """Return the path to an rsync merge file containing the given rules,
+    writing it only once per run. Return None if there are no rules.
+    """
+    
+    global _directory
+    
+    content = os.fsencode(get_filter(filters).to_rsync())
+    if not content:
+        return None
+    
+    key = hashlib.sha1(content).hexdigest()
+    with _lock:
+        if key not in _merge_files:
+            if _directory is None:
+                # NOTE: the directory is removed when the interpreter exits
+                _directory = tempfile.TemporaryDirectory(
+                    prefix="sneakersync-")
+            path = "{}/{}.rules".format(_directory.name, key)
+            with open(path, "wb") as fd:
+                fd.write(content)
+            _merge_files[key] = path
+        return _merge_files[key]
@@ -0,0 +1,91 @@
+import gzip
+import os
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+# In mirror mode, each send of a module increments its generation, and the
+# paths it changed are stored on the drive. The state records the generation
+# of each module that each host last sent or received, so that a receive only
+# applies the changes of the generations the host has not seen yet.
+
+def get_directory(drive, module):
+    return drive / "sneakersync.changes" / sneakersync.get_module_id(module)
+
+def save_changes(drive, module, generation, paths):
+    """Store the paths which changed in a generation of a module, relative to
+    its root. None means that the whole module was sent.
+    """
+    
+    path = get_directory(drive, module) / "{:08d}".format(generation)
+    if paths is None:
+        if path.exists():
+            path.unlink()
+        return
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    with gzip.open(temporary, "wb") as fd:
+        for entry in sorted(paths):
+            fd.write(os.fsencode(entry)+b"\0")
+    os.replace(temporary, path)
+
+def load_changes(drive, module, generation):
+    """Return the paths which changed in a generation of a module, or None if
+    they are unknown.
+    """
+    
+    path = get_directory(drive, module) / "{:08d}".format(generation)
+    try:
+        with gzip.open(path, "rb") as fd:
+            return set(os.fsdecode(x) for x in fd.read().split(b"\0") if x)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError):
+        sneakersync.logger.warning("Invalid list of changes: {}".format(path))
+        return None
+
+def get_changes(drive, module, state, host):
+    """Return the paths of a module which changed since host last sent or
+    received it, an empty set if host is up to date, or None if the whole
+    module must be received.
+    """
+    
+    module_id = sneakersync.get_module_id(module)
+    current = state.module_generations.get(module_id)
+    previous = state.vectors.get(host, {}).get(module_id)
+    if current is None or previous is None or previous > current:
+        return None
+    
+    changes = set()
+    for generation in range(previous+1, current+1):
+        paths = load_changes(drive, module, generation)
+        if paths is None:
+            return None
+        changes.update(paths)
+    return changes
+
+def prune(drive, module, state):
+    """Remove the changes which are not needed anymore: those which were
+    received by all hosts, and those older than a send of the whole module.
+    """
+    
+    directory = get_directory(drive, module)
+    if not directory.is_dir():
+        return
+    
+    module_id = sneakersync.get_module_id(module)
+    stored = set(int(x.name) for x in directory.iterdir() if x.name.isdigit())
+    current = state.module_generations.get(module_id, 0)
+    received = [
+        x[module_id] for x in state.vectors.values() if module_id in x]
+    
+    floor = min(received, default=current)
+    for generation in range(current, floor, -1):
+        if generation not in stored:
+            floor = generation
+            break
+    
+    for generation in stored:
+        if generation <= floor:
+            (directory / "{:08d}".format(generation)).unlink()
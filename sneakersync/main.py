@@ -12,7 +12,9 @@ def main():
         "--verbosity", "-v",
         choices=["error", "warning", "info", "debug"], default="warning")
     
-    backend = sneakersync.rsync
+    parser.add_argument(
+        "--backend", choices=["rsync", "native"], default="rsync",
+        help="Transfer backend (default: rsync)")
     
     # NOTE: display progress by default
     progress_group = parser.add_mutually_exclusive_group()
@@ -23,21 +25,103 @@ def main():
         "--no-progress", dest="progress", action="store_false", 
         help="Display progress bar (see --progress)")
     
+    parser.add_argument(
+        "--jobs", "-j", type=get_jobs, 
+        help="Number of modules processed in parallel "
+            "(default: value from configuration, or 1)")
+    
     subparsers = parser.add_subparsers(help="Sub-commands help")
     
     send_parser = subparsers.add_parser(
         "send", help="Send data on the sneakernet",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    send_parser.add_argument(
+        "--metrics-json", type=pathlib.Path, metavar="PATH",
+        help="Write the metrics of the transfer to this JSON file")
     send_parser.add_argument("destination", type=pathlib.Path)
-    send_parser.set_defaults(
-        function=lambda destination, progress: sneakersync.operations.send(destination, progress, backend))
+    send_parser.add_argument(
+        "volumes", type=pathlib.Path, nargs="*",
+        help="Other drives: the modules are spread over all drives")
+    send_parser.set_defaults(function=sneakersync.operations.send)
     
     receive_parser = subparsers.add_parser(
         "receive", help="Receive data from the sneakernet",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    receive_parser.add_argument(
+        "--verify", action="store_true",
+        help="Check the received files against the checksums of the sender")
+    receive_parser.add_argument(
+        "--metrics-json", type=pathlib.Path, metavar="PATH",
+        help="Write the metrics of the transfer to this JSON file")
     receive_parser.add_argument("source", type=pathlib.Path)
-    receive_parser.set_defaults(
-        function=lambda source, progress: sneakersync.operations.receive(source, progress, backend))
+    receive_parser.set_defaults(function=sneakersync.operations.receive)
+    
+    verify_parser = subparsers.add_parser(
+        "verify", 
+        help="Check the files on the drive against the checksums of the "
+            "sender",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    verify_parser.add_argument("source", type=pathlib.Path)
+    verify_parser.set_defaults(function=sneakersync.operations.verify)
+    
+    plan_parser = subparsers.add_parser(
+        "plan", 
+        help="Print what would be sent on the sneakernet, and whether it fits "
+            "on the drive",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    plan_parser.add_argument("destination", type=pathlib.Path)
+    plan_parser.add_argument(
+        "volumes", type=pathlib.Path, nargs="*",
+        help="Other drives: print how the modules are spread over all drives")
+    plan_parser.set_defaults(function=sneakersync.operations.plan)
+    
+    stats_parser = subparsers.add_parser(
+        "stats", 
+        help="Print the trends of the transfers recorded on the drive",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    stats_parser.add_argument("source", type=pathlib.Path)
+    stats_parser.set_defaults(function=sneakersync.operations.stats)
+    
+    ls_parser = subparsers.add_parser(
+        "ls", 
+        help="List the modules in the catalog of the drive, or the content "
+            "of one of their directories",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ls_parser.add_argument("source", type=pathlib.Path)
+    ls_parser.add_argument(
+        "path", nargs="?", help="Local path of a directory of a module")
+    ls_parser.set_defaults(function=sneakersync.operations.ls)
+    
+    find_parser = subparsers.add_parser(
+        "find", 
+        help="Find the files in the catalog of the drive whose name matches "
+            "a pattern",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    find_parser.add_argument("source", type=pathlib.Path)
+    find_parser.add_argument(
+        "pattern",
+        help="Glob pattern, matched against the paths if it contains a \"/\"")
+    find_parser.set_defaults(function=sneakersync.operations.find)
+    
+    diff_parser = subparsers.add_parser(
+        "diff", 
+        help="Print the differences between the catalog of the drive and the "
+            "local modules",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    diff_parser.add_argument("source", type=pathlib.Path)
+    diff_parser.add_argument(
+        "path", nargs="?", help="Only compare the module containing this path")
+    diff_parser.set_defaults(function=sneakersync.operations.diff)
+    
+    watch_parser = subparsers.add_parser(
+        "watch", 
+        help="Record the changes of the modules, so that the next send only "
+            "transfers them",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    watch_parser.add_argument(
+        "configuration", type=pathlib.Path,
+        help="Configuration file, or directory containing sneakersync.cfg")
+    watch_parser.set_defaults(function=sneakersync.operations.watch)
     
     arguments = vars(parser.parse_args())
     
@@ -49,9 +133,20 @@ def main():
     if "function" not in arguments:
         parser.error("No action specified")    
     function = arguments.pop("function")
+    arguments["backend"] = getattr(sneakersync, arguments["backend"])
+    
+    # On a terminal, display a progress bar, and the transferred files only
+    # in verbose mode. Otherwise, display the transferred files.
+    progress_bar = None
+    if arguments["progress"] and sys.stderr.isatty():
+        progress_bar = sneakersync.progress.ProgressBar()
+        arguments["progress"] = (verbosity in ["info", "debug"])
+    arguments["callback"] = progress_bar
     
     try:
         function(**arguments)
+        if progress_bar is not None:
+            progress_bar.close()
     except sneakersync.Exception as e:
         sneakersync.logger.error(
             "Could not {} module {}: \n{}".format(
@@ -65,5 +160,16 @@ def main():
     
     return 0
 
+def get_jobs(value):
+    """Parse the number of jobs of the command line."""
+    
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number: {}".format(value))
+    if jobs < 1:
+        raise argparse.ArgumentTypeError("must be positive: {}".format(jobs))
+    return jobs
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,228 @@
+import collections
+import gzip
+import hashlib
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+class Manifest(object):
+    """Size, modification time, change time, inode and mode of each entry of
+    a module, at the time of the last send.
+    """
+    
+    _magic = b"sneakersync-manifest-1\n"
+    _record = struct.Struct("<IqqqQI")
+    
+    def __init__(self, path, host, checksum, entries):
+        self.path = path
+        self.host = host
+        self.checksum = checksum
+        # Path relative to the module root -> (size, mtime, ctime, inode, mode)
+        self.entries = entries
+    
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with gzip.open(temporary, "wb") as fd:
+            fd.write(Manifest._magic)
+            header = {"host": self.host, "checksum": self.checksum}
+            fd.write(json.dumps(header).encode()+b"\n")
+            for path, entry in sorted(self.entries.items()):
+                path = os.fsencode(path)
+                fd.write(Manifest._record.pack(len(path), *entry))
+                fd.write(path)
+        os.replace(temporary, self.path)
+    
+    @staticmethod
+    def load(path):
+        """Load a manifest, return None if it does not exist or is invalid."""
+        
+        if not path.is_file():
+            return None
+        
+        entries = {}
+        try:
+            with gzip.open(path, "rb") as fd:
+                if fd.readline() != Manifest._magic:
+                    return None
+                header = json.loads(fd.readline().decode())
+                record_size = Manifest._record.size
+                while True:
+                    record = fd.read(record_size)
+                    if not record:
+                        break
+                    length, *entry = Manifest._record.unpack(record)
+                    entries[os.fsdecode(fd.read(length))] = tuple(entry)
+        except (OSError, EOFError, ValueError, struct.error):
+            sneakersync.logger.warning("Invalid manifest: {}".format(path))
+            return None
+        
+        return Manifest(path, header["host"], header["checksum"], entries)
+    
+    def get_children(self):
+        """Return the names of the entries of each directory."""
+        
+        children = collections.defaultdict(list)
+        for path in self.entries:
+            if path:
+                parent, _, name = path.rpartition("/")
+                children[parent].append(name)
+        return children
+
+def get_path(destination, module, host=None):
+    """Path to the manifest of a module. In incremental mode, each host has
+    its own manifest.
+    """
+    
+    name = sneakersync.get_module_id(module)
+    if host is not None:
+        name = "{}.{}".format(name, host)
+    return destination / "sneakersync.manifests" / name
+
+def get_checksum(configuration, module):
+    """Checksum of the configuration items which affect the manifest."""
+    
+    data = [
+        str(sneakersync.get_module_root(module)),
+        configuration["filters"], module["filters"]]
+    # NOTE: the compression is only included when enabled, so that the
+    # checksums of existing manifests are not modified.
+    if module["compression"] != "none":
+        data.append(module["compression"])
+    return hashlib.sha1(repr(data).encode()).hexdigest()
+
+def prepare(destination, configuration, module, state, invalidate=True):
+    """Scan the module and return its new manifest and the paths which changed
+    since the previous send from this host (or None if the whole module must
+    be transferred). The manifest must be saved once the transfer is done.
+    If invalidate is False, the previous manifest of the mirror mode is kept
+    on the drive: it must be removed before the transfer.
+    """
+    
+    host = socket.gethostname()
+    checksum = get_checksum(configuration, module)
+    incremental = (configuration["mode"] == "incremental")
+    path = get_path(destination, module, host if incremental else None)
+    
+    # In mirror mode, the previous manifest only describes the content of the
+    # drive if the last send was done from this host. In both modes, the
+    # configuration must not have changed.
+    previous = Manifest.load(path)
+    if previous is not None and (
+            previous.host != host or previous.checksum != checksum
+            or (not incremental and state.previous_host != host)):
+        previous = None
+    
+    # Until the transfer is finished, the mirror does not match any manifest
+    if invalidate and not incremental and path.exists():
+        path.unlink()
+    
+    source = sneakersync.get_module_root(module)
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    entries = scan(
+        source, filter_, "/".join(source.relative_to(source.anchor).parts),
+        previous)
+    
+    manifest = Manifest(path, host, checksum, entries)
+    if previous is None:
+        return manifest, None
+    else:
+        return manifest, get_changes(previous.entries, entries)
+
+def scan(source, filter_, relative, previous=None):
+    """Return the entries of the source directory. Directories which were not
+    modified since the previous manifest are not listed again: their
+    entries are taken from the manifest, only their status is updated.
+    The relative path of source from the root of the transfer is used to
+    match the filters.
+    """
+    
+    entries = {}
+    previous_entries = previous.entries if previous is not None else {}
+    previous_children = previous.get_children() if previous is not None else {}
+    
+    directories = [""]
+    while directories:
+        directory = directories.pop()
+        directory_path = os.path.join(source, directory)
+        try:
+            directory_stat = os.lstat(directory_path)
+        except FileNotFoundError:
+            continue
+        entries[directory] = get_entry(directory_stat)
+        
+        # NOTE: adding, removing or renaming an entry updates the
+        # modification time of the directory.
+        previous_entry = previous_entries.get(directory)
+        if (
+                previous_entry is not None
+                and previous_entry[1] == directory_stat.st_mtime_ns
+                and previous_entry[3] == directory_stat.st_ino):
+            names = previous_children.get(directory, [])
+        else:
+            names = []
+            try:
+                iterator = os.scandir(directory_path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with iterator:
+                for entry in iterator:
+                    path = "/".join(
+                        x for x in [relative, directory, entry.name] if x)
+                    if not filter_.excluded(
+                            path, entry.is_dir(follow_symlinks=False)):
+                        names.append(entry.name)
+        
+        for name in names:
+            path = "{}/{}".format(directory, name) if directory else name
+            try:
+                entry_stat = os.lstat(os.path.join(source, path))
+            except FileNotFoundError:
+                continue
+            entries[path] = get_entry(entry_stat)
+            if stat.S_ISDIR(entry_stat.st_mode):
+                directories.append(path)
+    
+    return entries
+
+def get_entry(stat_):
+    return (
+        stat_.st_size, stat_.st_mtime_ns, stat_.st_ctime_ns, stat_.st_ino,
+        stat_.st_mode)
+
+def get_changes(previous, current):
+    """Return the paths which were added, modified or deleted."""
+    
+    changes = set(x for x, y in current.items() if previous.get(x) != y)
+    changes.update(x for x in previous if x not in current)
+    
+    # Keep hard-linked files together, so that their links are preserved.
+    links = collections.defaultdict(list)
+    for path, entry in current.items():
+        if stat.S_ISREG(entry[4]):
+            links[entry[3]].append(path)
+    for path in list(changes):
+        entry = current.get(path)
+        if entry is not None and len(links.get(entry[3], [])) > 1:
+            changes.update(links[entry[3]])
+    
+    add_parents(changes)
+    return changes
+
+def add_parents(changes):
+    """Add the parents of all changed entries, so that their modification
+    times are restored after the transfer.
+    """
+    
+    for path in list(changes):
+        while path:
+            path = path.rpartition("/")[0]
+            if path in changes:
+                break
+            changes.add(path)
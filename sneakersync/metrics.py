@@ -0,0 +1,222 @@
+import collections
+import datetime
+import functools
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+
+sneakersync = sys.modules["sneakersync"]
+
+# Number of records kept in the history
+history_size = 10000
+
+# Number of previous runs to which a run is compared, and minimal number of
+# previous runs to flag a regression.
+window = 10
+minimum_runs = 3
+
+# A run is flagged if its throughput is lower than this fraction of the
+# median of the previous runs, or if it transferred more than this factor of
+# their median size. Transfers smaller than minimum_size do not give a
+# meaningful throughput.
+slow_ratio = 0.7
+growth_ratio = 1.5
+minimum_size = 2**26
+
+class Recorder(object):
+    """Collect the metrics of the modules of a run from their progress
+    events, and forward these events to callback. The statistics of the last
+    event use the names of the fields of "rsync --stats".
+    """
+    
+    def __init__(self, action, callback=None):
+        self.action = action
+        self.callback = callback
+        self.host = socket.gethostname()
+        self.date = datetime.datetime.now().isoformat(" ", "seconds")
+        self.records = []
+        
+        self._events = {}
+        self._lock = threading.Lock()
+    
+    def __call__(self, module, event):
+        with self._lock:
+            self._events[sneakersync.get_module_id(module)] = event
+        if self.callback is not None:
+            self.callback(module, event)
+    
+    def get_callback(self, module):
+        return functools.partial(self, module)
+    
+    def add(self, module, duration):
+        """Record the transfer of a module, which took duration seconds."""
+        
+        module_id = sneakersync.get_module_id(module)
+        with self._lock:
+            event = self._events.pop(module_id, None)
+        
+        statistics_ = {}
+        size, files = 0, 0
+        if event is not None:
+            statistics_ = event.statistics or {}
+            size = event.bytes_done
+            files = event.files_done or 0
+        scanned = statistics_.get("Number of files")
+        
+        record = {
+            "date": self.date, "host": self.host, "action": self.action,
+            "module": module_id,
+            "root": str(sneakersync.get_module_root(module)),
+            "duration": round(duration, 3), "bytes": size, "files": files,
+            "scanned": int(scanned) if scanned is not None else None,
+            "rate": round(size/duration) if duration > 0 else None,
+            "statistics": statistics_}
+        with self._lock:
+            self.records.append(record)
+    
+    def save(self, drive, path=None):
+        """Append the records to the history on the drive and, if path is
+        specified, write them as JSON to path.
+        """
+        
+        if not self.records:
+            return
+        
+        append(drive, self.records)
+        if path is not None:
+            self.write(path)
+    
+    def write(self, path):
+        """Write the records as JSON to path."""
+        
+        data = {
+            "date": self.date, "host": self.host, "action": self.action,
+            "modules": self.records}
+        with open(path, "w") as fd:
+            json.dump(data, fd, indent=2)
+            fd.write("\n")
+
+def get_path(drive):
+    return drive / "sneakersync.metrics"
+
+def append(drive, records):
+    """Append records to the history, one JSON object per line, and drop the
+    oldest records when the history is twice as large as history_size.
+    """
+    
+    path = get_path(drive)
+    with path.open("a+") as fd:
+        # NOTE: do not append to a record truncated by an interrupted run
+        if fd.tell() > 0:
+            fd.seek(fd.tell()-1)
+            if fd.read(1) != "\n":
+                fd.write("\n")
+        for record in records:
+            fd.write(json.dumps(record, separators=(",", ":"))+"\n")
+    
+    history = load(drive)
+    if len(history) > 2*history_size:
+        temporary = path.with_suffix(".tmp")
+        with temporary.open("w") as fd:
+            for record in history[-history_size:]:
+                fd.write(json.dumps(record, separators=(",", ":"))+"\n")
+        os.replace(temporary, path)
+
+def load(drive):
+    """Return the records of the history, oldest first."""
+    
+    path = get_path(drive)
+    if not path.is_file():
+        return []
+    
+    records = []
+    with path.open() as fd:
+        for line in fd:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # NOTE: the last line is truncated if a run was interrupted
+                sneakersync.logger.warning(
+                    "Invalid metrics record in {}".format(path))
+    return records
+
+def get_regressions(record, previous):
+    """Return the problems of a record compared to the previous records of
+    the same module and action.
+    """
+    
+    previous = previous[-window:]
+    if len(previous) < minimum_runs:
+        return []
+    
+    problems = []
+    sizes = [x["bytes"] for x in previous]
+    median_size = statistics.median(sizes)
+    if median_size and record["bytes"] > growth_ratio*median_size:
+        problems.append(
+            "transferred {:.1f} times the usual size".format(
+                record["bytes"]/median_size))
+    
+    rates = [
+        x["rate"] for x in previous
+        if x["rate"] is not None and x["bytes"] >= minimum_size]
+    if (
+            len(rates) >= minimum_runs and record["rate"] is not None
+            and record["bytes"] >= minimum_size):
+        median_rate = statistics.median(rates)
+        if record["rate"] < slow_ratio*median_rate:
+            problems.append(
+                "throughput {:.0%} lower than usual".format(
+                    1-record["rate"]/median_rate))
+    return problems
+
+def describe(record):
+    """Return a human-readable summary of a record."""
+    
+    format_size = sneakersync.progress.format_size
+    text = "{}, {} in {} files".format(
+        sneakersync.progress.format_duration(record["duration"]),
+        format_size(record["bytes"]), record["files"])
+    if record["scanned"] is not None:
+        text += " ({} scanned)".format(record["scanned"])
+    if record["rate"] is not None:
+        text += ", {}/s".format(format_size(record["rate"]))
+    return text
+
+def report(history):
+    """Return a human-readable report of the trends of each module and action
+    in the history.
+    """
+    
+    format_size = sneakersync.progress.format_size
+    groups = collections.OrderedDict()
+    for record in history:
+        groups.setdefault(
+            (record["module"], record["action"]), []).append(record)
+    
+    lines = []
+    for records in groups.values():
+        last = records[-1]
+        previous = records[:-1][-window:]
+        lines.append(
+            "{} ({}, {} runs)".format(
+                last["root"], last["action"], len(records)))
+        lines.append(
+            "  Last run: {} on {}: {}".format(
+                last["date"], last["host"], describe(last)))
+        if previous:
+            text = "  Median of the {} previous runs: {}, {}".format(
+                len(previous),
+                sneakersync.progress.format_duration(
+                    statistics.median(x["duration"] for x in previous)),
+                format_size(statistics.median(x["bytes"] for x in previous)))
+            rates = [x["rate"] for x in previous if x["rate"] is not None]
+            if rates:
+                text += ", {}/s".format(format_size(statistics.median(rates)))
+            lines.append(text)
+        for problem in get_regressions(last, previous):
+            lines.append("  WARNING: {}".format(problem))
+    return "\n".join(lines)+"\n" if lines else ""
@@ -0,0 +1,799 @@
+import concurrent.futures
+import errno
+import hashlib
+import logging
+import os
+import pathlib
+import stat
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+def send(
+        destination, configuration, module, state, progress=False, files=None,
+        callback=None, digests=None):
+    source = sneakersync.get_module_root(module)
+    if not source.is_dir():
+        raise Exception("No such directory: {}".format(source))
+    
+    # NOTE: same layout as "rsync --relative": the full path of the module
+    # root is kept on the destination.
+    relative_source = source.relative_to(source.anchor)
+    target = destination / relative_source
+    
+    # NOTE: compressed files do not need holes
+    extent_map = None
+    if module["compression"] == "none":
+        extent_map = sneakersync.sparse.ExtentMap.load(
+            sneakersync.sparse.get_path(destination, module))
+    
+    transfer = Transfer(
+        configuration["filters"]+module["filters"], "send", module, progress,
+        callback=callback, compression=module["compression"],
+        profile=sneakersync.profiles.get_profile(
+            configuration, module, source),
+        extent_map=extent_map, digests=digests)
+    
+    # Create the implied directories, and set their attributes once their
+    # content has been transferred.
+    parents = [x for x in reversed(relative_source.parents) if x.parts]
+    for parent in parents:
+        transfer.copy_directory_entry(
+            source.anchor / parent, destination / parent)
+    try:
+        transfer.run(source, target, "/".join(relative_source.parts), files)
+    finally:
+        if extent_map is not None:
+            extent_map.save(target)
+    for parent in reversed(parents):
+        copy_metadata(source.anchor / parent, destination / parent)
+
+def receive(
+        source, configuration, module, state, progress=False, delete=True,
+        callback=None, files=None, profile=None):
+    drive = source
+    remote_root = sneakersync.get_module_root(module, state.previous_host)
+    source = source / remote_root.relative_to(remote_root.anchor)
+    if not source.is_dir():
+        raise Exception("No such directory: {}".format(source))
+    
+    target = sneakersync.get_module_root(module)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    
+    if profile is None:
+        profile = sneakersync.profiles.get_profile(
+            configuration, module, source)
+    transfer = Transfer(
+        configuration["filters"]+module["filters"], "receive", module,
+        progress, delete, callback, module["compression"], profile,
+        sneakersync.sparse.ExtentMap.load(
+            sneakersync.sparse.get_path(drive, module)))
+    transfer.run(source, target, "", files)
+
+class Transfer(object):
+    """In-process equivalent of
+    "rsync --archive --acls --hard-links --xattrs --delete".
+    
+    With compression, files are compressed when sending and decompressed
+    when receiving, using a pool of workers. The workers of a directory are
+    waited for before its attributes are set.
+    
+    Files are always copied whole, through a temporary file; the profile
+    only sets the preallocation, the handling of sparse files and when
+    extraneous entries are deleted. Only the data of sparse files is copied:
+    their extents are recorded in the extent map when sending, and read from
+    it when receiving.
+    
+    With the "physical" order of the profile, regular files are queued
+    instead of being copied as they are found, then copied in the order of
+    their data on the source disk: large files first, then batches of small
+    files, which are read before being written. Compressed modules are
+    always copied in directory order.
+    
+    If digests is specified, the uncompressed files which are copied whole
+    are hashed while they are copied: their size, modification time and
+    digest are recorded in digests, by path relative to the source.
+    """
+    
+    def __init__(
+            self, filters, action, module, progress, delete=True,
+            callback=None, compression="none", profile=None,
+            extent_map=None, digests=None):
+        self.filter = sneakersync.filters.get_filter(filters)
+        self.action = action
+        self.module = module
+        self.progress = progress
+        self.delete = delete
+        self.profile = profile or sneakersync.profiles.profiles["default"]
+        self.extent_map = extent_map
+        self.digests = digests
+        self.source_root = None
+        self.tracker = sneakersync.progress.Tracker(callback)
+        # Number of entries visited, including the root
+        self.scanned = 0
+        
+        # Target path of already-copied hard links, by source inode
+        self.links = {}
+        self.errors = []
+        
+        self.compression = compression
+        self.executor = None
+        if compression != "none":
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                os.cpu_count())
+        # Pending copies, in submission order and by target
+        self.futures = []
+        self.pending = {}
+        
+        # Queued regular files, hard links to queued files and directories
+        # whose attributes must be set once the queue is flushed.
+        self.queue = None
+        if self.profile.order == "physical" and self.executor is None:
+            self.queue = []
+        self.queued = set()
+        self.deferred_links = []
+        self.directories = []
+    
+    def run(self, source, target, relative, files=None):
+        """Copy the source directory to target. If files is specified, only
+        these paths (relative to source) are copied, or deleted from target
+        if they are missing from source and deleting is enabled.
+        """
+        
+        self.source_root = source
+        self.scanned = 1
+        try:
+            self.copy_directory_entry(source, target)
+            if files is None:
+                self.copy_tree(source, target, relative)
+            else:
+                self.copy_files(source, target, relative, files)
+            self.flush()
+            self.wait()
+            for source_path, target_path, source_stat in reversed(
+                    self.directories):
+                try:
+                    copy_metadata(source_path, target_path, source_stat)
+                except OSError as e:
+                    self.errors.append("{}: {}".format(target_path, e))
+            copy_metadata(source, target)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+        
+        if self.errors:
+            raise sneakersync.Exception(
+                self.action, self.module, "\n".join(self.errors))
+        self.tracker.finish(self.scanned)
+    
+    def copy_tree(self, source, target, relative):
+        """Recursively copy the content of the source directory."""
+        
+        start = len(self.futures)
+        entries = []
+        for entry in sorted(os.scandir(source), key=lambda x: x.name):
+            path = "{}/{}".format(relative, entry.name).lstrip("/")
+            is_directory = entry.is_dir(follow_symlinks=False)
+            if (
+                    self.filter.excluded(path, is_directory)
+                    or entry.name == partial_directory):
+                continue
+            entries.append((entry, path))
+        names = set(entry.name for entry, _ in entries)
+        self.scanned += len(entries)
+        
+        # NOTE: deleting first frees space on the target
+        delete_before = (self.delete and self.profile.delete == "before")
+        if delete_before:
+            self.delete_extraneous(target, relative, names)
+        
+        for entry, path in entries:
+            try:
+                self.copy_entry(
+                    entry.path, target / entry.name, path,
+                    entry.stat(follow_symlinks=False))
+            except OSError as e:
+                self.errors.append("{}: {}".format(path, e))
+        
+        self.wait(start)
+        if self.delete and not delete_before:
+            self.delete_extraneous(target, relative, names)
+    
+    def copy_files(self, source, target, relative, files):
+        """Copy the given paths, without recursing in directories."""
+        
+        directories = []
+        for path in sorted(files):
+            transfer_path = "{}/{}".format(relative, path).lstrip("/")
+            source_path = source / path
+            target_path = target / path
+            try:
+                try:
+                    source_stat = os.lstat(source_path)
+                except FileNotFoundError:
+                    if self.delete and os.path.lexists(target_path):
+                        remove(target_path)
+                        self.report("deleting {}".format(transfer_path))
+                    continue
+                
+                self.scanned += 1
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                if stat.S_ISDIR(source_stat.st_mode):
+                    self.copy_directory_entry(source_path, target_path)
+                    directories.append((source_path, target_path))
+                else:
+                    self.copy_entry(
+                        source_path, target_path, transfer_path, source_stat)
+            except OSError as e:
+                self.errors.append("{}: {}".format(transfer_path, e))
+        
+        # Set the attributes of directories once their content is copied
+        self.flush()
+        self.wait()
+        for source_path, target_path in reversed(directories):
+            try:
+                copy_metadata(source_path, target_path)
+            except OSError as e:
+                self.errors.append("{}: {}".format(target_path, e))
+    
+    def copy_entry(self, source, target, relative, source_stat):
+        sneakersync.operations.check_cancelled()
+        mode = source_stat.st_mode
+        
+        if stat.S_ISDIR(mode):
+            self.copy_directory_entry(source, target)
+            self.copy_tree(source, target, relative)
+            if self.queue is not None:
+                self.directories.append((source, target, source_stat))
+                return
+        elif stat.S_ISLNK(mode):
+            link = os.readlink(source)
+            if not (target.is_symlink() and os.readlink(target) == link):
+                remove(target)
+                os.symlink(link, target)
+                self.report(relative)
+        elif stat.S_ISREG(mode):
+            key = (source_stat.st_dev, source_stat.st_ino)
+            if source_stat.st_nlink > 1 and key in self.links:
+                if str(self.links[key]) in self.queued:
+                    self.deferred_links.append(
+                        (self.links[key], target, relative))
+                else:
+                    self.link(self.links[key], target, relative)
+                return
+            if source_stat.st_nlink > 1:
+                self.links[key] = target
+            
+            if self.is_up_to_date(source, source_stat, target):
+                copy_metadata(source, target, source_stat)
+            elif self.queue is not None:
+                self.queue.append((source, target, relative, source_stat))
+                self.queued.add(str(target))
+            else:
+                self.copy_regular(source, target, relative, source_stat)
+            return
+        else:
+            if not target.is_symlink() and target.exists():
+                target_stat = target.stat()
+                if (
+                        target_stat.st_mode == mode
+                        and target_stat.st_rdev == source_stat.st_rdev):
+                    return
+            remove(target)
+            os.mknod(target, mode, source_stat.st_rdev)
+            self.report(relative)
+        
+        copy_metadata(source, target, source_stat)
+    
+    def copy_directory_entry(self, source, target):
+        """Create the target directory if needed, and make sure its content
+        can be modified. Its attributes are set by the caller once its
+        content has been transferred.
+        """
+        
+        if target.is_symlink() or (target.exists() and not target.is_dir()):
+            remove(target)
+        if not target.is_dir():
+            target.mkdir(mode=0o700)
+        elif not os.access(target, os.W_OK | os.X_OK):
+            target.chmod(target.stat().st_mode | stat.S_IWUSR | stat.S_IXUSR)
+    
+    def copy_regular(self, source, target, relative, source_stat, data=None):
+        """Copy a regular file which is not up to date, and its attributes.
+        data is the content of the file, if it has already been read.
+        """
+        
+        if self.executor is not None:
+            # NOTE: the attributes are copied by the worker
+            future = self.executor.submit(
+                self.copy_compressed, source, target, relative, source_stat)
+            self.futures.append(future)
+            self.pending[str(target)] = future
+            return
+        self.copy_file(source, target, relative, source_stat, data)
+        copy_metadata(source, target, source_stat)
+    
+    def flush(self):
+        """Copy the queued files in physical order, then create the hard
+        links to these files.
+        """
+        
+        if not self.queue:
+            return
+        
+        large, batches = sneakersync.ordering.schedule(self.queue)
+        self.queue = []
+        for source, target, relative, source_stat in large:
+            sneakersync.operations.check_cancelled()
+            try:
+                self.copy_regular(source, target, relative, source_stat)
+            except OSError as e:
+                self.errors.append("{}: {}".format(relative, e))
+        
+        for batch in batches:
+            sneakersync.operations.check_cancelled()
+            # NOTE: read the whole batch before writing, so that the source
+            # disk is read sequentially.
+            contents = []
+            for source, target, relative, source_stat in batch:
+                try:
+                    with open(source, "rb") as fd:
+                        contents.append(fd.read())
+                except OSError as e:
+                    self.errors.append("{}: {}".format(relative, e))
+                    contents.append(None)
+            for (source, target, relative, source_stat), data in zip(
+                    batch, contents):
+                if data is None:
+                    continue
+                try:
+                    self.copy_regular(
+                        source, target, relative, source_stat, data)
+                except OSError as e:
+                    self.errors.append("{}: {}".format(relative, e))
+        self.queued.clear()
+        
+        for source, target, relative in self.deferred_links:
+            try:
+                self.link(source, target, relative)
+            except OSError as e:
+                self.errors.append("{}: {}".format(relative, e))
+        self.deferred_links = []
+    
+    def copy_file(self, source, target, relative, source_stat, data=None):
+        """Copy a regular file through a temporary file in the same
+        directory, so that an interrupted transfer never leaves a truncated
+        file. Large files are copied in the partial directory, and an
+        interrupted copy is resumed by the next transfer. data is the content
+        of the file, if it has already been read.
+        """
+        
+        offset = 0
+        if source_stat.st_size >= resume_size:
+            temporary = get_partial_path(target, source_stat)
+            offset = get_resume_offset(temporary, source_stat)
+            temporary.parent.mkdir(exist_ok=True)
+        else:
+            temporary = target.with_name(".{}.sneakersync".format(target.name))
+        
+        try:
+            with open(source, "rb") as source_fd, \
+                    open(temporary, "r+b" if offset else "wb") as target_fd:
+                extents = self.get_extents(source, source_fd, source_stat)
+                if offset:
+                    target_fd.truncate(offset)
+                    source_fd.seek(offset)
+                    target_fd.seek(offset)
+                    self.report("resuming {} at {}".format(relative, offset))
+                elif (
+                        self.profile.preallocate and source_stat.st_size
+                        and extents is None
+                        and temporary.parent.name != partial_directory):
+                    # NOTE: preallocating would fill the holes. The size of
+                    # partial copies is the progress of the copy, they are
+                    # not preallocated.
+                    preallocate(target_fd.fileno(), source_stat.st_size)
+                hash_ = None
+                if self.digests is not None and not offset and extents is None:
+                    hash_ = sneakersync.checksums.new_hash()
+                if extents is None and data is not None:
+                    target_fd.write(memoryview(data)[offset:])
+                    size = len(data) - offset
+                    if hash_ is not None:
+                        hash_.update(data)
+                elif hash_ is not None:
+                    size = copy_hashed(source_fd, target_fd, hash_)
+                elif extents is None:
+                    copy_contents(source_fd.fileno(), target_fd.fileno())
+                    size = target_fd.tell() - offset
+                else:
+                    sneakersync.sparse.copy_extents(
+                        source_fd.fileno(), target_fd.fileno(),
+                        sneakersync.sparse.clip(extents, offset),
+                        source_stat.st_size)
+                    size = source_stat.st_size - offset
+                if hash_ is not None:
+                    self.record_digest(
+                        source, source_fd, source_stat, size, hash_)
+            copy_metadata(source, temporary)
+            if target.is_dir() and not target.is_symlink():
+                remove(target)
+            os.replace(temporary, target)
+            if temporary.parent.name == partial_directory:
+                try:
+                    temporary.parent.rmdir()
+                except OSError:
+                    pass
+        except BaseException:
+            # NOTE: keep the partial copy of large files, even on
+            # KeyboardInterrupt.
+            if temporary.parent.name != partial_directory:
+                if os.path.lexists(temporary):
+                    os.unlink(temporary)
+            raise
+        self.report(relative)
+        self.tracker.update(size)
+    
+    def record_digest(self, source, source_fd, source_stat, size, hash_):
+        """Record the digest of a file which was hashed while it was copied,
+        unless it was modified during the copy.
+        """
+        
+        current = os.fstat(source_fd.fileno())
+        if (
+                current.st_size == source_stat.st_size == size
+                and current.st_mtime_ns == source_stat.st_mtime_ns):
+            path = "/".join(
+                pathlib.Path(source).relative_to(self.source_root).parts)
+            self.digests[path] = (
+                source_stat.st_size, source_stat.st_mtime_ns, hash_.digest())
+    
+    def get_extents(self, source, source_fd, source_stat):
+        """Return the data extents of a sparse file, or None if the file is
+        not sparse or if sparse handling is disabled.
+        """
+        
+        if self.profile.sparse is False:
+            return None
+        
+        path = "/".join(pathlib.Path(source).relative_to(self.source_root).parts)
+        extents = None
+        if self.action == "receive" and self.extent_map is not None:
+            extents = self.extent_map.get(path, source_stat)
+        if extents is None and sneakersync.sparse.is_sparse(source_stat):
+            extents = sneakersync.sparse.get_extents(
+                source_fd.fileno(), source_stat.st_size)
+        
+        if self.action == "send" and self.extent_map is not None:
+            if extents is None:
+                self.extent_map.entries.pop(path, None)
+            else:
+                self.extent_map.entries[path] = (
+                    source_stat.st_size, source_stat.st_mtime_ns, extents)
+        return extents
+    
+    def copy_compressed(self, source, target, relative, source_stat):
+        """Compress (when sending) or decompress (when receiving) a file,
+        through a temporary file in the same directory. This is run by the
+        workers: errors are recorded instead of raised.
+        """
+        
+        temporary = target.with_name(".{}.sneakersync".format(target.name))
+        try:
+            with open(source, "rb", buffering=0) as source_fd, \
+                    open(temporary, "wb", buffering=0) as target_fd:
+                if self.action == "send":
+                    sneakersync.compression.compress(
+                        relative, source_fd, target_fd, source_stat.st_size)
+                    size = source_stat.st_size
+                else:
+                    size = sneakersync.compression.decompress(
+                        source_fd, target_fd)
+            copy_metadata(source, temporary, source_stat)
+            if target.is_dir() and not target.is_symlink():
+                remove(target)
+            os.replace(temporary, target)
+        except Exception as e:
+            self.errors.append("{}: {}".format(relative, e))
+            return
+        finally:
+            if os.path.lexists(temporary):
+                os.unlink(temporary)
+        self.report(relative)
+        self.tracker.update(size)
+    
+    def wait(self, start=0):
+        """Wait for the copies submitted after the given one."""
+        
+        for future in self.futures[start:]:
+            future.result()
+        del self.futures[start:]
+    
+    def is_up_to_date(self, source, source_stat, target):
+        if self.compression == "none":
+            return is_up_to_date(source_stat, target)
+        
+        # NOTE: compressed files contain their original size
+        if self.action == "send":
+            size = source_stat.st_size
+            target_size = sneakersync.compression.get_size(target)
+        else:
+            size = sneakersync.compression.get_size(source)
+            target_size = (
+                os.lstat(target).st_size if os.path.lexists(target) else None)
+        return (
+            size == target_size
+            and is_up_to_date(source_stat, target, check_size=False))
+    
+    def link(self, source, target, relative):
+        """Hard-link target to an already-copied file."""
+        
+        # Wait until the file has been copied by a worker
+        future = self.pending.get(str(source))
+        if future is not None:
+            future.result()
+        
+        if os.path.lexists(target) and os.path.samefile(source, target):
+            return
+        temporary = target.with_name(".{}.sneakersync".format(target.name))
+        os.link(source, temporary)
+        if target.is_dir() and not target.is_symlink():
+            remove(target)
+        os.replace(temporary, target)
+        self.report(relative)
+    
+    def delete_extraneous(self, target, relative, names):
+        """Delete the entries of target which are not in the source. As in
+        rsync, excluded entries are not deleted.
+        """
+        
+        for entry in os.scandir(target):
+            if entry.name in names:
+                continue
+            if entry.name == partial_directory:
+                remove_stale_partials(entry.path, names)
+                continue
+            path = "{}/{}".format(relative, entry.name).lstrip("/")
+            if self.filter.excluded(path, entry.is_dir(follow_symlinks=False)):
+                continue
+            try:
+                remove(target / entry.name)
+                self.report("deleting {}".format(path))
+            except OSError as e:
+                self.errors.append("{}: {}".format(path, e))
+    
+    def report(self, message):
+        if self.progress:
+            sneakersync.write_output(self.module, "{}\n".format(message))
+
+# Files at least this large are copied in the partial directory, so that
+# an interrupted copy can be resumed.
+resume_size = 2**26
+
+# Directory of the partial copies, next to the target files
+partial_directory = ".sneakersync-partial"
+
+def get_partial_path(target, source_stat):
+    """Return the path of the partial copy of a file. The path depends on the
+    size and modification time of the source, so that a partial copy is not
+    resumed if the source has changed.
+    """
+    
+    name = hashlib.sha1(os.fsencode(target.name)).hexdigest()[:16]
+    return target.parent / partial_directory / "{}.{}.{}".format(
+        name, source_stat.st_size, source_stat.st_mtime_ns)
+
+def get_resume_offset(partial, source_stat):
+    """Return the offset at which a partial copy can be resumed, removing
+    the partial copies of previous versions of the source.
+    """
+    
+    prefix = partial.name.split(".")[0]+"."
+    offset = 0
+    if partial.parent.is_dir():
+        for entry in os.scandir(partial.parent):
+            if entry.name == partial.name:
+                # NOTE: the end of the partial copy may not have been
+                # written to disk: discard the last chunk.
+                size = entry.stat(follow_symlinks=False).st_size
+                offset = max(0, size//resume_chunk - 1) * resume_chunk
+                offset = min(offset, source_stat.st_size)
+            elif entry.name.startswith(prefix):
+                os.unlink(entry.path)
+    return offset
+
+def remove_stale_partials(directory, names):
+    """Remove the partial copies of files which are not in names anymore."""
+    
+    prefixes = set(
+        hashlib.sha1(os.fsencode(x)).hexdigest()[:16] for x in names)
+    for entry in os.scandir(directory):
+        if entry.name.split(".")[0] not in prefixes:
+            remove(entry.path)
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+
+# Granularity of resumed copies
+resume_chunk = 2**20
+
+# Errors of copy_file_range and sendfile when they cannot be used for a given
+# pair of files.
+_unsupported = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF}
+
+def preallocate(fd, size):
+    """Allocate the space of a file, when the file system supports it."""
+    
+    if not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno not in _unsupported:
+            raise
+
+def copy_contents(source_fd, target_fd, length=None):
+    """Copy the content of a file from the current offsets, up to length
+    bytes if specified, in kernel space when possible.
+    """
+    
+    functions = []
+    if hasattr(os, "copy_file_range"):
+        functions.append(os.copy_file_range)
+    if hasattr(os, "sendfile"):
+        functions.append(lambda source, target, count:
+            os.sendfile(target, source, None, count))
+    
+    chunk_size = 2**30
+    remaining = length
+    for function in functions:
+        copied = 0
+        try:
+            while remaining is None or remaining > 0:
+                count = function(
+                    source_fd, target_fd,
+                    chunk_size if remaining is None
+                    else min(chunk_size, remaining))
+                if count == 0:
+                    return
+                copied += count
+                if remaining is not None:
+                    remaining -= count
+            return
+        except OSError as e:
+            # Only fall back to the next method if nothing was copied
+            if e.errno not in _unsupported or copied != 0:
+                raise
+    
+    while remaining is None or remaining > 0:
+        data = os.read(
+            source_fd, 2**20 if remaining is None else min(2**20, remaining))
+        if not data:
+            break
+        os.write(target_fd, data)
+        if remaining is not None:
+            remaining -= len(data)
+
+def copy_hashed(source_fd, target_fd, hash_):
+    """Copy the content of a file through a buffer, updating hash_ with the
+    copied data. Return the number of bytes copied.
+    """
+    
+    buffer = bytearray(sneakersync.checksums.chunk_size)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        size = source_fd.readinto(buffer)
+        if not size:
+            return copied
+        hash_.update(view[:size])
+        target_fd.write(view[:size])
+        copied += size
+
+def copy_metadata(source, target, source_stat=None):
+    """Copy owner, mode, extended attributes (including ACLs) and timestamps
+    of source to target.
+    """
+    
+    if source_stat is None:
+        source_stat = os.stat(source, follow_symlinks=False)
+    is_link = stat.S_ISLNK(source_stat.st_mode)
+    
+    # NOTE: as in rsync, owner is only preserved when running as super-user
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        os.chown(
+            target, source_stat.st_uid, source_stat.st_gid,
+            follow_symlinks=False)
+    if not is_link:
+        os.chmod(target, stat.S_IMODE(source_stat.st_mode))
+    
+    copy_xattrs(source, target)
+    
+    if hasattr(os, "chflags") and not is_link:
+        try:
+            os.chflags(target, source_stat.st_flags)
+        except OSError as e:
+            if e.errno not in [errno.EOPNOTSUPP, errno.EPERM]:
+                raise
+    
+    if not is_link or os.utime in os.supports_follow_symlinks:
+        os.utime(
+            target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns),
+            follow_symlinks=False)
+
+def copy_xattrs(source, target):
+    """Copy the extended attributes of source to target. On Linux, POSIX ACLs
+    are stored in the "system.posix_acl_*" extended attributes, and are
+    copied as well.
+    """
+    
+    if not hasattr(os, "listxattr"):
+        return
+    
+    try:
+        source_names = set(os.listxattr(source, follow_symlinks=False))
+        target_names = set(os.listxattr(target, follow_symlinks=False))
+    except OSError as e:
+        if e.errno in [errno.ENOTSUP, errno.EPERM]:
+            return
+        raise
+    
+    for name in target_names - source_names:
+        try:
+            os.removexattr(target, name, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in [errno.ENOTSUP, errno.EPERM, errno.ENODATA]:
+                raise
+    
+    for name in source_names:
+        value = os.getxattr(source, name, follow_symlinks=False)
+        if name in target_names:
+            if os.getxattr(target, name, follow_symlinks=False) == value:
+                continue
+        try:
+            os.setxattr(target, name, value, follow_symlinks=False)
+        except OSError as e:
+            # Attributes from restricted namespaces (e.g. "trusted." or
+            # "security.") cannot be set by regular users.
+            if e.errno not in [errno.ENOTSUP, errno.EPERM]:
+                raise
+            sneakersync.logger.warning(
+                "Could not set attribute {} on {}".format(name, target))
+
+def get_missing_metadata():
+    """Return the metadata which rsync preserves on this platform, but which
+    the native backend cannot copy.
+    """
+    
+    missing = []
+    if not hasattr(os, "listxattr"):
+        missing.append("extended attributes and ACLs")
+    if sys.platform == "darwin":
+        missing.append("creation times")
+    return missing
+
+def is_up_to_date(source_stat, target, check_size=True):
+    """Quick check of rsync: same size and same modification time."""
+    
+    try:
+        target_stat = os.stat(target, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(target_stat.st_mode)
+        and (not check_size or target_stat.st_size == source_stat.st_size)
+        and int(target_stat.st_mtime) == int(source_stat.st_mtime))
+
+def remove(path):
+    """Remove a file or a directory tree, if it exists."""
+    
+    if os.path.isdir(path) and not os.path.islink(path):
+        if not os.access(path, os.W_OK | os.X_OK):
+            os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR | stat.S_IXUSR)
+        for entry in os.scandir(path):
+            remove(entry.path)
+        os.rmdir(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
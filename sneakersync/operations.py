@@ -1,8 +1,17 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
 import datetime
 import logging
+import os
 import pathlib
 import socket
+import stat
 import sys
+import threading
+import time
+import uuid
 
 import yaml
 
@@ -10,12 +19,54 @@ sneakersync = sys.modules["sneakersync"]
 
 from .state import State
 
-def send(destination, progress, backend):
-    """Send modules on the sneakernet."""
+def send(
+        destination, progress, backend, jobs=None, callback=None,
+        metrics_json=None, confirmation=None, volumes=None):
+    """Send modules on the sneakernet. If specified, callback is called with
+    the module and a sneakersync.progress.Progress object as the transfer
+    progresses. The metrics of each module are appended to the history on the
+    drive and, if metrics_json is specified, written to this path. Questions
+    are asked to the user, unless confirmation is specified: it is then
+    called with the question, and returns the answer as a boolean. If
+    volumes (other drives) are specified, the modules are spread over
+    destination and volumes.
+    """
     
+    if volumes:
+        return sneakersync.volumes.send(
+            [destination]+list(volumes), progress, backend, jobs, callback,
+            metrics_json, confirmation)
+    
+    confirm_ = confirmation or confirm
     state = State.load(destination / "sneakersync.dat")
-    if state.previous_direction == "send":
-        confirmed = confirm(
+    configuration = read_configuration(destination / "sneakersync.cfg")
+    incremental = (configuration["mode"] == "incremental")
+    if configuration["layout"] == "dedup":
+        backend = sneakersync.store
+    elif configuration["layout"] == "pack":
+        backend = sneakersync.packs
+    
+    host = socket.gethostname()
+    
+    # NOTE: in incremental mode, each send creates a new bundle. In mirror
+    # mode, a send only overwrites changes if they were not received by this
+    # host.
+    if not incremental and state.module_generations:
+        vector = state.vectors.get(host, {})
+        pending = [
+            str(sneakersync.get_module_root(x))
+            for x in configuration["modules"]
+            if state.module_generations.get(sneakersync.get_module_id(x))
+                not in [None, vector.get(sneakersync.get_module_id(x))]]
+        if pending:
+            confirmed = confirm_(
+                "WARNING: "
+                "do you want to overwrite the changes of {}, which were not "
+                "received by {}?".format(", ".join(pending), host))
+            if not confirmed:
+                return 0
+    elif state.previous_direction == "send" and not incremental:
+        confirmed = confirm_(
             "WARNING: "
             "do you want to re-send the current files "
             "(sent from {} on {})?".format(
@@ -23,51 +74,861 @@ def send(destination, progress, backend):
         if not confirmed:
             return 0
     
-    configuration = read_configuration(destination / "sneakersync.cfg")
     
+    # Resume an interrupted send from this host: skip the modules which were
+    # completely sent with the same configuration. In incremental mode, the
+    # incomplete bundle is sent again.
+    if incremental:
+        state.checkpoints = {}
+    else:
+        state.checkpoints = {
+            module_id: checkpoint
+            for module_id, checkpoint in state.checkpoints.items()
+            if checkpoint["host"] == host}
+    modules = []
     for module in configuration["modules"]:
+        checkpoint = state.checkpoints.get(sneakersync.get_module_id(module))
+        if (
+                checkpoint is not None
+                and checkpoint["checksum"] == sneakersync.manifest.get_checksum(
+                    configuration, module)):
+            if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+                print(
+                    "Skipping {} (sent on {})".format(
+                        sneakersync.get_module_root(module),
+                        checkpoint["date"]))
+        else:
+            modules.append(module)
+    
+    check_metadata(backend, modules)
+    
+    # Find the changed paths once: they are used by the estimate, the
+    # transfer, the checksums and the catalog.
+    changes = {}
+    def prepare_module(module):
+        changes[sneakersync.get_module_id(module)] = get_changes(
+            destination, configuration, module, state,
+            get_backend(backend, module))
+    run_modules(
+        modules, prepare_module, "send", get_jobs(jobs, configuration))
+    
+    # Check that the data fits on the drive before modifying it
+    sizes = {}
+    if configuration["preflight"]:
+        estimates = get_estimates(
+            destination, configuration, state, get_jobs(jobs, configuration),
+            modules, changes)
+        sizes = {
+            sneakersync.get_module_id(x.module): x.size for x in estimates}
+        size = sum(x.size for x in estimates)
+        space = sum(x.space for x in estimates)
+        free_space = sneakersync.plan.get_free_space(destination)
+        if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+            # NOTE: the duration of small transfers is not worth measuring
+            # the drive.
+            throughput = state.throughput
+            if throughput is None and size >= 2**26:
+                throughput = sneakersync.plan.measure_throughput(destination)
+            print(
+                sneakersync.plan.report(estimates, free_space, throughput),
+                end="")
+        if space > free_space:
+            confirmed = confirm_(
+                "WARNING: "
+                "{} are required on the drive, but only {} are available. "
+                "Do you want to send anyway?".format(
+                    sneakersync.progress.format_size(space),
+                    sneakersync.progress.format_size(free_space)))
+            if not confirmed:
+                return 0
+        start = time.monotonic()
+    
+    if incremental:
+        if state.generations.get(host, 0) != state.generation:
+            sneakersync.logger.warning(
+                "Some bundles have not been received by {}".format(host))
+        bundle = sneakersync.bundles.create(destination, state.generation+1)
+        manifests = []
+    
+    def send_module(module):
         if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
             print("Sending {}".format(sneakersync.get_module_root(module)))
         
-        backend.send(destination, configuration, module, state, progress)
+        module_callback = recorder.get_callback(module)
+        module_backend = get_backend(backend, module)
+        # NOTE: the dedup and pack layouts do not contain a copy of the module
+        is_tree = (
+            module_backend not in [sneakersync.store, sneakersync.packs])
+        
+        module_id = sneakersync.get_module_id(module)
+        position, files, manifest = changes[module_id]
+        
+        # Hash the files while they are transferred. The native backend
+        # hashes the uncompressed files while it copies them, so that they
+        # are only read once; the other files are hashed after the transfer.
+        token = uuid.uuid4().hex
+        checksums, digests = None, None
+        cancelled = threading.Event()
+        options = {"callback": module_callback}
+        if configuration["checksums"] and not incremental and is_tree:
+            if (
+                    module_backend is sneakersync.native
+                    and module["compression"] == "none"):
+                digests = {}
+                options["digests"] = digests
+            else:
+                checksums = sneakersync.checksums.start(
+                    destination, configuration, module,
+                    state.tokens.get(module_id), token, files,
+                    cancelled=cancelled)
+        
+        start = time.monotonic()
+        try:
+            if incremental:
+                manifests.append(
+                    sneakersync.bundles.send(
+                        destination, configuration, module, state, progress,
+                        module_backend, bundle, module_callback,
+                        (manifest, files)))
+            elif manifest is not None:
+                # Until the transfer is finished, the mirror does not match
+                # any manifest.
+                if manifest.path.exists():
+                    manifest.path.unlink()
+                module_backend.send(
+                    destination, configuration, module, state, progress,
+                    files, **options)
+                manifest.save()
+            elif files is not None:
+                # Only send the paths recorded by the watcher. The manifest
+                # does not describe the drive anymore.
+                manifest_path = sneakersync.manifest.get_path(
+                    destination, module)
+                if manifest_path.exists():
+                    manifest_path.unlink()
+                if files:
+                    module_backend.send(
+                        destination, configuration, module, state, progress,
+                        files, **options)
+            else:
+                module_backend.send(
+                    destination, configuration, module, state, progress,
+                    **options)
+        except BaseException:
+            # NOTE: the hashing thread must not outlive a failed transfer,
+            # e.g. in the long-running process of the async API.
+            if checksums is not None:
+                cancelled.set()
+                concurrent.futures.wait([checksums])
+            raise
+        
+        duration = time.monotonic()-start
+        recorder.add(module, duration)
+        
+        if digests is not None:
+            checksums = sneakersync.checksums.compute(
+                destination, configuration, module,
+                state.tokens.get(module_id), token, files, digests)
+            checksums.save()
+        elif checksums is not None:
+            checksums = checksums.result()
+            checksums.save()
+        
+        if configuration["catalog"]:
+            sneakersync.catalog.update(
+                destination, configuration, module, files, checksums)
+        
+        if is_tree:
+            with checkpoints_lock:
+                record_transfer(
+                    state, module, "send", sneakersync.profiles.get_profile(
+                        configuration, module,
+                        sneakersync.get_module_root(module)),
+                    duration, sizes.get(module_id))
+        
+        if not incremental:
+            # NOTE: sends which did not change anything keep the generation
+            generation = state.module_generations.get(module_id, 0)
+            if files is None or files:
+                generation += 1
+                sneakersync.generations.save_changes(
+                    destination, module, generation, files)
+            with checkpoints_lock:
+                state.checkpoints[module_id] = {
+                    "host": host, "date": str(datetime.datetime.now()),
+                    "checksum": sneakersync.manifest.get_checksum(
+                        configuration, module)}
+                state.tokens[module_id] = token
+                state.module_generations[module_id] = generation
+                state.vectors.setdefault(host, {})[module_id] = generation
+                state.save()
+                sneakersync.generations.prune(destination, module, state)
+            sneakersync.watch.set_baseline(module, position, token)
+    
+    checkpoints_lock = threading.Lock()
+    recorder = sneakersync.metrics.Recorder("send", callback)
+    try:
+        run_modules(
+            modules, send_module, "send", get_jobs(jobs, configuration))
+    finally:
+        recorder.save(destination, metrics_json)
+    
+    if incremental:
+        # The manifests are only valid once the bundle is complete
+        bundle.save()
+        for manifest in manifests:
+            manifest.save()
+        if state.generations.get(host, 0) == state.generation:
+            state.generations[host] = bundle.generation
+        state.generation = bundle.generation
+        sneakersync.bundles.prune(destination, state)
+    elif configuration["layout"] == "dedup":
+        sneakersync.store.Store(destination).collect_garbage(configuration)
+    elif configuration["layout"] == "pack":
+        sneakersync.packs.collect_garbage(destination, configuration)
+    if configuration["catalog"]:
+        sneakersync.catalog.prune(destination, configuration)
     
+    # NOTE: small transfers do not give a meaningful throughput
+    if configuration["preflight"] and size >= 2**26:
+        state.throughput = size / max(time.monotonic()-start, 1e-6)
+    
+    state.checkpoints = {}
+    state.volume = None
     state.previous_direction = "send"
     state.previous_date = datetime.datetime.now()
-    state.previous_host = socket.gethostname()
+    state.previous_host = host
     state.save()
 
-def receive(source, progress, backend):
-    """Receive modules from the sneakernet."""
+def receive(
+        source, progress, backend, jobs=None, callback=None, verify=False,
+        metrics_json=None, confirmation=None):
+    """Receive modules from the sneakernet. The callback, metrics_json and
+    confirmation are used as in send. If verify is True, the received files
+    are checked against the checksums computed by the sender.
+    """
     
+    confirm_ = confirmation or confirm
     state = State.load(source / "sneakersync.dat")
-    if state.previous_direction == "receive":
-        confirmed = confirm(
+    if state.volume is not None:
+        return sneakersync.volumes.receive(
+            source, progress, backend, jobs, callback, verify, metrics_json,
+            confirmation)
+    configuration = read_configuration(source / "sneakersync.cfg")
+    incremental = (configuration["mode"] == "incremental")
+    if configuration["layout"] == "dedup":
+        backend = sneakersync.store
+    elif configuration["layout"] == "pack":
+        backend = sneakersync.packs
+    
+    # NOTE: in incremental mode, only the new bundles are received. In mirror
+    # mode, only the paths which changed since the last transfer of each
+    # module by this host are received.
+    host = socket.gethostname()
+    changes = {}
+    received = False
+    if not incremental:
+        changes = {
+            sneakersync.get_module_id(x): sneakersync.generations.get_changes(
+                source, x, state, host)
+            for x in configuration["modules"]}
+        if state.module_generations:
+            received = bool(changes) and all(
+                x == set() for x in changes.values())
+        else:
+            received = (state.previous_direction == "receive")
+    
+    if received:
+        if state.module_generations:
+            details = "already received by {}".format(host)
+        else:
+            details = "sent from {} on {}".format(
+                state.previous_host, state.previous_date.strftime("%c"))
+        confirmed = confirm_(
             "WARNING: "
-            "do you want to receive the current files again "
-            "(sent from {} on {})?".format(
-                state.previous_host, state.previous_date.strftime("%c")))
+            "do you want to receive the current files again ({})?".format(
+                details))
         if not confirmed:
             return 0
-        confirmed = confirm(
+        confirmed = confirm_(
             "This will overwrite your data. Are you really sure?")
         if not confirmed:
             return 0
+        changes = {x: None for x in changes}
     
-    configuration = read_configuration(source / "sneakersync.cfg")
-    
-    for module in configuration["modules"]:
+    def receive_module(module):
+        module_id = sneakersync.get_module_id(module)
+        if changes.get(module_id) == set():
+            if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+                print(
+                    "Skipping {} (already received)".format(
+                        sneakersync.get_module_root(module)))
+            return
         if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
             print("Receiving {}".format(sneakersync.get_module_root(module)))
         
-        backend.receive(source, configuration, module, state, progress)
+        module_callback = recorder.get_callback(module)
+        module_backend = get_backend(backend, module)
+        start = time.monotonic()
+        if incremental:
+            sneakersync.bundles.receive(
+                source, configuration, module, state, progress,
+                module_backend, module_callback)
+        else:
+            # NOTE: the changes which happen during the transfer must be sent
+            # next time, the journal position is taken before it.
+            position = sneakersync.watch.get_position(configuration, module)
+            files = changes[module_id]
+            is_tree = (
+                module_backend not in [sneakersync.store, sneakersync.packs])
+            remote_root = sneakersync.get_module_root(
+                module, state.previous_host)
+            # NOTE: the profile is resolved once, for the transfer and for
+            # its record.
+            options = {"callback": module_callback}
+            if is_tree and (files is None or files):
+                options["profile"] = sneakersync.profiles.get_profile(
+                    configuration, module,
+                    source / remote_root.relative_to(remote_root.anchor))
+            if files is None:
+                module_backend.receive(
+                    source, configuration, module, state, progress,
+                    **options)
+            elif files:
+                module_backend.receive(
+                    source, configuration, module, state, progress,
+                    files=files, **options)
+            with transfers_lock:
+                if module_id in state.module_generations:
+                    state.vectors.setdefault(host, {})[module_id] = (
+                        state.module_generations[module_id])
+                    sneakersync.generations.prune(source, module, state)
+            if is_tree:
+                sneakersync.watch.set_baseline(
+                    module, position, state.tokens.get(module_id))
+            if "profile" in options:
+                with transfers_lock:
+                    record_transfer(
+                        state, module, "receive", options["profile"],
+                        time.monotonic()-start)
+        recorder.add(module, time.monotonic()-start)
+        
+        if verify:
+            verify_module(
+                source, configuration, module, state, "receive",
+                sneakersync.get_module_root(module), False)
+    
+    check_metadata(backend, configuration["modules"])
+    transfers_lock = threading.Lock()
+    recorder = sneakersync.metrics.Recorder("receive", callback)
+    try:
+        run_modules(
+            configuration["modules"], receive_module, "receive",
+            get_jobs(jobs, configuration))
+    finally:
+        recorder.save(source, metrics_json)
     
+    if incremental:
+        state.generations[host] = state.generation
     state.previous_direction = "receive"
     state.save()
 
+async def send_async(
+        destination, backend=None, jobs=None, callback=None,
+        confirmation=False, progress=False, metrics_json=None):
+    """Asynchronous version of send, for applications based on asyncio. The
+    transfer runs in a worker thread, and rsync runs on the event loop of the
+    caller. The callback is called on this event loop. confirmation is the
+    answer to all questions, or a function (possibly asynchronous) called
+    with the question and returning the answer. Cancelling the task
+    terminates rsync, or stops the native backend after the current file.
+    """
+    
+    return await run_async(
+        send, destination, progress, backend or sneakersync.rsync, jobs,
+        callback, confirmation, metrics_json=metrics_json)
+
+async def receive_async(
+        source, backend=None, jobs=None, callback=None, confirmation=False,
+        progress=False, verify=False, metrics_json=None):
+    """Asynchronous version of receive, see send_async."""
+    
+    return await run_async(
+        receive, source, progress, backend or sneakersync.rsync, jobs,
+        callback, confirmation, verify=verify, metrics_json=metrics_json)
+
+def plan(
+        destination, progress, backend, jobs=None, callback=None,
+        volumes=None):
+    """Print the files and bytes which a send would transfer, and whether
+    they fit on the drive, without transferring anything. If volumes (other
+    drives) are specified, print how the modules would be spread over
+    destination and volumes. The progress, backend and callback arguments
+    are accepted for consistency with send.
+    """
+    
+    state = State.load(destination / "sneakersync.dat")
+    configuration = read_configuration(destination / "sneakersync.cfg")
+    if volumes:
+        sneakersync.volumes.check(configuration)
+        destinations = [destination]+list(volumes)
+        assignment = sneakersync.volumes.plan(
+            destinations, configuration,
+            [State.load(x / "sneakersync.dat") for x in destinations],
+            get_jobs(jobs, configuration))
+        print(
+            sneakersync.volumes.report(
+                destinations, configuration, assignment),
+            end="")
+        return assignment
+    
+    estimates = get_estimates(
+        destination, configuration, state, get_jobs(jobs, configuration))
+    throughput = (
+        state.throughput or sneakersync.plan.measure_throughput(destination))
+    print(
+        sneakersync.plan.report(
+            estimates, sneakersync.plan.get_free_space(destination),
+            throughput),
+        end="")
+    return estimates
+
+def stats(source, progress, backend, jobs=None, callback=None):
+    """Print the trends of the metrics recorded on the drive, and flag the
+    regressions. The progress, backend, jobs and callback arguments are
+    accepted for consistency with send.
+    """
+    
+    history = sneakersync.metrics.load(source)
+    if not history:
+        print("No metrics recorded in {}".format(source))
+    else:
+        print(sneakersync.metrics.report(history), end="")
+    return history
+
+def ls(source, progress, backend, jobs=None, callback=None, path=None):
+    """Print the modules recorded in the catalog of the drive or, if path
+    is specified, the content of this directory of a module. The progress,
+    backend, jobs and callback arguments are accepted for consistency with
+    send.
+    """
+    
+    modules = sneakersync.catalog.get_modules(source)
+    if path is None:
+        for module in modules.values():
+            print(
+                "{} {:>8} {:>10} {} {}".format(
+                    module["date"], module["entries"],
+                    sneakersync.progress.format_size(module["size"]),
+                    module["host"], module["root"]))
+        return modules
+    
+    configuration = read_configuration(source / "sneakersync.cfg")
+    module, relative = sneakersync.catalog.resolve(configuration, path)
+    rows = sneakersync.catalog.list_directory(source, module, relative)
+    for name, mode, size, mtime, _ in rows:
+        print(
+            "{} {:>10} {} {}".format(
+                stat.filemode(mode), size,
+                datetime.datetime.fromtimestamp(mtime//10**9).isoformat(
+                    " ", "seconds"),
+                name))
+    return rows
+
+def find(source, pattern, progress, backend, jobs=None, callback=None):
+    """Print the paths in the catalog of the drive whose name matches a glob
+    pattern, or whose path matches it if the pattern contains a "/". The
+    progress, backend, jobs and callback arguments are accepted for
+    consistency with send.
+    """
+    
+    modules = sneakersync.catalog.get_modules(source)
+    rows = sneakersync.catalog.find(source, pattern)
+    for module, path, *_ in rows:
+        print(os.path.join(modules[module]["root"], path))
+    return rows
+
+def diff(source, progress, backend, jobs=None, callback=None, path=None):
+    """Print the differences between the catalog of the drive and the local
+    modules (or the module containing path): "+" for the entries which are
+    only in the local tree, "-" for the entries which are only on the
+    drive, "M" for the modified entries. The progress, backend, jobs and
+    callback arguments are accepted for consistency with send.
+    """
+    
+    configuration = read_configuration(source / "sneakersync.cfg")
+    if path is None:
+        modules = configuration["modules"]
+    else:
+        modules = [sneakersync.catalog.resolve(configuration, path)[0]]
+    
+    differences = []
+    for module in modules:
+        root = sneakersync.get_module_root(module)
+        for status, relative in sneakersync.catalog.diff(
+                source, configuration, module):
+            print("{} {}".format(status, os.path.join(root, relative)))
+            differences.append((status, root / relative))
+    return differences
+
+def verify(source, progress, backend, jobs=None, callback=None):
+    """Check the files of all modules on the drive against the checksums
+    computed by the sender. The progress, backend and callback arguments are
+    accepted for consistency with send.
+    """
+    
+    state = State.load(source / "sneakersync.dat")
+    configuration = read_configuration(source / "sneakersync.cfg")
+    
+    # NOTE: all modules are checked, even if some of them are corrupted
+    failures = []
+    def verify_drive(module):
+        root = sneakersync.get_module_root(module, state.previous_host)
+        try:
+            verify_module(
+                source, configuration, module, state, "verify",
+                source / root.relative_to(root.anchor),
+                module["compression"] != "none")
+        except sneakersync.Exception as e:
+            sneakersync.logger.error(
+                "Could not {} module {}: \n{}".format(
+                    e.action, e.module["root"], e.text))
+            failures.append(module)
+    
+    run_modules(
+        configuration["modules"], verify_drive, "verify",
+        get_jobs(jobs, configuration))
+    if failures:
+        raise Exception(
+            "{} module(s) do not match their checksums".format(len(failures)))
+
+def verify_module(
+        source, configuration, module, state, action, root, compressed):
+    """Check the files of a module in root against its checksums, raise a
+    sneakersync.Exception if some of them do not match.
+    """
+    
+    if (
+            configuration["mode"] != "mirror"
+            or configuration["layout"] != "tree"):
+        sneakersync.logger.warning(
+            "Checksums are only available in mirror mode with the tree layout")
+        return
+    
+    checksums = sneakersync.checksums.Checksums.load(
+        sneakersync.checksums.get_path(source, module))
+    if (
+            checksums is None
+            or checksums.token != state.tokens.get(
+                sneakersync.get_module_id(module))):
+        sneakersync.logger.warning(
+            "No checksums for {}".format(sneakersync.get_module_root(module)))
+        return
+    
+    problems = sneakersync.checksums.verify(root, checksums, compressed)
+    if problems:
+        raise sneakersync.Exception(action, module, "\n".join(problems))
+    if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+        sneakersync.write_output(
+            module, "Verified {} files of {}\n".format(
+                len(checksums.entries), sneakersync.get_module_root(module)))
+
+def watch(configuration, progress, backend, jobs=None, callback=None):
+    """Record the changes of all modules in their journal until interrupted,
+    so that the next send only transfers them. The configuration is either a
+    configuration file or a directory containing sneakersync.cfg. The other
+    arguments are accepted for consistency with send.
+    """
+    
+    if configuration.is_dir():
+        configuration = configuration / "sneakersync.cfg"
+    if not configuration.is_file():
+        raise Exception("No such configuration: {}".format(configuration))
+    
+    try:
+        sneakersync.watch.run(read_configuration(configuration))
+    except KeyboardInterrupt:
+        pass
+
+def record_transfer(state, module, direction, profile, duration, size=None):
+    """Record the profile and duration of the last transfer of a module, so
+    that the throughput of profiles can be compared.
+    """
+    
+    transfer = {
+        "direction": direction, "profile": profile.name,
+        "date": str(datetime.datetime.now()), "duration": duration}
+    if size is not None:
+        transfer["size"] = size
+        transfer["throughput"] = size / max(duration, 1e-6)
+    state.transfers[sneakersync.get_module_id(module)] = transfer
+
+def get_jobs(jobs, configuration):
+    """Return the number of modules processed in parallel: jobs if specified,
+    otherwise the value from the configuration.
+    """
+    
+    if jobs is None:
+        return configuration["jobs"]
+    if jobs < 1:
+        raise Exception("Number of jobs must be positive: {}".format(jobs))
+    return jobs
+
+def get_backend(backend, module):
+    """Return the backend of a module: compressed modules require the native
+    backend.
+    """
+    
+    if module["compression"] != "none" and backend is sneakersync.rsync:
+        return sneakersync.native
+    return backend
+
+def check_metadata(backend, modules):
+    """Warn if the native backend is used for some of the modules and cannot
+    preserve all their metadata on this platform.
+    """
+    
+    missing = sneakersync.native.get_missing_metadata()
+    if missing and any(
+            get_backend(backend, x) is sneakersync.native for x in modules):
+        sneakersync.logger.warning(
+            "The native backend does not preserve the {} of the files on "
+            "this platform, use the rsync backend to keep them".format(
+                " and ".join(missing)))
+
+def get_changes(destination, configuration, module, state, backend):
+    """Return the position in the journal of a module, the paths which
+    changed since its previous send from this host (None if the whole
+    module must be transferred) and its new manifest (None if it is not
+    used). The drive is not modified.
+    """
+    
+    if configuration["mode"] == "incremental":
+        manifest, files = sneakersync.manifest.prepare(
+            destination, configuration, module, state)
+        return None, files, manifest
+    
+    # NOTE: the journal and the manifest are only used with the tree layout
+    # of the mirror mode, where the drive contains a copy of the module.
+    if backend in [sneakersync.store, sneakersync.packs]:
+        return None, None, None
+    position = sneakersync.watch.get_position(configuration, module)
+    files = sneakersync.watch.get_changes(
+        configuration, module, state, position)
+    if files is not None or not configuration["manifest"]:
+        return position, files, None
+    manifest, files = sneakersync.manifest.prepare(
+        destination, configuration, module, state, False)
+    return position, files, manifest
+
+def get_estimates(
+        destination, configuration, state, jobs=1, modules=None,
+        changes=None):
+    """Estimate the transfer of the given modules (all modules by default),
+    in parallel. If specified, changes contains the result of get_changes
+    for each module, so that the modules are not scanned again.
+    """
+    
+    if modules is None:
+        modules = configuration["modules"]
+    
+    estimates = {}
+    def estimate_module(module):
+        module_id = sneakersync.get_module_id(module)
+        entries = None
+        if changes is not None:
+            _, files, manifest = changes[module_id]
+            if manifest is not None and files is None:
+                entries = manifest.entries.items()
+            elif manifest is not None:
+                entries = [
+                    (x, manifest.entries[x]) for x in files
+                    if x in manifest.entries]
+            elif files is not None:
+                entries = sneakersync.plan.get_entries(
+                    sneakersync.get_module_root(module), files)
+        estimates[module_id] = sneakersync.plan.estimate(
+            destination, configuration, module, state, entries)
+    
+    run_modules(modules, estimate_module, "plan", jobs)
+    return [estimates[sneakersync.get_module_id(x)] for x in modules]
+
+class AsyncRunner(object):
+    """Link between the blocking operations, running in a worker thread, and
+    the event loop of the async API.
+    """
+    
+    def __init__(self, loop):
+        self.loop = loop
+        self.cancelled = threading.Event()
+        # Coroutines running on the loop
+        self.tasks = set()
+    
+    def run(self, coroutine):
+        """Run a coroutine on the loop, wait for its result. This must be
+        called from the worker thread.
+        """
+        
+        if self.cancelled.is_set():
+            coroutine.close()
+            raise Exception("Operation cancelled")
+        return asyncio.run_coroutine_threadsafe(
+            self._track(coroutine), self.loop).result()
+    
+    async def cancel(self):
+        """Cancel the running coroutines and wait for them. Subsequent calls
+        to run and check_cancelled fail.
+        """
+        
+        self.cancelled.set()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _track(self, coroutine):
+        if self.cancelled.is_set():
+            coroutine.close()
+            raise asyncio.CancelledError()
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await coroutine
+        finally:
+            self.tasks.discard(task)
+
+# Runner of the async API in the current worker thread
+_runner = contextvars.ContextVar("runner", default=None)
+
+def get_runner():
+    """Return the runner of the async API, None outside of the async API."""
+    
+    return _runner.get()
+
+def check_cancelled():
+    """Raise an exception if the operation was cancelled through the async
+    API.
+    """
+    
+    runner = _runner.get()
+    if runner is not None and runner.cancelled.is_set():
+        raise Exception("Operation cancelled")
+
+async def run_async(function, *args, **kwargs):
+    """Call a blocking operation (send or receive) from the async API. The
+    callback (5th argument) and confirmation (6th argument) are adapted to
+    the worker thread.
+    """
+    
+    loop = asyncio.get_running_loop()
+    runner = AsyncRunner(loop)
+    args = list(args)
+    callback, confirmation = args[4:6]
+    
+    if callback is not None:
+        args[4] = lambda module, event: loop.call_soon_threadsafe(
+            callback, module, event)
+    
+    def confirm_(message):
+        answer = confirmation
+        if callable(confirmation):
+            answer = confirmation(message)
+            if asyncio.iscoroutine(answer):
+                answer = runner.run(answer)
+        sneakersync.logger.info("{} {}".format(message, "y" if answer else "n"))
+        return bool(answer)
+    args[5] = confirm_
+    
+    def worker():
+        token = _runner.set(runner)
+        try:
+            return function(*args[:5], confirmation=args[5], **kwargs)
+        finally:
+            _runner.reset(token)
+    
+    future = loop.run_in_executor(None, worker)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # NOTE: nothing must run once the cancellation is done
+        await runner.cancel()
+        try:
+            await future
+        except Exception:
+            pass
+        raise
+
+def run_modules(modules, function, action, jobs=1):
+    """Call function on each module, using at most jobs parallel workers.
+    
+    Modules whose root is on the same device are handled one after the
+    other by the same worker, so that they do not compete for the same disk.
+    All modules are processed even if some of them fail; the first failure
+    is then raised as a SneakersyncException.
+    """
+    
+    if jobs <= 1:
+        for module in modules:
+            check_cancelled()
+            function(module)
+        return
+    
+    groups = collections.OrderedDict()
+    for module in modules:
+        device = get_device(sneakersync.get_module_root(module))
+        groups.setdefault(device, []).append(module)
+    
+    errors = []
+    def run_group(group):
+        for module in group:
+            try:
+                check_cancelled()
+                function(module)
+            except sneakersync.Exception as e:
+                errors.append(e)
+            except Exception as e:
+                errors.append(sneakersync.Exception(action, module, str(e)))
+    
+    # NOTE: the workers run in a copy of the context of the caller, e.g. to
+    # use the runner of the async API.
+    with concurrent.futures.ThreadPoolExecutor(
+            min(jobs, len(groups))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, run_group, group)
+            for group in groups.values()]
+        # NOTE: get the results to propagate unexpected errors
+        for future in futures:
+            future.result()
+    
+    for error in errors[1:]:
+        sneakersync.logger.error(
+            "Could not {} module {}: \n{}".format(
+                error.action, error.module["root"], error.text))
+    if errors:
+        raise errors[0]
+
+def get_device(path):
+    """Return the device of path, or of its closest existing parent."""
+    
+    path = pathlib.Path(path)
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return os.stat(path).st_dev
+
 def read_configuration(path):
     configuration = {
         "modules": [],
-        "filters": []
+        "filters": [],
+        "jobs": 1,
+        "manifest": "false",
+        "log": "false",
+        "preflight": "false",
+        "checksums": "false",
+        "catalog": "false",
+        "profile": "default",
+        "mode": "mirror",
+        "layout": "tree",
+        "max_entries_per_batch": "0"
     }
     
     if path.is_file():
@@ -88,9 +949,62 @@ def read_configuration(path):
         module["root"] = {h: pathlib.Path(p) for h, p in module["root"].items()}
         
         module.setdefault("filters", [])
+        module.setdefault("profile", configuration["profile"])
+        sneakersync.profiles.parse(module["profile"])
+        module.setdefault(
+            "max_entries_per_batch", configuration["max_entries_per_batch"])
+        module["max_entries_per_batch"] = int(module["max_entries_per_batch"])
+        if module["max_entries_per_batch"] < 0:
+            raise Exception(
+                "Maximum number of entries per batch must not be negative: "
+                "{}".format(module["max_entries_per_batch"]))
+        module.setdefault("compression", "none")
+        sneakersync.compression.check(module["compression"])
+        if (
+                module["compression"] != "none"
+                and configuration["layout"] in ["dedup", "pack"]):
+            raise Exception(
+                "The {} layout does not support compression".format(
+                    configuration["layout"]))
+    
+    configuration["manifest"] = get_boolean(configuration["manifest"])
+    configuration["log"] = get_boolean(configuration["log"])
+    configuration["preflight"] = get_boolean(configuration["preflight"])
+    configuration["checksums"] = get_boolean(configuration["checksums"])
+    configuration["catalog"] = get_boolean(configuration["catalog"])
+    if configuration["mode"] not in ["mirror", "incremental"]:
+        raise Exception("Invalid mode: {}".format(configuration["mode"]))
+    if configuration["layout"] not in ["tree", "dedup", "pack"]:
+        raise Exception("Invalid layout: {}".format(configuration["layout"]))
+    if configuration["layout"] != "tree" and configuration["mode"] != "mirror":
+        raise Exception(
+            "The {} layout requires the mirror mode".format(
+                configuration["layout"]))
+    
+    try:
+        configuration["jobs"] = int(configuration["jobs"])
+    except ValueError:
+        raise Exception(
+            "Invalid number of jobs: {}".format(configuration["jobs"]))
+    if configuration["jobs"] < 1:
+        raise Exception(
+            "Number of jobs must be positive: {}".format(
+                configuration["jobs"]))
     
     return configuration
 
+def get_boolean(value):
+    """Convert a configuration value to a boolean."""
+    
+    if isinstance(value, bool):
+        return value
+    elif value.lower() in ["true", "yes", "on", "1"]:
+        return True
+    elif value.lower() in ["false", "no", "off", "0"]:
+        return False
+    else:
+        raise Exception("Invalid boolean value: {}".format(value))
+
 def confirm(message):
     user_input = ""
     while user_input.lower() not in ["y", "n"]: 
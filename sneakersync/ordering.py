@@ -0,0 +1,93 @@
+import errno
+import os
+import struct
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+sneakersync = sys.modules["sneakersync"]
+
+# FS_IOC_FIEMAP, and the structures of its argument with a single extent
+_fiemap = 0xC020660B
+_header = struct.Struct("=QQIIII")
+_extent = struct.Struct("=QQQQQIIII")
+
+# Devices whose file system does not support FIEMAP
+_unsupported = set()
+_lock = threading.Lock()
+
+# Files larger than large_size are copied first, one by one. Smaller files
+# are read by batches of at most batch_size bytes and batch_files files,
+# then written in sequence.
+large_size = 2**24
+batch_size = 2**26
+batch_files = 1024
+
+def get_physical_offset(path, stat_):
+    """Return the physical offset of the first extent of a file, or None if
+    it is unknown (no FIEMAP support, empty file or data stored inline).
+    """
+    
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return None
+    with _lock:
+        if stat_.st_dev in _unsupported:
+            return None
+    
+    buffer = bytearray(
+        _header.pack(0, 2**64-1, 0, 0, 1, 0)+bytes(_extent.size))
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            fcntl.ioctl(fd, _fiemap, buffer, True)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        if e.errno in [errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL]:
+            with _lock:
+                _unsupported.add(stat_.st_dev)
+        return None
+    
+    if _header.unpack_from(buffer)[3] == 0:
+        return None
+    return _extent.unpack_from(buffer, _header.size)[1]
+
+def get_key(path, stat_):
+    """Return the sort key of a file in physical order: the offset of its
+    first extent, or its inode number if the offset is unknown.
+    """
+    
+    offset = get_physical_offset(path, stat_)
+    if offset is None:
+        return (stat_.st_dev, 0, stat_.st_ino)
+    return (stat_.st_dev, 1, offset)
+
+def schedule(entries):
+    """Sort regular files in physical order. entries are tuples whose first
+    item is the path of the file and last item its status. Return the large
+    files, and the batches of small files.
+    """
+    
+    keys = {id(x): get_key(x[0], x[-1]) for x in entries}
+    entries = sorted(entries, key=lambda x: keys[id(x)])
+    
+    large = [x for x in entries if x[-1].st_size >= large_size]
+    batches = []
+    batch, size = [], 0
+    for entry in entries:
+        if entry[-1].st_size >= large_size:
+            continue
+        if batch and (
+                size+entry[-1].st_size > batch_size
+                or len(batch) >= batch_files):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(entry)
+        size += entry[-1].st_size
+    if batch:
+        batches.append(batch)
+    return large, batches
@@ -0,0 +1,349 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import socket
+import stat
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+# Files smaller than small_size are appended to packs of at most pack_size
+# bytes (below the 4 GiB limit of FAT32); larger files are stored separately,
+# in chunks of at most chunk_size bytes.
+small_size = 2**20
+pack_size = 2**30
+chunk_size = 2**30
+
+# Packs whose live data is less than this fraction of their size are
+# rewritten by the next send.
+compaction_ratio = 0.5
+
+class Packs(object):
+    """Pack storage of a module on the drive: small files are appended to
+    large pack files, larger files are stored as separate files, and the
+    module is described by an index referencing them. Packs are never
+    modified: changed files are appended to new packs, and unused packs are
+    removed once the new index is saved. The names of the files on the drive
+    do not depend on the names of the files of the module, so that the file
+    system of the drive does not need to support them.
+    """
+    
+    def __init__(self, drive, module):
+        self.path = (
+            drive / "sneakersync.packs" / sneakersync.get_module_id(module))
+        self.packs = self.path / "packs"
+        self.files = self.path / "files"
+        self.index = self.path / "index"
+    
+    def get_pack(self, name):
+        return self.packs / name
+    
+    def get_file(self, name):
+        return self.files / name[:2] / name[2:]
+    
+    def get_chunk(self, name, index):
+        """Path to a chunk of a stored file: the first chunk is the stored
+        file itself.
+        """
+        
+        path = self.get_file(name)
+        if index == 0:
+            return path
+        return path.with_name("{}.{}".format(path.name, index))
+    
+    def load_index(self):
+        if not self.index.is_file():
+            return None
+        with gzip.open(self.index, "rt") as fd:
+            header = json.loads(fd.readline())
+            header["entries"] = [json.loads(line) for line in fd]
+        return header
+    
+    def save_index(self, index):
+        self.path.mkdir(parents=True, exist_ok=True)
+        temporary = self.index.with_suffix(".tmp")
+        with gzip.open(temporary, "wt") as fd:
+            header = {x: y for x, y in index.items() if x != "entries"}
+            fd.write(json.dumps(header)+"\n")
+            for entry in index["entries"]:
+                fd.write(json.dumps(entry)+"\n")
+        os.replace(temporary, self.index)
+    
+    def add_file(self, path, relative, entry):
+        """Store a large file in chunks, unless it is already stored. Return
+        the name of the stored file, its number of chunks, and whether it was
+        added.
+        """
+        
+        name = hashlib.sha256(
+            "{}\0{}\0{}".format(
+                relative, entry["size"], entry["mtime"]).encode()).hexdigest()
+        target = self.get_file(name)
+        if target.is_file():
+            count = 1
+            while self.get_chunk(name, count).is_file():
+                count += 1
+            return name, count, False
+        
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temporaries = []
+        try:
+            with open(path, "rb") as source_fd:
+                while True:
+                    temporary = target.with_name(
+                        ".{}.{}.sneakersync".format(
+                            target.name, len(temporaries)))
+                    temporaries.append(temporary)
+                    with open(temporary, "wb") as target_fd:
+                        sneakersync.native.copy_contents(
+                            source_fd.fileno(), target_fd.fileno(),
+                            chunk_size)
+                        size = os.fstat(target_fd.fileno()).st_size
+                    if size < chunk_size:
+                        break
+            if size == 0 and len(temporaries) > 1:
+                os.unlink(temporaries.pop())
+            
+            # NOTE: the first chunk is moved last, so that a stored file is
+            # complete.
+            for index, temporary in reversed(list(enumerate(temporaries))):
+                os.replace(temporary, self.get_chunk(name, index))
+        finally:
+            for temporary in temporaries:
+                if os.path.lexists(temporary):
+                    os.unlink(temporary)
+        return name, len(temporaries), True
+    
+    def read(self, entry, fds):
+        """Return the content of a packed file. fds contains the open packs,
+        by name, and is updated with the packs opened by this function.
+        """
+        
+        if entry["pack"] not in fds:
+            fds[entry["pack"]] = open(self.get_pack(entry["pack"]), "rb")
+        data = os.pread(
+            fds[entry["pack"]].fileno(), entry["size"], entry["offset"])
+        if len(data) != entry["size"]:
+            raise Exception(
+                "Truncated pack: {}".format(self.get_pack(entry["pack"])))
+        return data
+    
+    def collect_garbage(self, index):
+        """Remove the packs and files which are not referenced by index."""
+        
+        packs = set(x["pack"] for x in index["entries"] if "pack" in x)
+        files = set(x["file"] for x in index["entries"] if "file" in x)
+        if self.packs.is_dir():
+            for path in self.packs.iterdir():
+                if path.name not in packs:
+                    path.unlink()
+        if self.files.is_dir():
+            for directory in self.files.iterdir():
+                for path in directory.iterdir():
+                    name = directory.name+path.name.split(".")[0]
+                    if name not in files:
+                        path.unlink()
+                if not any(directory.iterdir()):
+                    directory.rmdir()
+
+class Writer(object):
+    """Append files to new packs."""
+    
+    def __init__(self, packs):
+        self.packs = packs
+        self.packs.packs.mkdir(parents=True, exist_ok=True)
+        self.number = max(
+            [int(x.stem) for x in self.packs.packs.glob("*.pack")], default=0)
+        self.fd = None
+        # Names of the packs created by this writer
+        self.names = set()
+    
+    def add(self, data):
+        """Append data to the current pack. Return the name of the pack and
+        the offset of the data.
+        """
+        
+        if self.fd is None or self.fd.tell()+len(data) > pack_size:
+            self.close()
+            self.number += 1
+            name = "{:08d}.pack".format(self.number)
+            self.fd = open(self.packs.get_pack(name), "wb")
+            self.names.add(name)
+        
+        offset = self.fd.tell()
+        self.fd.write(data)
+        return os.path.basename(self.fd.name), offset
+    
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+def send(
+        destination, configuration, module, state, progress=False,
+        callback=None):
+    source = sneakersync.get_module_root(module)
+    if not source.is_dir():
+        raise Exception("No such directory: {}".format(source))
+    
+    packs = Packs(destination, module)
+    
+    # Keep the stored files which did not change since the previous send,
+    # using the quick check of rsync.
+    previous = packs.load_index()
+    cache = {}
+    if previous is not None:
+        cache = {
+            x["path"]: x for x in previous["entries"]
+            if "pack" in x or "file" in x}
+    
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    relative = "/".join(source.relative_to(source.anchor).parts)
+    
+    tracker = sneakersync.progress.Tracker(callback)
+    writer = Writer(packs)
+    entries = []
+    errors = []
+    links = {}
+    try:
+        for path, entry_stat in sneakersync.store.walk(
+                source, filter_, relative, errors):
+            full_path = os.path.join(source, path)
+            try:
+                entry = sneakersync.store.get_entry(
+                    full_path, path, entry_stat)
+                if stat.S_ISREG(entry_stat.st_mode):
+                    key = (entry_stat.st_dev, entry_stat.st_ino)
+                    if entry_stat.st_nlink > 1 and key in links:
+                        entry["link"] = links[key]
+                        entries.append(entry)
+                        continue
+                    elif entry_stat.st_nlink > 1:
+                        links[key] = path
+                    
+                    cached = cache.get(path)
+                    if (
+                            cached is not None
+                            and cached["size"] == entry["size"]
+                            and cached["mtime"] == entry["mtime"]):
+                        for name in ["pack", "offset", "file", "chunks"]:
+                            if name in cached:
+                                entry[name] = cached[name]
+                    elif entry["size"] < small_size:
+                        with open(full_path, "rb") as fd:
+                            data = fd.read()
+                        # NOTE: the file may have changed since its status
+                        entry["size"] = len(data)
+                        entry["pack"], entry["offset"] = writer.add(data)
+                        report(module, progress, path)
+                        tracker.update(entry["size"])
+                    else:
+                        entry["file"], chunks, added = packs.add_file(
+                            full_path, path, entry)
+                        if chunks > 1:
+                            entry["chunks"] = chunks
+                        if added:
+                            report(module, progress, path)
+                            tracker.update(entry["size"])
+                entries.append(entry)
+            except OSError as e:
+                errors.append("{}: {}".format(path, e))
+        
+        if errors:
+            raise sneakersync.Exception("send", module, "\n".join(errors))
+        
+        compact(packs, writer, entries)
+    finally:
+        writer.close()
+    
+    index = {
+        "host": socket.gethostname(), "root": str(source), "entries": entries}
+    packs.save_index(index)
+    packs.collect_garbage(index)
+    tracker.finish(len(entries))
+
+def compact(packs, writer, entries):
+    """Copy the files of the previous packs which are mostly unused to new
+    packs.
+    """
+    
+    live = {}
+    for entry in entries:
+        if "pack" in entry:
+            live[entry["pack"]] = live.get(entry["pack"], 0) + entry["size"]
+    sparse = set(
+        name for name, size in live.items()
+        if name not in writer.names
+        and size < compaction_ratio*packs.get_pack(name).stat().st_size)
+    
+    fds = {}
+    try:
+        for entry in entries:
+            if entry.get("pack") in sparse:
+                entry["pack"], entry["offset"] = writer.add(
+                    packs.read(entry, fds))
+    finally:
+        for fd in fds.values():
+            fd.close()
+
+def receive(
+        source, configuration, module, state, progress=False,
+        callback=None):
+    packs = Packs(source, module)
+    index = packs.load_index()
+    if index is None:
+        raise Exception(
+            "Module {} is not in the packs".format(
+                sneakersync.get_module_root(module)))
+    
+    # NOTE: packed files are read in the order of the index, which is the
+    # order in which they were appended.
+    fds = {}
+    def write(entry, target):
+        if sneakersync.store.is_up_to_date(entry, target):
+            return False
+        
+        temporary = target.with_name(".{}.sneakersync".format(target.name))
+        try:
+            with open(temporary, "wb") as fd:
+                if "file" in entry:
+                    for index in range(entry.get("chunks", 1)):
+                        chunk = packs.get_chunk(entry["file"], index)
+                        with open(chunk, "rb") as chunk_fd:
+                            sneakersync.native.copy_contents(
+                                chunk_fd.fileno(), fd.fileno())
+                else:
+                    fd.write(packs.read(entry, fds))
+            if target.is_dir() and not target.is_symlink():
+                sneakersync.native.remove(target)
+            os.replace(temporary, target)
+        finally:
+            if os.path.lexists(temporary):
+                os.unlink(temporary)
+        return True
+    
+    try:
+        sneakersync.store.extract(
+            configuration, module, index["entries"], write, progress, callback)
+    finally:
+        for fd in fds.values():
+            fd.close()
+
+def collect_garbage(drive, configuration):
+    """Remove the packs of unknown modules."""
+    
+    path = drive / "sneakersync.packs"
+    if not path.is_dir():
+        return
+    modules = set(
+        sneakersync.get_module_id(x) for x in configuration["modules"])
+    for directory in path.iterdir():
+        if directory.name not in modules:
+            shutil.rmtree(directory)
+
+def report(module, progress, message):
+    if progress:
+        sneakersync.write_output(module, "{}\n".format(message))
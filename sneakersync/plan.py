@@ -0,0 +1,209 @@
+import os
+import shutil
+import socket
+import stat
+import sys
+import time
+
+sneakersync = sys.modules["sneakersync"]
+
+class Estimate(object):
+    """Files and bytes which a send would transfer for a module, and the
+    additional space it would use on the drive.
+    """
+    
+    def __init__(self, module, files=0, size=0, space=0):
+        self.module = module
+        self.files = files
+        self.size = size
+        self.space = space
+
+def estimate(destination, configuration, module, state, entries=None):
+    """Estimate the transfer of a module, without modifying the drive. If
+    entries is specified, it contains the paths which may be transferred
+    with their manifest entry, and the module is not scanned.
+    """
+    
+    source = sneakersync.get_module_root(module)
+    if not source.is_dir():
+        raise Exception("No such directory: {}".format(source))
+    
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    relative = "/".join(source.relative_to(source.anchor).parts)
+    
+    # NOTE: in mirror mode, the paths recorded by the watcher are the only
+    # ones which may be transferred.
+    if (
+            entries is None and configuration["mode"] == "mirror"
+            and configuration["layout"] == "tree"):
+        files = sneakersync.watch.get_changes(
+            configuration, module, state,
+            sneakersync.watch.get_position(configuration, module))
+        if files is not None:
+            entries = get_entries(source, files)
+    # NOTE: the entries are not kept in memory, except in incremental mode
+    # where they are compared to the previous manifest.
+    if entries is None:
+        entries = (
+            (x.path, x.get_manifest_entry())
+            for x in sneakersync.scan.walk(source, filter_, relative))
+    
+    if configuration["mode"] == "incremental":
+        entries = dict(entries)
+        changed = get_changed(destination, configuration, module, entries)
+        entries = entries.items()
+        is_transferred = lambda path, entry: path in changed
+        get_previous_size = lambda path: 0
+    elif configuration["layout"] == "dedup":
+        cached = get_cached(destination, module)
+        is_transferred = lambda path, entry: (
+            cached.get(path) != (entry[0], entry[1], entry[3]))
+        get_previous_size = lambda path: 0
+    elif configuration["layout"] == "pack":
+        # NOTE: changed files are appended to new packs
+        index = sneakersync.packs.Packs(destination, module).load_index()
+        stored = {}
+        if index is not None:
+            stored = {
+                x["path"]: (x["size"], x["mtime"]) for x in index["entries"]
+                if "pack" in x or "file" in x}
+        is_transferred = lambda path, entry: (
+            stored.get(path) != (entry[0], entry[1]))
+        get_previous_size = lambda path: 0
+    elif module["compression"] != "none":
+        # NOTE: compressed files contain their original size
+        def is_transferred(path, entry):
+            target = destination / relative / path
+            return (
+                sneakersync.compression.get_size(target) != entry[0]
+                or not is_up_to_date(entry, target, check_size=False))
+        get_previous_size = lambda path: get_size(
+            destination / relative / path)
+    else:
+        is_transferred = lambda path, entry: not is_up_to_date(
+            entry, destination / relative / path)
+        get_previous_size = lambda path: get_size(
+            destination / relative / path)
+    
+    result = Estimate(module)
+    inodes = set()
+    for path, entry in entries:
+        # NOTE: the content of hard-linked files is only transferred once
+        if not stat.S_ISREG(entry[4]) or entry[3] in inodes:
+            continue
+        inodes.add(entry[3])
+        if is_transferred(path, entry):
+            result.files += 1
+            result.size += entry[0]
+            result.space += max(0, entry[0]-get_previous_size(path))
+    
+    return result
+
+def get_entries(source, files):
+    """Return the manifest entries of the given paths of source which still
+    exist.
+    """
+    
+    entries = []
+    for path in files:
+        try:
+            entries.append(
+                (path, sneakersync.manifest.get_entry(
+                    os.lstat(source / path))))
+        except FileNotFoundError:
+            pass
+    return entries
+
+def get_changed(destination, configuration, module, entries):
+    """Return the paths which changed since the previous incremental send
+    from this host, or all paths if there is no valid manifest.
+    """
+    
+    host = socket.gethostname()
+    previous = sneakersync.manifest.Manifest.load(
+        sneakersync.manifest.get_path(destination, module, host))
+    if (
+            previous is None or previous.host != host
+            or previous.checksum != sneakersync.manifest.get_checksum(
+                configuration, module)):
+        return set(entries)
+    return sneakersync.manifest.get_changes(previous.entries, entries)
+
+def get_cached(destination, module):
+    """Return the size, modification time and inode of the files already in
+    the store, for the previous send from this host.
+    """
+    
+    store = sneakersync.store.Store(destination)
+    tree = store.load_tree(module)
+    if tree is None or tree["host"] != socket.gethostname():
+        return {}
+    return {
+        x["path"]: (x["size"], x["mtime"], x["inode"])
+        for x in tree["entries"]
+        if "hash" in x and store.get_object(x["hash"]).is_file()}
+
+def is_up_to_date(entry, target, check_size=True):
+    """Quick check of rsync: same size and same modification time."""
+    
+    try:
+        target_stat = os.stat(target, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(target_stat.st_mode)
+        and (not check_size or target_stat.st_size == entry[0])
+        and target_stat.st_mtime_ns//10**9 == entry[1]//10**9)
+
+def get_size(path):
+    try:
+        path_stat = os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return 0
+    return path_stat.st_size if stat.S_ISREG(path_stat.st_mode) else 0
+
+def measure_throughput(drive, size=16*2**20):
+    """Measure the write throughput of the drive, in bytes per second."""
+    
+    path = drive / ".sneakersync.throughput"
+    data = os.urandom(2**20)
+    start = time.monotonic()
+    try:
+        with path.open("wb") as fd:
+            for _ in range(size // len(data)):
+                fd.write(data)
+            fd.flush()
+            os.fsync(fd.fileno())
+    finally:
+        if path.exists():
+            path.unlink()
+    return size / max(time.monotonic()-start, 1e-6)
+
+def get_free_space(drive):
+    return shutil.disk_usage(drive).free
+
+def report(estimates, free_space, throughput):
+    """Return a human-readable report of the estimates."""
+    
+    format_size = sneakersync.progress.format_size
+    lines = []
+    for estimate in estimates:
+        lines.append("{}: {} files, {}".format(
+            sneakersync.get_module_root(estimate.module), estimate.files,
+            format_size(estimate.size)))
+    
+    files = sum(x.files for x in estimates)
+    size = sum(x.size for x in estimates)
+    space = sum(x.space for x in estimates)
+    lines.append(
+        "Total: {} files, {} to transfer, {} required on drive, "
+        "{} available".format(
+            files, format_size(size), format_size(space),
+            format_size(free_space)))
+    if throughput:
+        lines.append(
+            "Estimated duration: {} (at {}/s)".format(
+                sneakersync.progress.format_duration(size/throughput),
+                format_size(throughput)))
+    return "\n".join(lines)+"\n"
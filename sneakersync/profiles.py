@@ -0,0 +1,183 @@
+import stat
+import statistics
+import sys
+import threading
+
+sneakersync = sys.modules["sneakersync"]
+
+class Profile(object):
+    """Settings of the transfer of a module.
+    
+    whole_file: copy whole files (True) or use the delta algorithm of rsync
+      (False); None lets rsync decide.
+    inplace: update files in place instead of through a temporary copy.
+    sparse: re-create the holes of sparse files (True or None) or fill them
+      (False); None only warns when the transfer cannot keep the holes.
+    preallocate: allocate the space of files before writing them.
+    delete: when extraneous entries are deleted, "before", "during",
+      "after" or "delay" the transfer.
+    order: order in which the native backend copies files, "directory" or
+      "physical" (the order of their data on the source disk).
+    """
+    
+    __slots__ = [
+        "name", "whole_file", "inplace", "sparse", "preallocate", "delete",
+        "order"]
+    
+    def __init__(
+            self, name, whole_file=None, inplace=False, sparse=None,
+            preallocate=False, delete="during", order="directory"):
+        self.name = name
+        self.whole_file = whole_file
+        self.inplace = inplace
+        self.sparse = sparse
+        self.preallocate = preallocate
+        self.delete = delete
+        self.order = order
+    
+    def get_rsync_options(self, version=None):
+        """Return the options of rsync for this profile. version is the
+        version of rsync as a tuple, None if it is unknown.
+        """
+        
+        options = []
+        if self.whole_file is not None:
+            options.append(
+                "--whole-file" if self.whole_file else "--no-whole-file")
+        if self.inplace:
+            options.append("--inplace")
+        else:
+            # NOTE: rsync does not accept --partial-dir with --inplace
+            options.append(
+                "--partial-dir={}".format(
+                    sneakersync.native.partial_directory))
+        if self.sparse is not False:
+            # NOTE: older versions of rsync reject --sparse along with these
+            # options
+            conflict = None
+            if self.inplace and (version is None or version < (3, 1, 3)):
+                conflict = "--inplace"
+            elif self.preallocate and (version is None or version < (3, 2, 0)):
+                conflict = "--preallocate"
+            if conflict is None:
+                options.append("--sparse")
+            elif self.sparse:
+                sneakersync.logger.warning(
+                    "rsync {} does not support --sparse with {}".format(
+                        ".".join(str(x) for x in version or ["(unknown)"]),
+                        conflict))
+        if self.preallocate:
+            options.append("--preallocate")
+        return options
+    
+    def get_rsync_delete_options(self):
+        options = ["--delete"]
+        if self.delete != "during":
+            options.append("--delete-{}".format(self.delete))
+        return options
+
+profiles = {
+    # Behavior of rsync for local copies
+    "default": Profile("default"),
+    # Few large files which change partially, e.g. virtual machine images:
+    # only the modified blocks are written to the drive.
+    "large-files": Profile(
+        "large-files", whole_file=False, inplace=True, preallocate=True),
+    # Many small files: the delta algorithm is not worth its cost
+    "small-files": Profile("small-files", whole_file=True),
+}
+
+# Number of files sampled by the auto profile
+sample_size = 10000
+
+# Modules where files larger than large_size hold most of the data use the
+# large-files profile; modules whose median file is smaller than small_size
+# use the small-files profile.
+large_size = 2**30
+small_size = 2**16
+
+def parse(value):
+    """Return the profile of a module from the configuration: the name of a
+    profile, "auto", or a mapping of settings overriding the default
+    profile. "auto" is returned as None.
+    """
+    
+    if isinstance(value, str):
+        if value == "auto":
+            return None
+        if value not in profiles:
+            raise Exception("Invalid profile: {}".format(value))
+        return profiles[value]
+    
+    profile = Profile("custom")
+    for key, setting in value.items():
+        if key in ["whole_file", "sparse"] and setting in ["auto", "null"]:
+            setting = None
+        elif key in ["whole_file", "inplace", "sparse", "preallocate"]:
+            setting = sneakersync.operations.get_boolean(setting)
+        elif key == "delete":
+            if setting not in ["before", "during", "after", "delay"]:
+                raise Exception("Invalid delete timing: {}".format(setting))
+        elif key == "order":
+            if setting not in ["directory", "physical"]:
+                raise Exception("Invalid order: {}".format(setting))
+        else:
+            raise Exception("Invalid profile setting: {}".format(key))
+        setattr(profile, key, setting)
+    return profile
+
+# Profiles of the modules chosen during this run
+_cache = {}
+_lock = threading.Lock()
+
+def get_profile(configuration, module, root):
+    """Return the profile of a module, whose files are read from root. The
+    auto profile samples root once per run.
+    """
+    
+    profile = parse(module.get("profile", "default"))
+    if profile is not None:
+        return profile
+    
+    key = (sneakersync.get_module_id(module), str(root))
+    with _lock:
+        profile = _cache.get(key)
+    if profile is None:
+        filter_ = sneakersync.filters.get_filter(
+            configuration["filters"]+module["filters"])
+        relative = "/".join(root.relative_to(root.anchor).parts)
+        profile = choose(sample(root, filter_, relative))
+        sneakersync.logger.info(
+            "Using profile {} for {}".format(profile.name, root))
+        with _lock:
+            _cache[key] = profile
+    return profile
+
+def sample(root, filter_, relative, size=None):
+    """Return the sizes of at most size regular files of root, visiting the
+    directories in breadth-first order. The relative path of root from the
+    root of the transfer is used to match the filters.
+    """
+    
+    size = size or sample_size
+    sizes = []
+    # NOTE: the directories which cannot be read are not sampled
+    for entry in sneakersync.scan.walk(
+            root, filter_, relative, breadth_first=True, errors=[]):
+        if stat.S_ISREG(entry.mode):
+            sizes.append(entry.size)
+            if len(sizes) >= size:
+                break
+    return sizes
+
+def choose(sizes):
+    """Return the profile matching a distribution of file sizes."""
+    
+    total = sum(sizes)
+    if not total:
+        return profiles["default"]
+    if sum(x for x in sizes if x >= large_size) >= total/2:
+        return profiles["large-files"]
+    if statistics.median(sizes) < small_size:
+        return profiles["small-files"]
+    return profiles["default"]
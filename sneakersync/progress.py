@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+
+class Progress(object):
+    """Progress of the transfer of a module. Sizes are in bytes, rate is in
+    bytes per second and ETA in seconds. Totals, rate and ETA are None when
+    they are not known. The last event of a transfer may have statistics,
+    named as the fields of "rsync --stats".
+    """
+    
+    __slots__ = (
+        "bytes_done", "bytes_total", "files_done", "files_total", "rate", "eta",
+        "statistics")
+    
+    def __init__(
+            self, bytes_done, bytes_total=None, files_done=None,
+            files_total=None, rate=None, eta=None, statistics=None):
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.files_done = files_done
+        self.files_total = files_total
+        self.rate = rate
+        self.eta = eta
+        self.statistics = statistics
+    
+    def __repr__(self):
+        return "Progress({})".format(
+            ", ".join(
+                "{}={!r}".format(x, getattr(self, x)) for x in self.__slots__))
+    
+    def __eq__(self, other):
+        return all(
+            getattr(self, x) == getattr(other, x) for x in self.__slots__)
+
+class Tracker(object):
+    """Build progress events for in-process transfers, where totals are not
+    known in advance.
+    """
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self.start = time.monotonic()
+        self.bytes_done = 0
+        self.files_done = 0
+        self._lock = threading.Lock()
+    
+    def update(self, size):
+        """Record the transfer of a file. This may be called from several
+        threads.
+        """
+        
+        with self._lock:
+            self.bytes_done += size
+            self.files_done += 1
+            if self.callback is not None:
+                elapsed = time.monotonic() - self.start
+                self.callback(Progress(
+                    self.bytes_done, files_done=self.files_done,
+                    rate=self.bytes_done/elapsed if elapsed > 0 else None))
+    
+    def finish(self, scanned=None):
+        """Send the last event of the transfer, with the statistics of the
+        transferred files and, if known, the number of scanned files.
+        """
+        
+        if self.callback is None:
+            return
+        statistics = {
+            "Number of regular files transferred": self.files_done,
+            "Total transferred file size": self.bytes_done}
+        if scanned is not None:
+            statistics["Number of files"] = scanned
+        self.callback(Progress(
+            self.bytes_done, self.bytes_done, self.files_done,
+            self.files_done, None, 0, statistics))
+
+class ProgressBar(object):
+    """Render the progress of all modules on a single line of a terminal."""
+    
+    def __init__(self, stream=None, width=30, interval=0.1):
+        self.stream = stream or sys.stderr
+        self.width = width
+        self.interval = interval
+        
+        self._events = {}
+        self._last_render = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, module, event):
+        with self._lock:
+            self._events[id(module)] = event
+            now = time.monotonic()
+            if now - self._last_render >= self.interval:
+                self._last_render = now
+                self.render()
+    
+    def render(self):
+        events = list(self._events.values())
+        bytes_done = sum(x.bytes_done for x in events)
+        rate = sum(x.rate for x in events if x.rate is not None)
+        
+        if all(x.bytes_total is not None for x in events):
+            bytes_total = sum(x.bytes_total for x in events)
+        else:
+            bytes_total = None
+        
+        if bytes_total:
+            ratio = min(1, bytes_done/bytes_total)
+            filled = int(ratio*self.width)
+            bar = "[{}{}] {:3d}% ".format(
+                "#"*filled, "-"*(self.width-filled), int(100*ratio))
+            size = "{}/{}".format(
+                format_size(bytes_done), format_size(bytes_total))
+        else:
+            bar = ""
+            size = format_size(bytes_done)
+        
+        line = "{}{} {}/s".format(bar, size, format_size(rate))
+        etas = [x.eta for x in events if x.eta is not None]
+        if etas:
+            line += " ETA {}".format(format_duration(max(etas)))
+        self.stream.write("\r{:<79}".format(line))
+        self.stream.flush()
+    
+    def close(self):
+        with self._lock:
+            if self._events:
+                self.render()
+                self.stream.write("\n")
+                self.stream.flush()
+
+def format_size(size):
+    for unit in ["B", "kB", "MB", "GB", "TB"]:
+        if size < 1024 or unit == "TB":
+            break
+        size /= 1024
+    return "{:.1f} {}".format(size, unit)
+
+def format_duration(duration):
+    duration = int(duration)
+    return "{}:{:02d}:{:02d}".format(
+        duration//3600, (duration//60) % 60, duration % 60)
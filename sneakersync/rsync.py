@@ -1,92 +1,491 @@
+import asyncio
+import codecs
+import collections
+import contextlib
 import logging
+import os
+import pathlib
+import re
 import socket
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
 
 sneakersync = sys.modules["sneakersync"]
 
-def send(destination, configuration, module, state, progress=False):
+def send(
+        destination, configuration, module, state, progress=False, files=None,
+        callback=None):
     source = sneakersync.get_module_root(module)
     if not source.is_dir():
         raise Exception("No such directory: {}".format(source))
+    profile = sneakersync.profiles.get_profile(configuration, module, source)
         
     command = [
         "rsync",
-        "--archive", "--acls", "--hard-links", "--xattrs",
-        "--delete", "--relative"
+        "--archive", "--acls", "--hard-links", "--xattrs", "--relative"
     ]
+    command.extend(profile.get_rsync_options(get_version()))
     if sys.platform == "darwin":
         command.extend(["--crtimes", "--fileflags"])
-    command.extend(get_verbosity_options(progress))
+    command.extend(get_verbosity_options(progress, callback))
     
-    command += get_filters(configuration["filters"])
-    command += get_filters(module["filters"])
-    command += ["/.{}/".format(source), "{}/".format(destination)]
+    command += get_filters(configuration["filters"], module["filters"])
     
-    call_subprocess(command, "send", module)
+    # NOTE: the commands of all batches append to the same log
+    log = get_log(destination, configuration, module, "send")
+    reset_log(log)
+    
+    relative_source = source.relative_to(source.anchor)
+    if files is None and module["max_entries_per_batch"] == 0:
+        command += profile.get_rsync_delete_options()
+        command += ["/.{}/".format(source), "{}/".format(destination)]
+        call_subprocess(command, "send", module, callback, log)
+        return
+    
+    if files is None:
+        batches = get_batches(
+            source, destination / relative_source,
+            configuration["filters"]+module["filters"],
+            "/".join(relative_source.parts), module["max_entries_per_batch"])
+    else:
+        batches = [files]
+    for batch in batches:
+        # Only transfer the given paths; the paths which are missing from the
+        # source are deleted from the destination.
+        with tempfile.NamedTemporaryFile() as fd:
+            for path in batch:
+                fd.write(os.fsencode(str(relative_source / path))+b"\0")
+            fd.flush()
+            call_subprocess(
+                command+[
+                    "--files-from={}".format(fd.name), "--from0",
+                    "--delete-missing-args", "--force",
+                    source.anchor, "{}/".format(destination)],
+                "send", module, callback, log)
 
-def receive(source, configuration, module, state, progress=False):
+def receive(
+        source, configuration, module, state, progress=False, delete=True,
+        callback=None, files=None, profile=None):
+    remote_root = sneakersync.get_module_root(module, state.previous_host)
+    if profile is None:
+        profile = sneakersync.profiles.get_profile(
+            configuration, module,
+            source / remote_root.relative_to(remote_root.anchor))
+    
     command = [
         "rsync",
-        "--archive", "--acls", "--hard-links", "--xattrs",
-        "--delete"
+        "--archive", "--acls", "--hard-links", "--xattrs"
     ]
+    command.extend(profile.get_rsync_options(get_version()))
+    batched = (files is None and module["max_entries_per_batch"] != 0)
+    if delete and files is None and not batched:
+        command.extend(profile.get_rsync_delete_options())
     if sys.platform == "darwin":
         command.extend(["--crtimes", "--fileflags"])
-    command.extend(get_verbosity_options(progress))
+    command.extend(get_verbosity_options(progress, callback))
+    
+    command += get_filters(configuration["filters"], module["filters"])
+    
+    log = get_log(source, configuration, module, "receive")
+    reset_log(log)
+    
+    remote_source = "{}{}/".format(source, remote_root)
+    target = sneakersync.get_module_root(module)
+    if batched:
+        batches = get_batches(
+            pathlib.Path(remote_source), target,
+            configuration["filters"]+module["filters"], "",
+            module["max_entries_per_batch"], delete)
+    else:
+        batches = [files]
+    for batch in batches:
+        with tempfile.NamedTemporaryFile() as fd:
+            arguments = []
+            if batch is not None:
+                # Only transfer the given paths, as in send
+                for path in batch:
+                    fd.write(os.fsencode(path or ".")+b"\0")
+                fd.flush()
+                arguments = [
+                    "--files-from={}".format(fd.name), "--from0", "--force",
+                    "--delete-missing-args" if delete
+                    else "--ignore-missing-args"]
+            call_subprocess(
+                command+arguments+[remote_source, "{}/".format(target)],
+                "receive", module, callback, log)
+
+def get_batches(source, target, filters, relative, max_entries, delete=True):
+    """Split the transfer of the source directory to target in batches of
+    about max_entries paths (relative to source), so that the file list of
+    each rsync process stays bounded. The hard links of a file are in the
+    same batch. If delete is True, the extraneous entries of target are
+    included, so that they are deleted as paths missing from the source.
+    The directories come last, so that their attributes are set once their
+    content is transferred.
+    
+    The paths are stored in temporary files while the tree is walked: only
+    the hard-linked files are kept in memory.
+    """
+    
+    filter_ = sneakersync.filters.get_filter(filters)
+    def is_excluded(name, path, is_directory):
+        return (
+            name == sneakersync.native.partial_directory
+            or filter_.excluded(
+                "{}/{}".format(relative, path).lstrip("/"), is_directory))
     
-    command += get_filters(configuration["filters"])
-    command += get_filters(module["filters"])
-    command += [
-        "{}{}/".format(
-            source, sneakersync.get_module_root(module, state.previous_host)), 
-        "{}/".format(sneakersync.get_module_root(module))]
+    # Paths of each group of hard links, and group of each hard-linked path
+    links = {}
+    linked = {}
+    with tempfile.TemporaryFile() as paths_fd, \
+            tempfile.TemporaryFile() as directories_fd:
+        directories = [""]
+        while directories:
+            directory = directories.pop()
+            names = set()
+            for entry in sorted(
+                    os.scandir(source / directory), key=lambda x: x.name):
+                path = "/".join(x for x in [directory, entry.name] if x)
+                is_directory = entry.is_dir(follow_symlinks=False)
+                if is_excluded(entry.name, path, is_directory):
+                    continue
+                names.add(entry.name)
+                if is_directory:
+                    directories.append(path)
+                    directories_fd.write(os.fsencode(path)+b"\0")
+                    continue
+                
+                entry_stat = entry.stat(follow_symlinks=False)
+                if (
+                        stat.S_ISREG(entry_stat.st_mode)
+                        and entry_stat.st_nlink > 1):
+                    key = (entry_stat.st_dev, entry_stat.st_ino)
+                    links.setdefault(key, []).append(path)
+                    linked[path] = key
+                paths_fd.write(os.fsencode(path)+b"\0")
+            
+            # As in rsync, excluded entries are not deleted
+            target_directory = target / directory
+            if (
+                    delete and target_directory.is_dir()
+                    and not target_directory.is_symlink()):
+                for entry in os.scandir(target_directory):
+                    path = "/".join(x for x in [directory, entry.name] if x)
+                    if not (
+                            entry.name in names
+                            or is_excluded(
+                                entry.name, path,
+                                entry.is_dir(follow_symlinks=False))):
+                        paths_fd.write(os.fsencode(path)+b"\0")
+        
+        batch = []
+        for path in read_paths(paths_fd):
+            key = linked.pop(path, None)
+            if key is not None:
+                group = links.pop(key, None)
+                if group is None:
+                    continue
+                batch.extend(group)
+            else:
+                batch.append(path)
+            if len(batch) >= max_entries:
+                yield batch
+                batch = []
+        
+        batch.append("")
+        for path in read_paths(directories_fd):
+            batch.append(path)
+            if len(batch) >= max_entries:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def read_paths(fd):
+    """Yield the NUL-terminated paths written to a binary file."""
     
-    call_subprocess(command, "receive", module)
+    fd.seek(0)
+    buffer = b""
+    for data in iter(lambda: fd.read(2**20), b""):
+        buffer += data
+        *paths, buffer = buffer.split(b"\0")
+        for path in paths:
+            yield os.fsdecode(path)
 
-def get_filters(filters):
-    """Return the rsync options for the given filters."""
+def get_filters(*filters):
+    """Return the rsync options for the given lists of filters. Each list is
+    compiled to a merge file, once per run, so that the number of filters
+    is not limited by the maximum length of the command line.
+    """
     
     arguments = []
-    for filter_ in filters:
-        if len(filter_) > 1:
-            raise Exception(
-                "Filter must contain only one entry: {}".format(filter_))
-        if "exclude" in filter_:
-            arguments += ["--exclude", filter_["exclude"]]
-        elif "include" in filter_:
-            arguments += ["--include", filter_["include"]]
-        else:
-            raise Exception(
-                "Filter must contain include or exclude: {}".format(filter_))
+    for rules in filters:
+        path = sneakersync.filters.get_merge_file(rules)
+        if path is not None:
+            arguments.append("--filter=merge {}".format(path))
     return arguments
 
-def get_verbosity_options(progress):
+def get_verbosity_options(progress, callback=None):
     options = []
     if progress:
         options.append("--info=name")
-    if sneakersync.logger.getEffectiveLevel() <= logging.INFO:
+    if callback is not None:
+        options.append("--info=progress2")
+    if (
+            callback is not None
+            or sneakersync.logger.getEffectiveLevel() <= logging.INFO):
         options.append("--stats")
     if sneakersync.logger.getEffectiveLevel() <= logging.DEBUG:
         options.extend(["--verbose", "--verbose"])
     return options
 
-def call_subprocess(command, action, module):
-    """Call a command, redirect output given current logging level."""
+def get_log(drive, configuration, module, action):
+    """Path to the log file of a module on the drive, or None if logging is
+    disabled.
+    """
+    
+    if not configuration["log"]:
+        return None
+    return drive / "sneakersync.logs" / "{}.{}.log".format(
+        sneakersync.get_module_id(module), action)
+
+def reset_log(log):
+    """Empty the log file of a module, if any: the commands of the module
+    append their output to it.
+    """
+    
+    if log is not None:
+        log.parent.mkdir(exist_ok=True)
+        log.open("wb").close()
+
+# Version of the rsync executables, found once per run
+_versions = {}
+_versions_lock = threading.Lock()
+
+def get_version(executable="rsync"):
+    """Return the version of rsync as a tuple, or None if it cannot be found.
+    """
+    
+    with _versions_lock:
+        if executable not in _versions:
+            version = None
+            try:
+                output = subprocess.run(
+                    [executable, "--version"], stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL).stdout.decode(errors="replace")
+                match = re.search(r"version v?(\d+(?:\.\d+)+)", output)
+                if match:
+                    version = tuple(int(x) for x in match.group(1).split("."))
+            except OSError:
+                pass
+            _versions[executable] = version
+        return _versions[executable]
+
+# Number of output lines kept for the error report
+output_lines = 100
+
+def call_subprocess(command, action, module, callback=None, log=None):
+    """Call a command, redirect output given current logging level. If a
+    callback is specified, the progress and statistics lines of rsync are
+    converted to progress events. The last lines of output are kept for the
+    error report; if log is specified, the whole output is also written to
+    this file.
+    
+    When called from the async API, the command runs on its event loop.
+    """
+    
+    runner = sneakersync.operations.get_runner()
+    if runner is not None:
+        return runner.run(
+            call_subprocess_async(command, action, module, callback, log))
+    
+    with contextlib.ExitStack() as stack:
+        output = Output(module, callback, stack, log)
+        process = stack.enter_context(subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+        for data in iter(lambda: process.stdout.read1(2**16), b""):
+            output.feed(data)
+        output.close()
+        process.wait()
+    
+    output.finish(process.returncode, action)
+
+async def call_subprocess_async(
+        command, action, module, callback=None, log=None):
+    """Asynchronous version of call_subprocess. If the task is cancelled, the
+    command is terminated, and killed if it does not exit within
+    termination_timeout seconds.
+    """
+    
+    with contextlib.ExitStack() as stack:
+        output = Output(module, callback, stack, log)
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            while True:
+                data = await process.stdout.read(2**16)
+                if not data:
+                    break
+                output.feed(data)
+            await process.wait()
+        except asyncio.CancelledError:
+            await terminate(process)
+            raise
+        output.close()
+    
+    output.finish(process.returncode, action)
+
+# Delay between the termination of a command and its killing, in seconds
+termination_timeout = 10
+
+async def terminate(process):
+    """Terminate a process created by asyncio, kill it if it does not exit.
+    """
+    
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), termination_timeout)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+class Output(object):
+    """Process the output of rsync: progress and statistics lines are
+    converted to progress events if a callback is specified, the other lines
+    are written on stdout. The last lines are kept for the error report, and
+    the whole output is written to the log file, if any.
+    """
     
-    output = []
-    process = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    for line in iter(process.stdout.readline, b""):
-        output.append(line)
+    def __init__(self, module, callback, stack, log=None):
+        self.module = module
+        self.callback = callback
+        self.log = log
+        self.show_stats = (
+            sneakersync.logger.getEffectiveLevel() <= logging.INFO)
+        
+        # NOTE: with --verbose, the output contains one line per file and may
+        # not fit in memory.
+        self.lines = collections.deque(maxlen=output_lines)
+        self.dropped = 0
+        self.statistics = {}
+        
         encoding = (
             getattr(sys.stdout, "encoding", None)
             or getattr(sys.stdin, "encoding", None)
             or "utf-8"
         )
-        sys.stdout.write(line.decode(encoding))
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        # NOTE: progress lines are terminated by "\r"
+        self.buffer = ""
+        
+        self.log_fd = None
+        if log is not None:
+            log.parent.mkdir(exist_ok=True)
+            self.log_fd = stack.enter_context(log.open("ab"))
+    
+    def feed(self, data):
+        if self.log_fd is not None:
+            self.log_fd.write(data)
+        self.buffer += self.decoder.decode(data)
+        lines = _line.findall(self.buffer)
+        self.buffer = self.buffer[sum(len(x) for x in lines):]
+        for line in lines:
+            if self.callback is not None:
+                event = parse_progress(line)
+                if event is not None:
+                    self.callback(event)
+                    continue
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(line)
+            if (
+                    self.callback is not None
+                    and parse_statistics(line, self.statistics)
+                    and not self.show_stats):
+                continue
+            sneakersync.write_output(self.module, line)
+    
+    def close(self):
+        self.buffer += self.decoder.decode(b"", True)
+        if self.buffer:
+            self.lines.append(self.buffer)
+    
+    def finish(self, returncode, action):
+        """Raise an exception if the command failed, otherwise send the
+        statistics to the callback.
+        """
+        
+        if returncode != 0:
+            text = "".join(self.lines)
+            if self.dropped:
+                text = "[{} lines omitted]\n{}".format(self.dropped, text)
+            if self.log is not None:
+                text += "\nFull output in {}".format(self.log)
+            raise sneakersync.Exception(action, self.module, text)
+        
+        if self.callback is not None and self.statistics:
+            size = int(self.statistics.get("Total transferred file size", 0))
+            files = int(
+                self.statistics.get("Number of regular files transferred", 0))
+            self.callback(sneakersync.progress.Progress(
+                size, size, files, files, None, 0, self.statistics))
+
+_line = re.compile(r"[^\r\n]*[\r\n]")
+
+_progress = re.compile(
+    r"^\s*(?P<bytes>[\d,.]+)\s+(?P<percent>\d+)%"
+    r"\s+(?P<rate>[\d,.]+)(?P<unit>[kMGT]?B)/s"
+    r"\s+(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+)"
+    r"(?:\s+\(xfr#(?P<transferred>\d+), \w\w-chk=(?P<remaining>\d+)/"
+    r"(?P<total>\d+)\))?")
+
+_units = {"B": 1, "kB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+
+def parse_progress(line):
+    """Parse a progress line of "rsync --info=progress2", return None if the
+    line is not a progress line.
+    """
+    
+    match = _progress.match(line)
+    if match is None:
+        return None
+    
+    bytes_done = int(re.sub(r"\D", "", match.group("bytes")))
+    percent = int(match.group("percent"))
+    rate = (
+        float(match.group("rate").replace(",", "."))
+        * _units[match.group("unit")])
+    eta = (
+        3600*int(match.group("hours")) + 60*int(match.group("minutes"))
+        + int(match.group("seconds")))
+    
+    event = sneakersync.progress.Progress(
+        bytes_done, 
+        bytes_done*100//percent if percent > 0 else None,
+        rate=rate, eta=eta)
+    if match.group("total") is not None:
+        event.files_total = int(match.group("total"))
+        event.files_done = event.files_total - int(match.group("remaining"))
+    return event
+
+_statistics = re.compile(r"^(?P<name>[A-Z][\w ]+): (?P<value>[\d,.]+)(?: |$)")
+_summary = re.compile(r"^(sent .* bytes/sec|total size is .*)?$")
+
+def parse_statistics(line, statistics):
+    """Parse a line of "rsync --stats" and store its numerical value in the
+    statistics dictionary. Return whether the line was a statistics line.
+    """
     
-    process.wait()
-    process.stdout.close()
-    if process.returncode != 0:
-        raise sneakersync.Exception(action, module, b"".join(output))
+    match = _statistics.match(line.strip())
+    if match is None:
+        return _summary.match(line.strip()) is not None
+    statistics[match.group("name")] = float(
+        re.sub(r"[^\d.]", "", match.group("value").replace(",", "")))
+    return True
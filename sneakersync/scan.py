@@ -0,0 +1,214 @@
+import collections
+import heapq
+import os
+import struct
+import sys
+import tempfile
+
+sneakersync = sys.modules["sneakersync"]
+
+# Number of entries sorted in memory before being written to the spill file,
+# and size of the buffer of each sorted run while merging them.
+chunk_size = 2**17
+buffer_size = 2**16
+
+class Entry(object):
+    """Status of an entry of a module, with its path relative to the module
+    root.
+    """
+    
+    __slots__ = ["path", "size", "mtime", "ctime", "inode", "mode", "nlink"]
+    
+    _record = struct.Struct("<IqqqQII")
+    
+    def __init__(self, path, size, mtime, ctime, inode, mode, nlink):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.ctime = ctime
+        self.inode = inode
+        self.mode = mode
+        self.nlink = nlink
+    
+    @staticmethod
+    def from_stat(path, stat_):
+        return Entry(
+            path, stat_.st_size, stat_.st_mtime_ns, stat_.st_ctime_ns,
+            stat_.st_ino, stat_.st_mode, stat_.st_nlink)
+    
+    def get_manifest_entry(self):
+        """Return the entry in the format of sneakersync.manifest."""
+        
+        return (self.size, self.mtime, self.ctime, self.inode, self.mode)
+    
+    def pack(self):
+        path = os.fsencode(self.path)
+        return Entry._record.pack(
+            len(path), self.size, self.mtime, self.ctime, self.inode,
+            self.mode, self.nlink) + path
+    
+    def __eq__(self, other):
+        return isinstance(other, Entry) and all(
+            getattr(self, x) == getattr(other, x) for x in Entry.__slots__)
+    
+    def __repr__(self):
+        return "Entry({})".format(
+            ", ".join(repr(getattr(self, x)) for x in Entry.__slots__))
+
+class Spill(object):
+    """Entries sorted by path, stored in a temporary file: the entries are
+    sorted by chunks of chunk_size entries, and the sorted runs are merged
+    when iterating.
+    """
+    
+    def __init__(self):
+        self.fd = tempfile.TemporaryFile()
+        # Start and end offset of each sorted run
+        self.runs = []
+        self.count = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def close(self):
+        self.fd.close()
+    
+    def extend(self, entries):
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                self._write(chunk)
+                chunk = []
+        if chunk:
+            self._write(chunk)
+    
+    def __iter__(self):
+        self.fd.flush()
+        return heapq.merge(
+            *[self._read(start, end) for start, end in self.runs],
+            key=lambda x: x.path)
+    
+    def __len__(self):
+        return self.count
+    
+    def _write(self, chunk):
+        chunk.sort(key=lambda x: x.path)
+        start = self.fd.seek(0, os.SEEK_END)
+        self.fd.write(b"".join(x.pack() for x in chunk))
+        self.runs.append((start, self.fd.tell()))
+        self.count += len(chunk)
+    
+    def _read(self, start, end):
+        """Yield the entries of a run, reading the file by blocks."""
+        
+        record_size = Entry._record.size
+        buffer = b""
+        offset = start
+        while offset < end or buffer:
+            if offset < end:
+                data = os.pread(
+                    self.fd.fileno(), min(buffer_size, end-offset), offset)
+                offset += len(data)
+                buffer += data
+            position = 0
+            while len(buffer)-position >= record_size:
+                length, *fields = Entry._record.unpack_from(buffer, position)
+                if len(buffer)-position < record_size+length:
+                    break
+                path = os.fsdecode(
+                    buffer[position+record_size:position+record_size+length])
+                yield Entry(path, *fields)
+                position += record_size+length
+            buffer = buffer[position:]
+            if offset >= end and buffer:
+                raise Exception("Truncated spill file")
+
+def walk(root, filter_, relative="", breadth_first=False, errors=None):
+    """Yield the entries of the root directory, starting with root itself.
+    Excluded entries are skipped, and excluded directories are not walked.
+    The relative path of root from the root of the transfer is used to
+    match the filters. Entries which disappear during the walk are skipped.
+    
+    Directories are walked depth-first, or breadth-first if breadth_first
+    is True. If errors is a list, the directories which cannot be listed
+    are skipped and their error is appended to it.
+    """
+    
+    try:
+        yield Entry.from_stat("", os.lstat(root))
+    except FileNotFoundError:
+        return
+    
+    directories = collections.deque([""])
+    while directories:
+        if breadth_first:
+            directory = directories.popleft()
+        else:
+            directory = directories.pop()
+        try:
+            iterator = os.scandir(os.path.join(root, directory))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except OSError as e:
+            if errors is None:
+                raise
+            errors.append("{}: {}".format(directory, e))
+            continue
+        with iterator:
+            for entry in iterator:
+                path = "{}/{}".format(directory, entry.name).lstrip("/")
+                try:
+                    is_directory = entry.is_dir(follow_symlinks=False)
+                    if filter_.excluded(
+                            "{}/{}".format(relative, path).lstrip("/"),
+                            is_directory):
+                        continue
+                    entry_stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                yield Entry.from_stat(path, entry_stat)
+                if is_directory:
+                    directories.append(path)
+
+def scan(configuration, module):
+    """Walk a module and return its entries, sorted by path, in a Spill."""
+    
+    root = sneakersync.get_module_root(module)
+    if not root.is_dir():
+        raise Exception("No such directory: {}".format(root))
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    
+    spill = Spill()
+    try:
+        spill.extend(
+            walk(root, filter_, "/".join(root.relative_to(root.anchor).parts)))
+    except BaseException:
+        spill.close()
+        raise
+    return spill
+
+def scan_modules(configuration, modules=None, jobs=1):
+    """Scan several modules (all modules by default) in parallel, return the
+    Spill of each module, by module identifier. Modules on the same device
+    are scanned one after the other.
+    """
+    
+    if modules is None:
+        modules = configuration["modules"]
+    
+    spills = {}
+    def scan_module(module):
+        spills[sneakersync.get_module_id(module)] = scan(configuration, module)
+    
+    try:
+        sneakersync.operations.run_modules(modules, scan_module, "scan", jobs)
+    except BaseException:
+        for spill in spills.values():
+            spill.close()
+        raise
+    return spills
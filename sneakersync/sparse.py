@@ -0,0 +1,128 @@
+import errno
+import json
+import os
+import sys
+
+sneakersync = sys.modules["sneakersync"]
+
+# Errors of SEEK_DATA and SEEK_HOLE when the file system does not support them
+_unsupported = {errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+def is_sparse(stat_):
+    """Test whether a file has fewer blocks than its size requires."""
+    
+    blocks = getattr(stat_, "st_blocks", None)
+    return blocks is not None and blocks*512 < stat_.st_size
+
+def get_extents(fd, size, start=0):
+    """Return the data extents of a file after start, as (offset, length).
+    If the file system cannot find the holes, the whole file is data.
+    """
+    
+    if not hasattr(os, "SEEK_DATA"):
+        return [(start, size-start)] if size > start else []
+    
+    extents = []
+    offset = start
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # No data after offset
+                break
+            elif e.errno in _unsupported:
+                return [(start, size-start)]
+            raise
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        if hole > data:
+            extents.append((data, hole-data))
+        offset = hole
+    os.lseek(fd, 0, os.SEEK_SET)
+    return extents
+
+def clip(extents, start):
+    """Return the parts of the extents which are after start."""
+    
+    return [
+        (max(offset, start), offset+length-max(offset, start))
+        for offset, length in extents if offset+length > start]
+
+def copy_extents(source_fd, target_fd, extents, size):
+    """Copy the data extents of a file, and leave holes elsewhere. Return
+    the number of bytes of data.
+    """
+    
+    copied = 0
+    for offset, length in extents:
+        os.lseek(source_fd, offset, os.SEEK_SET)
+        os.lseek(target_fd, offset, os.SEEK_SET)
+        sneakersync.native.copy_contents(source_fd, target_fd, length)
+        copied += length
+    os.ftruncate(target_fd, size)
+    return copied
+
+class ExtentMap(object):
+    """Data extents of the sparse files of a module, stored on the drive, so
+    that their holes can be re-created when receiving even if the file
+    system of the drive does not support them.
+    """
+    
+    def __init__(self, path, entries=None):
+        self.path = path
+        # Path relative to the module root -> (size, mtime, extents)
+        self.entries = entries or {}
+    
+    def get(self, path, stat_):
+        """Return the extents of a file, or None if they are unknown or if
+        the file was modified since they were recorded.
+        """
+        
+        entry = self.entries.get(path)
+        if (
+                entry is None or entry[0] != stat_.st_size
+                or entry[1]//10**9 != stat_.st_mtime_ns//10**9):
+            return None
+        return entry[2]
+    
+    def save(self, root):
+        """Save the map, forgetting the files which are not in root anymore.
+        """
+        
+        for path in list(self.entries):
+            if not os.path.isfile(os.path.join(root, path)):
+                del self.entries[path]
+        
+        if not self.entries:
+            if self.path.exists():
+                self.path.unlink()
+            return
+        
+        self.path.parent.mkdir(exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        with temporary.open("w") as fd:
+            json.dump(self.entries, fd)
+        os.replace(temporary, self.path)
+    
+    @staticmethod
+    def load(path):
+        """Load a map, return an empty map if it does not exist or is
+        invalid.
+        """
+        
+        try:
+            with path.open() as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return ExtentMap(path)
+        except ValueError:
+            sneakersync.logger.warning("Invalid extent map: {}".format(path))
+            return ExtentMap(path)
+        
+        return ExtentMap(path, {
+            path_: (size, mtime, [tuple(x) for x in extents])
+            for path_, (size, mtime, extents) in data.items()})
+
+def get_path(drive, module):
+    return (
+        drive / "sneakersync.extents" / sneakersync.get_module_id(module))
@@ -4,11 +4,47 @@ import yaml
 class State(object):
     """State of the sneakernet (previous operation, previous host, etc.)."""
     
-    def __init__(self, path, previous_direction, previous_date, previous_host):
+    def __init__(
+            self, path, previous_direction, previous_date, previous_host,
+            generation=0, generations=None, throughput=None,
+            checkpoints=None, tokens=None, transfers=None,
+            module_generations=None, vectors=None, volume=None):
         self.path = path
         self.previous_direction = previous_direction
         self.previous_date = previous_date
         self.previous_host = previous_host
+        
+        # Number of the last incremental bundle, and last bundle received by
+        # each host.
+        self.generation = generation
+        self.generations = generations or {}
+        
+        # Measured throughput of the previous send, in bytes per second
+        self.throughput = throughput
+        
+        # Modules already sent by an interrupted send: module identifier ->
+        # {"host", "date", "checksum" of the module configuration}
+        self.checkpoints = checkpoints or {}
+        
+        # Random token of the content of each module on the drive, changed by
+        # each send: module identifier -> token
+        self.tokens = tokens or {}
+        
+        # Last transfer of each module: module identifier -> {"direction",
+        # "profile", "date", "duration" and, when known, "size" and
+        # "throughput"}
+        self.transfers = transfers or {}
+        
+        # In mirror mode, number of sends of each module, and generation of
+        # each module last sent or received by each host: module identifier
+        # -> generation, and host -> module identifier -> generation.
+        self.module_generations = module_generations or {}
+        self.vectors = vectors or {}
+        
+        # If the drive is a volume of a set, see sneakersync.volumes: {"set"
+        # identifier, "number" of the volume, "count" of volumes, whether
+        # the volume is "complete", "shards" of all volumes}
+        self.volume = volume
     
     def save(self):
         data = copy.copy(vars(self))
@@ -30,4 +66,39 @@ class State(object):
                 if data:
                     state.update(data)
         
+        state["generation"] = int(state.get("generation", 0))
+        state["generations"] = {
+            host: int(generation) 
+            for host, generation in state.get("generations", {}).items()}
+        
+        state["module_generations"] = {
+            module_id: int(generation)
+            for module_id, generation
+            in state.get("module_generations", {}).items()}
+        state["vectors"] = {
+            host: {
+                module_id: int(generation)
+                for module_id, generation in vector.items()}
+            for host, vector in state.get("vectors", {}).items()}
+        
+        volume = state.get("volume")
+        if volume in [None, "null"]:
+            state["volume"] = None
+        else:
+            state["volume"] = {
+                "set": volume["set"], "number": int(volume["number"]),
+                "count": int(volume["count"]),
+                "complete": (volume["complete"] == "true"),
+                "shards": [
+                    {
+                        "module": x["module"], "volume": int(x["volume"]),
+                        "shard": int(x["shard"]), "shards": int(x["shards"]),
+                        "start": x["start"], "end": x["end"],
+                        "size": int(x["size"])}
+                    for x in volume["shards"]]}
+        
+        throughput = state.get("throughput")
+        state["throughput"] = (
+            float(throughput) if throughput not in [None, "null"] else None)
+        
         return State(path, **state)
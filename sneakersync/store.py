@@ -0,0 +1,411 @@
+import base64
+import errno
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+sneakersync = sys.modules["sneakersync"]
+
+# Linux ioctl sharing the extents of a file with another one (reflink)
+FICLONE = 0x40049409
+
+class Store(object):
+    """Content-addressed storage on the drive: the content of each file is
+    stored once, under its hash, and each module is described by a tree
+    referencing these contents.
+    """
+    
+    def __init__(self, drive):
+        self.path = drive / "sneakersync.store"
+        self.objects = self.path / "objects"
+        self.trees = self.path / "trees"
+    
+    def get_object(self, hash_):
+        return self.objects / hash_[:2] / hash_[2:]
+    
+    def add(self, path, hash_=None):
+        """Store the content of a file if it is not already in the store. If
+        the expected hash of the content is unknown, the file is hashed while
+        it is copied to a temporary object, which is then renamed to its
+        hash. Return the hash of the content, which may differ from the
+        expected one if the file was modified since it was hashed, and
+        whether the content was added to the store.
+        """
+        
+        if hash_ is not None and self.get_object(hash_).is_file():
+            return hash_, False
+        
+        # NOTE: modules sent in parallel may store the same content at the
+        # same time: each writer uses its own temporary file.
+        self.objects.mkdir(parents=True, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(
+            prefix=".", suffix=".sneakersync", dir=self.objects)
+        hasher = hashlib.sha256()
+        try:
+            with open(path, "rb") as source_fd, \
+                    open(fd, "wb") as target_fd:
+                while True:
+                    data = source_fd.read(2**20)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    target_fd.write(data)
+            hash_ = hasher.hexdigest()
+            added = not self.get_object(hash_).is_file()
+            if added:
+                self.get_object(hash_).parent.mkdir(exist_ok=True)
+                os.replace(temporary, self.get_object(hash_))
+        finally:
+            if os.path.lexists(temporary):
+                os.unlink(temporary)
+        return hash_, added
+    
+    def load_tree(self, module):
+        path = self.trees / sneakersync.get_module_id(module)
+        if not path.is_file():
+            return None
+        with gzip.open(path, "rt") as fd:
+            header = json.loads(fd.readline())
+            header["entries"] = [json.loads(line) for line in fd]
+        return header
+    
+    def save_tree(self, module, tree):
+        self.trees.mkdir(parents=True, exist_ok=True)
+        path = self.trees / sneakersync.get_module_id(module)
+        temporary = path.with_suffix(".tmp")
+        with gzip.open(temporary, "wt") as fd:
+            header = {x: y for x, y in tree.items() if x != "entries"}
+            fd.write(json.dumps(header)+"\n")
+            for entry in tree["entries"]:
+                fd.write(json.dumps(entry)+"\n")
+        os.replace(temporary, path)
+    
+    def collect_garbage(self, configuration):
+        """Remove the trees of unknown modules and the unreferenced objects."""
+        
+        modules = set(
+            sneakersync.get_module_id(x) for x in configuration["modules"])
+        referenced = set()
+        trees = list(self.trees.iterdir()) if self.trees.is_dir() else []
+        for path in trees:
+            if path.name not in modules:
+                path.unlink()
+                continue
+            with gzip.open(path, "rt") as fd:
+                fd.readline()
+                for line in fd:
+                    hash_ = json.loads(line).get("hash")
+                    if hash_ is not None:
+                        referenced.add(hash_)
+        
+        if not self.objects.is_dir():
+            return
+        for directory in self.objects.iterdir():
+            if not directory.is_dir():
+                continue
+            for path in directory.iterdir():
+                if directory.name+path.name not in referenced:
+                    path.unlink()
+
+def send(
+        destination, configuration, module, state, progress=False,
+        callback=None):
+    source = sneakersync.get_module_root(module)
+    if not source.is_dir():
+        raise Exception("No such directory: {}".format(source))
+    
+    store = Store(destination)
+    
+    # Do not hash again the files which did not change since the previous
+    # send from this host.
+    previous = store.load_tree(module)
+    cache = {}
+    if previous is not None and previous["host"] == socket.gethostname():
+        cache = {x["path"]: x for x in previous["entries"] if "hash" in x}
+    
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    relative = "/".join(source.relative_to(source.anchor).parts)
+    
+    tracker = sneakersync.progress.Tracker(callback)
+    entries = []
+    errors = []
+    links = {}
+    for path, entry_stat in walk(source, filter_, relative, errors):
+        full_path = os.path.join(source, path)
+        try:
+            entry = get_entry(full_path, path, entry_stat)
+            if stat.S_ISREG(entry_stat.st_mode):
+                key = (entry_stat.st_dev, entry_stat.st_ino)
+                if entry_stat.st_nlink > 1 and key in links:
+                    entry["link"] = links[key]
+                    entries.append(entry)
+                    continue
+                elif entry_stat.st_nlink > 1:
+                    links[key] = path
+                
+                # The new files are hashed while they are stored, so that
+                # they are only read once.
+                cached = cache.get(path)
+                hash_ = None
+                if cached is not None and all(
+                        cached[x] == entry[x]
+                        for x in ["size", "mtime", "inode"]):
+                    hash_ = cached["hash"]
+                hash_, added = store.add(full_path, hash_)
+                if added:
+                    report(module, progress, path)
+                    tracker.update(entry["size"])
+                entry["hash"] = hash_
+            entries.append(entry)
+        except OSError as e:
+            errors.append("{}: {}".format(path, e))
+    
+    if errors:
+        raise sneakersync.Exception("send", module, "\n".join(errors))
+    
+    store.save_tree(module, {
+        "host": socket.gethostname(), "root": str(source),
+        "entries": entries})
+    tracker.finish(len(entries))
+
+def receive(
+        source, configuration, module, state, progress=False,
+        callback=None):
+    store = Store(source)
+    tree = store.load_tree(module)
+    if tree is None:
+        raise Exception(
+            "Module {} is not in the store".format(
+                sneakersync.get_module_root(module)))
+    
+    # Received file for each content, used to create reflinks
+    contents = {}
+    def write(entry, target):
+        written = False
+        if not is_up_to_date(entry, target):
+            materialize(
+                store.get_object(entry["hash"]), contents.get(entry["hash"]),
+                target)
+            written = True
+        contents.setdefault(entry["hash"], target)
+        return written
+    
+    extract(configuration, module, tree["entries"], write, progress, callback)
+
+def extract(configuration, module, entries, write, progress, callback):
+    """Create the entries of a module in its root, delete the extraneous
+    files and set the attributes of directories once their content is
+    created. write is called with the entry and the target path of each
+    regular file which is not a hard link, and returns whether it wrote the
+    file.
+    """
+    
+    root = sneakersync.get_module_root(module)
+    root.parent.mkdir(parents=True, exist_ok=True)
+    filter_ = sneakersync.filters.get_filter(
+        configuration["filters"]+module["filters"])
+    
+    tracker = sneakersync.progress.Tracker(callback)
+    errors = []
+    directories = []
+    for entry in entries:
+        target = root / entry["path"] if entry["path"] else root
+        mode = entry["mode"]
+        try:
+            if stat.S_ISDIR(mode):
+                if target.is_symlink() or (
+                        target.exists() and not target.is_dir()):
+                    sneakersync.native.remove(target)
+                if not target.is_dir():
+                    target.mkdir(mode=0o700)
+                elif not os.access(target, os.W_OK | os.X_OK):
+                    target.chmod(
+                        target.stat().st_mode | stat.S_IWUSR | stat.S_IXUSR)
+                directories.append((target, entry))
+                continue
+            elif stat.S_ISLNK(mode):
+                if not (
+                        target.is_symlink()
+                        and os.readlink(target) == entry["target"]):
+                    sneakersync.native.remove(target)
+                    os.symlink(entry["target"], target)
+                    report(module, progress, entry["path"])
+            elif "link" in entry:
+                link = root / entry["link"]
+                if not (
+                        os.path.lexists(target)
+                        and os.path.samefile(link, target)):
+                    sneakersync.native.remove(target)
+                    os.link(link, target)
+                    report(module, progress, entry["path"])
+            elif stat.S_ISREG(mode):
+                if write(entry, target):
+                    report(module, progress, entry["path"])
+                    tracker.update(entry["size"])
+            else:
+                sneakersync.native.remove(target)
+                os.mknod(target, mode, entry["rdev"])
+            set_metadata(target, entry)
+        except OSError as e:
+            errors.append("{}: {}".format(entry["path"], e))
+    
+    # As in rsync, excluded entries are not deleted
+    paths = set(x["path"] for x in entries)
+    for path, entry_stat in walk(root, filter_, "", errors):
+        if path not in paths:
+            sneakersync.native.remove(root / path)
+            report(module, progress, "deleting {}".format(path))
+    
+    for target, entry in reversed(directories):
+        try:
+            set_metadata(target, entry)
+        except OSError as e:
+            errors.append("{}: {}".format(entry["path"], e))
+    
+    if errors:
+        raise sneakersync.Exception("receive", module, "\n".join(errors))
+    tracker.finish(len(entries))
+
+def walk(root, filter_, relative, errors):
+    """Yield the path (relative to root) and status of the entries below root
+    which are not excluded, starting with root itself, depth-first and in
+    name order. Excluded directories and directories which are not in the
+    yielded paths are not walked.
+    """
+    
+    def list_directory(directory):
+        try:
+            return iter(
+                sorted(
+                    os.scandir(os.path.join(root, directory)),
+                    key=lambda x: x.name))
+        except OSError as e:
+            errors.append("{}: {}".format(directory, e))
+            return iter([])
+    
+    yield "", os.lstat(root)
+    
+    # NOTE: the walk is iterative, so that deep trees do not exceed the
+    # recursion limit.
+    stack = [("", list_directory(""))]
+    while stack:
+        directory, iterator = stack[-1]
+        entry = next(iterator, None)
+        if entry is None:
+            stack.pop()
+            continue
+        path = "/".join(x for x in [directory, entry.name] if x)
+        is_directory = entry.is_dir(follow_symlinks=False)
+        transfer_path = "{}/{}".format(relative, path).lstrip("/")
+        if filter_.excluded(transfer_path, is_directory):
+            continue
+        yield path, entry.stat(follow_symlinks=False)
+        if is_directory and os.path.isdir(entry.path):
+            stack.append((path, list_directory(path)))
+
+def get_entry(path, relative, entry_stat):
+    """Return the description of a file system entry."""
+    
+    entry = {
+        "path": relative, "mode": entry_stat.st_mode,
+        "uid": entry_stat.st_uid, "gid": entry_stat.st_gid,
+        "atime": entry_stat.st_atime_ns, "mtime": entry_stat.st_mtime_ns}
+    
+    if hasattr(os, "listxattr"):
+        try:
+            entry["xattrs"] = {
+                name: base64.b64encode(
+                    os.getxattr(path, name, follow_symlinks=False)).decode()
+                for name in os.listxattr(path, follow_symlinks=False)}
+        except OSError as e:
+            if e.errno not in [errno.ENOTSUP, errno.EPERM]:
+                raise
+    
+    if stat.S_ISLNK(entry_stat.st_mode):
+        entry["target"] = os.readlink(path)
+    elif stat.S_ISREG(entry_stat.st_mode):
+        entry["size"] = entry_stat.st_size
+        entry["inode"] = entry_stat.st_ino
+    elif not stat.S_ISDIR(entry_stat.st_mode):
+        entry["rdev"] = entry_stat.st_rdev
+    
+    return entry
+
+def set_metadata(path, entry):
+    """Set the owner, mode, extended attributes and times of path."""
+    
+    is_link = stat.S_ISLNK(entry["mode"])
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        os.chown(path, entry["uid"], entry["gid"], follow_symlinks=False)
+    if not is_link:
+        os.chmod(path, stat.S_IMODE(entry["mode"]))
+    
+    if hasattr(os, "listxattr"):
+        xattrs = {
+            x: base64.b64decode(y) for x, y in entry.get("xattrs", {}).items()}
+        try:
+            for name in os.listxattr(path, follow_symlinks=False):
+                if name not in xattrs:
+                    os.removexattr(path, name, follow_symlinks=False)
+            for name, value in xattrs.items():
+                os.setxattr(path, name, value, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in [errno.ENOTSUP, errno.EPERM]:
+                raise
+            sneakersync.logger.warning(
+                "Could not set attributes on {}".format(path))
+    
+    if not is_link or os.utime in os.supports_follow_symlinks:
+        os.utime(
+            path, ns=(entry["atime"], entry["mtime"]), follow_symlinks=False)
+
+def materialize(object_, clone, target):
+    """Create target with the content of an object of the store. If a file
+    with the same content was already received, try to share its extents.
+    """
+    
+    temporary = target.with_name(".{}.sneakersync".format(target.name))
+    try:
+        with open(temporary, "wb") as target_fd:
+            cloned = False
+            if clone is not None:
+                try:
+                    with open(clone, "rb") as clone_fd:
+                        fcntl.ioctl(
+                            target_fd.fileno(), FICLONE, clone_fd.fileno())
+                    cloned = True
+                except OSError:
+                    pass
+            if not cloned:
+                with open(object_, "rb") as source_fd:
+                    sneakersync.native.copy_contents(
+                        source_fd.fileno(), target_fd.fileno())
+        if target.is_dir() and not target.is_symlink():
+            sneakersync.native.remove(target)
+        os.replace(temporary, target)
+    finally:
+        if os.path.lexists(temporary):
+            os.unlink(temporary)
+
+def is_up_to_date(entry, target):
+    """Quick check of rsync: same size and same modification time."""
+    
+    try:
+        target_stat = os.stat(target, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(target_stat.st_mode)
+        and target_stat.st_size == entry["size"]
+        and target_stat.st_mtime_ns//10**9 == entry["mtime"]//10**9)
+
+def report(module, progress, message):
+    if progress:
+        sneakersync.write_output(module, "{}\n".format(message))
@@ -0,0 +1,488 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+import socket
+import stat
+import sys
+import time
+import uuid
+
+sneakersync = sys.modules["sneakersync"]
+
+# The space used by each entry on a drive is counted in blocks of this size
+block_size = 4096
+
+# When the modules do not fit on a single drive, they are spread over a set
+# of drives, the volumes. Modules which do not fit on a volume are cut in
+# shards: ranges of paths, in the order of sneakersync.scan. The state of
+# each volume records the shards of all volumes, so that any of them can
+# tell which volumes are missing.
+#
+# A shard is a dictionary with the module identifier ("module"), the volume
+# number ("volume", starting at 1), the number of the shard and the number of
+# shards of the module ("shard", "shards"), the first path of the shard and
+# the first path of the next shard ("start", "end", where an empty end means
+# the end of the module) and the space it uses ("size").
+
+def send(
+        destinations, progress, backend, jobs=None, callback=None,
+        metrics_json=None, confirmation=None):
+    """Send the modules on a set of drives, as in sneakersync.operations.send.
+    The configuration is read from the first drive and copied to the other
+    ones.
+    """
+    
+    confirm_ = confirmation or sneakersync.operations.confirm
+    configuration = sneakersync.operations.read_configuration(
+        destinations[0] / "sneakersync.cfg")
+    check(configuration)
+    states = [
+        sneakersync.State.load(x / "sneakersync.dat") for x in destinations]
+    jobs = sneakersync.operations.get_jobs(jobs, configuration)
+    host = socket.gethostname()
+    
+    sent = [x for x in states if x.previous_direction == "send"]
+    if sent:
+        confirmed = confirm_(
+            "WARNING: "
+            "do you want to overwrite the files sent from {} on {}?".format(
+                sent[0].previous_host, sent[0].previous_date.strftime("%c")))
+        if not confirmed:
+            return 0
+    
+    volumes = plan(destinations, configuration, states, jobs)
+    if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+        print(report(destinations, configuration, volumes), end="")
+    
+    set_id = uuid.uuid4().hex
+    shards = [x for items in volumes for x in items]
+    count = sum(1 for x in volumes if x)
+    modules = {
+        sneakersync.get_module_id(x): x for x in configuration["modules"]}
+    recorder = sneakersync.metrics.Recorder("send", callback)
+    
+    for destination, state, items in zip(destinations, states, volumes):
+        if not items:
+            continue
+        if destination != destinations[0]:
+            shutil.copyfile(
+                destinations[0] / "sneakersync.cfg",
+                destination / "sneakersync.cfg")
+        
+        # Until the volume is complete, it cannot be received
+        state.volume = {
+            "set": set_id, "number": items[0]["volume"], "count": count,
+            "complete": False, "shards": shards}
+        state.save()
+        clean(destination, configuration, items)
+        
+        drive_shards = {x["module"]: x for x in items}
+        def send_module(module):
+            shard = drive_shards[sneakersync.get_module_id(module)]
+            source = sneakersync.get_module_root(module)
+            if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+                print(
+                    "Sending {} to volume {}".format(
+                        describe(module, shard), shard["volume"]))
+            
+            module_backend = sneakersync.operations.get_backend(
+                backend, module)
+            module_callback = recorder.get_callback(module)
+            start = time.monotonic()
+            if shard["shards"] == 1:
+                module_backend.send(
+                    destination, configuration, module, state, progress,
+                    callback=module_callback)
+            else:
+                if not source.is_dir():
+                    raise Exception("No such directory: {}".format(source))
+                filter_ = sneakersync.filters.get_filter(
+                    configuration["filters"]+module["filters"])
+                relative = "/".join(source.relative_to(source.anchor).parts)
+                target = destination / relative
+                remove_outside(target, filter_, relative, shard)
+                # NOTE: the paths of the shard which are missing from the
+                # source are deleted from the drive.
+                files = (
+                    get_paths(source, filter_, relative, shard)
+                    | get_paths(target, filter_, relative, shard))
+                module_backend.send(
+                    destination, configuration, module, state, progress,
+                    files, callback=module_callback)
+            recorder.add(module, time.monotonic()-start)
+            
+            # The journal does not match the content of the drive anymore
+            sneakersync.watch.set_baseline(module, None, None)
+        
+        records = len(recorder.records)
+        try:
+            sneakersync.operations.run_modules(
+                [modules[x["module"]] for x in items], send_module, "send",
+                jobs)
+        finally:
+            sneakersync.metrics.append(
+                destination, recorder.records[records:])
+        
+        state.volume["complete"] = True
+        state.checkpoints = {}
+        state.tokens = {}
+        state.module_generations = {}
+        state.vectors = {}
+        state.previous_direction = "send"
+        state.previous_date = datetime.datetime.now()
+        state.previous_host = host
+        state.save()
+    
+    if metrics_json is not None:
+        recorder.write(metrics_json)
+
+def receive(
+        source, progress, backend, jobs=None, callback=None, verify=False,
+        metrics_json=None, confirmation=None):
+    """Receive a volume of a set, in any order, as in
+    sneakersync.operations.receive. The volumes already received by this
+    host are recorded locally, and the missing ones are reported. Return
+    the numbers of the missing volumes.
+    """
+    
+    confirm_ = confirmation or sneakersync.operations.confirm
+    state = sneakersync.State.load(source / "sneakersync.dat")
+    configuration = sneakersync.operations.read_configuration(
+        source / "sneakersync.cfg")
+    volume = state.volume
+    if not volume["complete"]:
+        raise Exception(
+            "Volume {} of {} was not completely sent".format(
+                volume["number"], volume["count"]))
+    if verify:
+        raise Exception("Volumes cannot be verified: they have no checksums")
+    
+    received = load_received(volume["set"])
+    if volume["number"] in received:
+        confirmed = confirm_(
+            "WARNING: "
+            "do you want to receive volume {} of {} again?".format(
+                volume["number"], volume["count"]))
+        if not confirmed:
+            return 0
+    
+    modules = {
+        sneakersync.get_module_id(x): x for x in configuration["modules"]}
+    shards = {
+        x["module"]: x for x in volume["shards"]
+        if x["volume"] == volume["number"]}
+    
+    def receive_module(module):
+        shard = shards[sneakersync.get_module_id(module)]
+        if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+            print("Receiving {}".format(describe(module, shard)))
+        
+        module_backend = sneakersync.operations.get_backend(backend, module)
+        module_callback = recorder.get_callback(module)
+        start = time.monotonic()
+        if shard["shards"] == 1:
+            module_backend.receive(
+                source, configuration, module, state, progress,
+                callback=module_callback)
+        else:
+            remote_root = sneakersync.get_module_root(
+                module, state.previous_host)
+            filter_ = sneakersync.filters.get_filter(
+                configuration["filters"]+module["filters"])
+            # NOTE: the paths of the shard which are missing from the drive
+            # are deleted from the target.
+            files = (
+                get_paths(
+                    source / remote_root.relative_to(remote_root.anchor),
+                    filter_, "", shard)
+                | get_paths(
+                    sneakersync.get_module_root(module), filter_, "", shard))
+            module_backend.receive(
+                source, configuration, module, state, progress,
+                callback=module_callback, files=files)
+        recorder.add(module, time.monotonic()-start)
+        sneakersync.watch.set_baseline(module, None, None)
+    
+    recorder = sneakersync.metrics.Recorder("receive", callback)
+    try:
+        sneakersync.operations.run_modules(
+            [modules[x] for x in shards], receive_module, "receive",
+            sneakersync.operations.get_jobs(jobs, configuration))
+    finally:
+        recorder.save(source, metrics_json)
+    
+    received.add(volume["number"])
+    save_received(volume["set"], received, volume["count"])
+    missing = [
+        x for x in range(1, volume["count"]+1) if x not in received]
+    if sneakersync.logger.getEffectiveLevel() <= logging.WARNING:
+        if missing:
+            print("Volumes still to receive:")
+            for number in missing:
+                print(
+                    "  {}: {}".format(
+                        number, ", ".join(
+                            describe(modules[x["module"]], x)
+                            for x in volume["shards"]
+                            if x["volume"] == number)))
+        else:
+            print("All {} volumes received".format(volume["count"]))
+    
+    state.previous_direction = "receive"
+    state.save()
+    return missing
+
+def plan(destinations, configuration, states, jobs=1):
+    """Scan the modules, and assign them to the drives. Return the shards of
+    each drive.
+    """
+    
+    # The content of the previous volumes is replaced
+    capacities = []
+    for destination, state in zip(destinations, states):
+        capacity = sneakersync.plan.get_free_space(destination)
+        if state.volume is not None:
+            capacity += sum(
+                x["size"] for x in state.volume["shards"]
+                if x["volume"] == state.volume["number"])
+        capacities.append(capacity)
+    
+    spills = sneakersync.scan.scan_modules(configuration, jobs=jobs)
+    try:
+        sizes = {
+            module_id: sum(x[1] for x in get_costs(spill))
+            for module_id, spill in spills.items()}
+        volumes = assign(
+            sizes, capacities, lambda x: get_costs(spills[x]))
+    finally:
+        for spill in spills.values():
+            spill.close()
+    
+    if volumes is None:
+        raise Exception(
+            "The modules ({}) do not fit on the drives ({})".format(
+                sneakersync.progress.format_size(sum(sizes.values())),
+                sneakersync.progress.format_size(sum(capacities))))
+    return volumes
+
+def assign(sizes, capacities, get_entries):
+    """Assign the modules to drives. sizes contains the space used by each
+    module, by identifier, and capacities the available space of each drive.
+    get_entries is called with a module identifier, and returns the paths of
+    the module and their space, in path order. Return the shards of each
+    drive (in the order of capacities), or None if the modules do not fit.
+    
+    As few drives as possible are used, the largest ones first. Modules are
+    placed whole where possible, the largest first, each on the volume where
+    it leaves the least free space. The other modules are cut over the
+    volumes with the most free space, so that they have few shards.
+    """
+    
+    order = sorted(
+        range(len(capacities)), key=lambda x: capacities[x], reverse=True)
+    total = sum(sizes.values())
+    for count in range(1, len(capacities)+1):
+        if sum(capacities[x] for x in order[:count]) < total:
+            continue
+        
+        free = {x: capacities[x] for x in order[:count]}
+        shards = {x: [] for x in free}
+        remaining = []
+        for module_id in sorted(sizes, key=lambda x: (-sizes[x], x)):
+            candidates = [x for x in free if free[x] >= sizes[module_id]]
+            if candidates:
+                drive = min(candidates, key=lambda x: (free[x], x))
+                free[drive] -= sizes[module_id]
+                shards[drive].append({
+                    "module": module_id, "shard": 1, "shards": 1,
+                    "start": "", "end": "", "size": sizes[module_id]})
+            else:
+                remaining.append(module_id)
+        
+        fitting = True
+        for module_id in remaining:
+            module_shards = split(
+                get_entries(module_id),
+                sorted(free.items(), key=lambda x: (-x[1], x[0])))
+            if module_shards is None:
+                fitting = False
+                break
+            for index, (drive, start, end, size) in enumerate(module_shards):
+                free[drive] -= size
+                shards[drive].append({
+                    "module": module_id, "shard": index+1,
+                    "shards": len(module_shards), "start": start, "end": end,
+                    "size": size})
+        if not fitting:
+            continue
+        
+        # Number the used drives in their order
+        volumes = []
+        for drive in range(len(capacities)):
+            items = shards.get(drive, [])
+            for item in items:
+                item["volume"] = 1+sum(
+                    1 for x in range(drive) if shards.get(x))
+            volumes.append(items)
+        return volumes
+    
+    return None
+
+def split(entries, free):
+    """Cut the entries of a module (path and space, in path order) in shards
+    which fit in the free space of the drives, in the order of free (drive
+    and free space). Return the drive, first path, end path and space of
+    each shard, or None if the entries do not fit.
+    """
+    
+    if not free:
+        return None
+    
+    shards = []
+    position = 0
+    start, size = "", 0
+    for path, cost in entries:
+        while size+cost > free[position][1]:
+            if size > 0:
+                shards.append((free[position][0], start, path, size))
+                start, size = path, 0
+            position += 1
+            if position == len(free):
+                return None
+        size += cost
+    shards.append((free[position][0], start, "", size))
+    
+    if len(shards) == 1:
+        shards[0] = (shards[0][0], "", "", shards[0][3])
+    return shards
+
+def get_costs(entries):
+    """Yield the path and the space used on a drive by each entry."""
+    
+    # NOTE: hard links are only counted once, even though they may be in
+    # different shards.
+    inodes = set()
+    for entry in entries:
+        if stat.S_ISREG(entry.mode):
+            if entry.nlink > 1:
+                if entry.inode in inodes:
+                    yield entry.path, 0
+                    continue
+                inodes.add(entry.inode)
+            yield entry.path, max(1, -(-entry.size // block_size))*block_size
+        else:
+            yield entry.path, block_size
+
+def contains(shard, path):
+    return shard["start"] <= path and (not shard["end"] or path < shard["end"])
+
+def get_paths(root, filter_, relative, shard):
+    """Return the paths of a directory which are in a shard."""
+    
+    return set(
+        x.path for x in sneakersync.scan.walk(root, filter_, relative)
+        if contains(shard, x.path))
+
+def remove_outside(root, filter_, relative, shard):
+    """Remove the entries of a copy of a module which are not in a shard.
+    Directories are only removed if they are empty, since they may contain
+    entries of the shard.
+    """
+    
+    paths = sorted(
+        (
+            (x.path, stat.S_ISDIR(x.mode))
+            for x in sneakersync.scan.walk(root, filter_, relative)
+            if x.path and not contains(shard, x.path)),
+        reverse=True)
+    for path, is_directory in paths:
+        if is_directory:
+            try:
+                os.rmdir(root / path)
+            except OSError:
+                pass
+        else:
+            os.unlink(root / path)
+
+def clean(destination, configuration, shards):
+    """Remove the copies of the modules which are not on a volume, and the
+    files describing the previous content of the drive.
+    """
+    
+    module_ids = set(x["module"] for x in shards)
+    for module in configuration["modules"]:
+        if sneakersync.get_module_id(module) in module_ids:
+            path = sneakersync.manifest.get_path(destination, module)
+        else:
+            root = sneakersync.get_module_root(module)
+            path = destination / root.relative_to(root.anchor)
+        if os.path.lexists(path):
+            sneakersync.native.remove(path)
+    
+    catalog = sneakersync.catalog.get_path(destination)
+    if catalog.exists():
+        catalog.unlink()
+
+def check(configuration):
+    if configuration["mode"] != "mirror" or configuration["layout"] != "tree":
+        raise Exception(
+            "Volumes require the mirror mode and the tree layout")
+
+def describe(module, shard):
+    root = sneakersync.get_module_root(module)
+    if shard["shards"] == 1:
+        return str(root)
+    return "{} (shard {} of {})".format(root, shard["shard"], shard["shards"])
+
+def get_received_path():
+    return sneakersync.watch.get_directory() / "volumes.json"
+
+def load_received(set_id):
+    """Return the volumes of a set received by this host."""
+    
+    try:
+        with open(get_received_path()) as fd:
+            data = json.load(fd)
+    except FileNotFoundError:
+        return set()
+    if data["set"] != set_id:
+        return set()
+    return set(data["received"])
+
+def save_received(set_id, received, count):
+    """Record the volumes of a set received by this host, and forget them
+    once the set is complete.
+    """
+    
+    path = get_received_path()
+    if len(received) == count:
+        if path.exists():
+            path.unlink()
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as fd:
+        json.dump({"set": set_id, "received": sorted(received)}, fd)
+
+def report(destinations, configuration, volumes):
+    """Return a human-readable report of the assignment of the modules."""
+    
+    format_size = sneakersync.progress.format_size
+    modules = {
+        sneakersync.get_module_id(x): x for x in configuration["modules"]}
+    lines = []
+    for destination, shards in zip(destinations, volumes):
+        if not shards:
+            lines.append("{}: unused".format(destination))
+            continue
+        lines.append(
+            "Volume {} ({}): {}".format(
+                shards[0]["volume"], destination,
+                format_size(sum(x["size"] for x in shards))))
+        for shard in shards:
+            lines.append(
+                "  {}: {}".format(
+                    describe(modules[shard["module"]], shard),
+                    format_size(shard["size"])))
+    return "\n".join(lines)+"\n"
@@ -0,0 +1,482 @@
+import collections
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import json
+import os
+import pathlib
+import select
+import stat
+import struct
+import sys
+import uuid
+
+sneakersync = sys.modules["sneakersync"]
+
+# Events and flags of inotify, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+# Events which may change the content of a module
+_mask = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_event = struct.Struct("iIII")
+
+# Once a journal is larger than this, a new session is started: the next send
+# scans the whole module.
+maximum_size = 2**26
+
+class Inotify(object):
+    """Minimal binding of the inotify API of Linux."""
+    
+    _libc = None
+    
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise Exception("Watching modules requires inotify (Linux)")
+        if Inotify._libc is None:
+            Inotify._libc = ctypes.CDLL(
+                ctypes.util.find_library("c"), use_errno=True)
+        self.fd = Inotify._call(
+            Inotify._libc.inotify_init1, os.O_NONBLOCK | os.O_CLOEXEC)
+    
+    def add_watch(self, path, mask):
+        return Inotify._call(
+            Inotify._libc.inotify_add_watch, self.fd, os.fsencode(path), mask)
+    
+    def remove_watch(self, wd):
+        try:
+            Inotify._call(Inotify._libc.inotify_rm_watch, self.fd, wd)
+        except OSError as e:
+            # NOTE: the kernel removes the watches of deleted directories
+            if e.errno != errno.EINVAL:
+                raise
+    
+    def read(self):
+        """Return the pending events, as (wd, mask, cookie, name)."""
+        
+        try:
+            data = os.read(self.fd, 2**16)
+        except BlockingIOError:
+            return []
+        
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event.unpack_from(data, offset)
+            offset += _event.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+    
+    def close(self):
+        os.close(self.fd)
+    
+    @staticmethod
+    def _call(function, *arguments):
+        result = function(*arguments)
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return result
+
+class Journal(object):
+    """Paths of a module which changed while it was watched, stored on the
+    local computer.
+    
+    The watcher appends the changed paths (relative to the module root and
+    NUL-terminated) to the file of its session; a new session starts each
+    time the watcher starts or may have missed events. The baseline records
+    the position in the journal at the start of the last send or receive of
+    the module, and the token of the drive content it matched.
+    """
+    
+    def __init__(self, module):
+        self.directory = get_directory() / sneakersync.get_module_id(module)
+        self._lock = None
+    
+    def lock(self):
+        """Mark the module as watched, for as long as this object lives."""
+        
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = (self.directory / "lock").open("w")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fd.close()
+            raise Exception(
+                "Module is already watched: {}".format(self.directory))
+        self._lock = fd
+    
+    def unlock(self):
+        self._remove("status")
+        self._lock.close()
+        self._lock = None
+    
+    def is_watched(self):
+        try:
+            fd = (self.directory / "lock").open()
+        except FileNotFoundError:
+            return False
+        with fd:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return False
+    
+    def get_path(self, session):
+        return self.directory / "{}.journal".format(session)
+    
+    def get_position(self, checksum):
+        """Return the session and the end of the journal, or None if the
+        module is not watched with the given configuration checksum.
+        """
+        
+        if not self.is_watched():
+            return None
+        status = self._read("status")
+        if status is None or status["checksum"] != checksum:
+            return None
+        try:
+            return status["session"], get_end(self.get_path(status["session"]))
+        except FileNotFoundError:
+            return None
+    
+    def read(self, session, start, end):
+        """Return the paths recorded between two positions of a session."""
+        
+        with self.get_path(session).open("rb") as fd:
+            fd.seek(start)
+            data = fd.read(end-start)
+        return set(os.fsdecode(x) for x in data.split(b"\0")[:-1])
+    
+    def remove_sessions(self):
+        for path in self.directory.glob("*.journal"):
+            path.unlink()
+    
+    def write_status(self, session, checksum):
+        self._write("status", {"session": session, "checksum": checksum})
+    
+    def read_baseline(self):
+        return self._read("baseline")
+    
+    def write_baseline(self, session, offset, token):
+        self._write(
+            "baseline", {"session": session, "offset": offset, "token": token})
+    
+    def remove_baseline(self):
+        self._remove("baseline")
+    
+    def _read(self, name):
+        try:
+            with (self.directory / name).open() as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            sneakersync.logger.warning(
+                "Invalid journal file: {}".format(self.directory / name))
+            return None
+    
+    def _write(self, name, data):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = self.directory / "{}.tmp".format(name)
+        with temporary.open("w") as fd:
+            json.dump(data, fd)
+        os.replace(temporary, self.directory / name)
+    
+    def _remove(self, name):
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+
+class Watcher(object):
+    """Record the changes of a module in its journal."""
+    
+    def __init__(self, configuration, module):
+        self.module = module
+        self.root = sneakersync.get_module_root(module)
+        if not self.root.is_dir():
+            raise Exception("No such directory: {}".format(self.root))
+        self.filter = sneakersync.filters.get_filter(
+            configuration["filters"]+module["filters"])
+        self.relative = "/".join(self.root.relative_to(self.root.anchor).parts)
+        self.checksum = sneakersync.manifest.get_checksum(
+            configuration, module)
+        
+        self.journal = Journal(module)
+        self.journal.lock()
+        self.inotify = None
+        self.fd = None
+        try:
+            self.start()
+        except Exception:
+            self.close()
+            raise
+    
+    def start(self):
+        """Start a new session, watching the whole module."""
+        
+        self._close_session()
+        self.inotify = Inotify()
+        # Watch descriptor -> directory, and directory -> watch descriptor
+        self.directories = {}
+        self.watches = {}
+        # Inode -> paths of the regular files which have several links
+        self.links = collections.defaultdict(set)
+        
+        self.journal.remove_sessions()
+        self.session = uuid.uuid4().hex
+        self.fd = self.journal.get_path(self.session).open("ab")
+        self.watch("")
+        
+        # NOTE: the journal only describes the changes which happen once the
+        # whole module is watched.
+        self.journal.write_status(self.session, self.checksum)
+    
+    def close(self):
+        self._close_session()
+        self.journal.unlock()
+    
+    def watch(self, directory, changes=None):
+        """Watch a directory and its sub-directories. If changes is
+        specified, add all their entries to it.
+        """
+        
+        # NOTE: the walk yields a directory before listing it, so that the
+        # entries created in the meantime are recorded by inotify.
+        for entry in sneakersync.scan.walk(
+                self.root / directory, self.filter,
+                join(self.relative, directory)):
+            path = join(directory, entry.path)
+            if stat.S_ISDIR(entry.mode):
+                try:
+                    wd = self.inotify.add_watch(self.root / path, _mask)
+                except (FileNotFoundError, NotADirectoryError):
+                    wd = None
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise Exception(
+                            "Too many directories to watch in {}, increase "
+                            "fs.inotify.max_user_watches".format(self.root))
+                    raise
+                if wd is not None:
+                    self.directories[wd] = path
+                    self.watches[path] = wd
+            if not entry.path:
+                continue
+            if changes is not None:
+                changes.add(path)
+            if stat.S_ISREG(entry.mode):
+                self.add_links(path, entry.nlink, entry.inode)
+    
+    def unwatch(self, directory):
+        """Stop watching a directory and its sub-directories."""
+        
+        prefix = directory+"/"
+        paths = [
+            x for x in self.watches if x == directory or x.startswith(prefix)]
+        for path in paths:
+            wd = self.watches.pop(path)
+            del self.directories[wd]
+            self.inotify.remove_watch(wd)
+    
+    def process(self):
+        """Record the pending events in the journal. Return False if there
+        were no pending events.
+        """
+        
+        events = self.inotify.read()
+        if not events:
+            return False
+        
+        changes = set()
+        files = set()
+        for wd, mask, _, name in events:
+            if mask & IN_Q_OVERFLOW:
+                sneakersync.logger.warning(
+                    "Events of {} were lost, the next send will scan the "
+                    "whole module".format(self.root))
+                self.start()
+                return True
+            
+            directory = self.directories.get(wd)
+            if directory is None:
+                # NOTE: events of directories which are not watched anymore
+                continue
+            if mask & IN_IGNORED:
+                del self.directories[wd]
+                if self.watches.get(directory) == wd:
+                    del self.watches[directory]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if directory == "":
+                    raise Exception(
+                        "Module root was moved or deleted: {}".format(
+                            self.root))
+                # NOTE: the event of the parent directory records the path
+                continue
+            
+            path = join(directory, name)
+            is_directory = bool(mask & IN_ISDIR)
+            if path and self.is_excluded(path, is_directory):
+                continue
+            changes.add(path)
+            if is_directory and mask & IN_MOVED_FROM:
+                self.unwatch(path)
+            elif is_directory and mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch(path, changes)
+            elif not is_directory:
+                files.add(path)
+        
+        # Keep hard-linked files together, so that their links are preserved.
+        # NOTE: links are never forgotten during a session; transferring a
+        # path which was not modified is harmless.
+        for path in files:
+            try:
+                path_stat = os.lstat(self.root / path)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(path_stat.st_mode):
+                self.add_links(path, path_stat.st_nlink, path_stat.st_ino)
+                changes.update(self.links.get(path_stat.st_ino, []))
+        
+        if changes:
+            self.fd.write(
+                b"".join(os.fsencode(x)+b"\0" for x in sorted(changes)))
+            self.fd.flush()
+            if self.fd.tell() > maximum_size:
+                sneakersync.logger.warning(
+                    "Journal of {} is full, the next send will scan the whole "
+                    "module".format(self.root))
+                self.start()
+        return True
+    
+    def add_links(self, path, nlink, inode):
+        if nlink > 1:
+            self.links[inode].add(path)
+    
+    def is_excluded(self, path, is_directory):
+        return self.filter.excluded(
+            join(self.relative, path), is_directory)
+    
+    def _close_session(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+def run(configuration, modules=None):
+    """Record the changes of the modules (all modules by default) until
+    interrupted.
+    """
+    
+    if modules is None:
+        modules = configuration["modules"]
+    
+    watchers = []
+    try:
+        for module in modules:
+            watchers.append(Watcher(configuration, module))
+            sneakersync.logger.info(
+                "Watching {}".format(sneakersync.get_module_root(module)))
+        while True:
+            ready = select.select([x.inotify.fd for x in watchers], [], [])[0]
+            for watcher in watchers:
+                if watcher.inotify.fd in ready:
+                    watcher.process()
+    finally:
+        for watcher in watchers:
+            watcher.close()
+
+def get_position(configuration, module):
+    """Return the current position in the journal of a module, or None if the
+    module is not watched.
+    """
+    
+    return Journal(module).get_position(
+        sneakersync.manifest.get_checksum(configuration, module))
+
+def get_changes(configuration, module, state, position):
+    """Return the paths of the module which changed since its last send or
+    receive from this host, up to the given position of its journal. Return
+    None if the journal does not cover this whole period, or if the drive
+    content changed since then: the whole module must then be scanned.
+    """
+    
+    if position is None:
+        return None
+    
+    journal = Journal(module)
+    baseline = journal.read_baseline()
+    token = state.tokens.get(sneakersync.get_module_id(module))
+    if (
+            baseline is None or token is None or baseline["token"] != token
+            or baseline["session"] != position[0]):
+        return None
+    
+    try:
+        changes = journal.read(position[0], baseline["offset"], position[1])
+    except FileNotFoundError:
+        return None
+    
+    sneakersync.manifest.add_parents(changes)
+    return changes
+
+def set_baseline(module, position, token):
+    """Record that the module matches the drive content identified by token,
+    as of the given position of its journal.
+    """
+    
+    journal = Journal(module)
+    if position is None or token is None:
+        journal.remove_baseline()
+    else:
+        journal.write_baseline(position[0], position[1], token)
+
+def get_directory():
+    """Return the local directory of the journals."""
+    
+    state = (
+        os.environ.get("XDG_STATE_HOME")
+        or os.path.join(os.path.expanduser("~"), ".local", "state"))
+    return pathlib.Path(state) / "sneakersync"
+
+def get_end(path):
+    """Return the position after the last complete record of a journal."""
+    
+    with open(path, "rb") as fd:
+        end = fd.seek(0, os.SEEK_END)
+        while end > 0:
+            size = min(end, 4096)
+            fd.seek(end-size)
+            index = fd.read(size).rfind(b"\0")
+            if index != -1:
+                return end-size+index+1
+            end -= size
+    return 0
+
+def join(directory, name):
+    return "/".join(x for x in [directory, name] if x)
@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import io
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        with (self.source / "foo").open("w") as fd:
+            fd.write("Content of foo")
+        
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+        
+        self.patches = [
+            unittest.mock.patch("socket.gethostname", lambda: "host.name"),
+            contextlib.redirect_stdout(io.StringIO())]
+        for patch in self.patches:
+            patch.__enter__()
+    
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.__exit__(None, None, None)
+        shutil.rmtree(self.root)
+    
+    def test_call_subprocess(self):
+        events = []
+        output = (
+            "  100  10%  1.00kB/s  0:00:09 (xfr#1, to-chk=1/2)\\r"
+            "Total transferred file size: 1,000 bytes\\n")
+        asyncio.run(
+            sneakersync.rsync.call_subprocess_async(
+                ["printf", "%b", output], "send", {"root": {}},
+                events.append))
+        self.assertEqual(
+            events, [
+                sneakersync.progress.Progress(100, 1000, 1, 2, 1024, 9),
+                sneakersync.progress.Progress(
+                    1000, 1000, 0, 0, None, 0,
+                    {"Total transferred file size": 1000})])
+        
+        with self.assertRaises(sneakersync.Exception):
+            asyncio.run(
+                sneakersync.rsync.call_subprocess_async(
+                    ["false"], "send", {"root": {}}))
+    
+    def test_send(self):
+        threads = []
+        def callback(module, event):
+            threads.append(threading.current_thread())
+        
+        asyncio.run(
+            sneakersync.operations.send_async(
+                self.drive, sneakersync.native, callback=callback))
+        target = self.drive / self.source.relative_to(self.source.anchor)
+        self.assertTrue((target / "foo").is_file())
+        # The callback is called on the thread of the event loop
+        self.assertTrue(threads)
+        self.assertTrue(all(x is threading.main_thread() for x in threads))
+    
+    def test_confirmation(self):
+        # Changes sent from another host which were not received here
+        module = sneakersync.operations.read_configuration(
+            self.drive / "sneakersync.cfg")["modules"][0]
+        state = sneakersync.State(
+            self.drive / "sneakersync.dat", "send", None, "other.host",
+            module_generations={sneakersync.get_module_id(module): 1})
+        state.save()
+        target = self.drive / self.source.relative_to(self.source.anchor)
+        
+        questions = []
+        async def refuse(question):
+            questions.append(question)
+            return False
+        asyncio.run(
+            sneakersync.operations.send_async(
+                self.drive, sneakersync.native, confirmation=refuse))
+        self.assertEqual(len(questions), 1)
+        self.assertFalse(target.exists())
+        
+        asyncio.run(
+            sneakersync.operations.send_async(
+                self.drive, sneakersync.native, confirmation=True))
+        self.assertTrue((target / "foo").is_file())
+    
+    def test_cancel(self):
+        started = threading.Event()
+        def send(destination, configuration, module, state, *args, **kwargs):
+            started.set()
+            sneakersync.rsync.call_subprocess(
+                ["sleep", "30"], "send", module)
+        backend = unittest.mock.Mock(send=send)
+        
+        async def run():
+            task = asyncio.ensure_future(
+                sneakersync.operations.send_async(self.drive, backend))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertLess(time.monotonic()-start, 5)
+        # The interrupted module is not recorded as sent
+        state = sneakersync.State.load(self.drive / "sneakersync.dat")
+        self.assertEqual(state.checkpoints, {})
+        self.assertIsNone(state.previous_direction)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+import sneakersync
+
+class TestBatches(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.target = self.root / "target"
+        for path in [self.source, self.target]:
+            path.mkdir()
+        
+        for directory in ["a", "b", "c"]:
+            (self.source / directory).mkdir()
+            for name in ["1", "2", "3"]:
+                with (self.source / directory / name).open("w") as fd:
+                    fd.write("Content of {}/{}".format(directory, name))
+        os.link(self.source / "a" / "1", self.source / "c" / "link")
+        with (self.source / "excluded").open("w") as fd:
+            fd.write("Excluded")
+        
+        (self.target / "a").mkdir()
+        for path in ["a/extraneous", "excluded_2", "extraneous"]:
+            with (self.target / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_batches(self):
+        batches = list(
+            sneakersync.rsync.get_batches(
+                self.source, self.target, [{"exclude": "excluded*"}], "", 3))
+        paths = [x for batch in batches for x in batch]
+        
+        # Hard links may exceed the size of the batch
+        self.assertTrue(all(len(x) <= 4 for x in batches))
+        self.assertTrue(
+            any("a/1" in x and "c/link" in x for x in batches))
+        
+        # Extraneous entries are included, not excluded ones
+        self.assertIn("a/extraneous", paths)
+        self.assertIn("extraneous", paths)
+        self.assertNotIn("excluded", paths)
+        self.assertNotIn("excluded_2", paths)
+        
+        # Directories come last
+        self.assertEqual(paths[-4:], ["", "a", "b", "c"])
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertEqual(len(paths), 9+1+2+4)
+        
+        # Without deletion, the target is not scanned
+        batches = sneakersync.rsync.get_batches(
+            self.source, self.target, [], "", 3, False)
+        self.assertNotIn("extraneous", [x for batch in batches for x in batch])
+
+if __name__ == "__main__":
+    unittest.main()
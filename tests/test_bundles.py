@@ -0,0 +1,133 @@
+import unittest
+import unittest.mock
+
+import sneakersync
+
+import test_layouts_base
+
+class TestBundles(test_layouts_base.TestLayoutsBase):
+    options = ["mode: incremental"]
+    
+    def setUp(self):
+        super().setUp()
+        
+        (self.drives[0] / "module" / "subdir").mkdir(parents=True)
+        for name in ["foo", "subdir/bar"]:
+            with (self.drives[0] / "module" / name).open("w") as fd:
+                fd.write("Content of {}".format(name))
+    
+    def test_first_send(self):
+        self._send("first.host")
+        state = sneakersync.State.load(self.sneakerdrive / "sneakersync.dat")
+        self.assertEqual(state.generation, 1)
+        self.assertEqual(state.generations, {"first.host": 1})
+        
+        bundle = sneakersync.bundles.Bundle.load(
+            sneakersync.bundles.get_directory(self.sneakerdrive) / "00000001")
+        self.assertEqual(bundle.host, "first.host")
+        self.assertEqual(list(bundle.modules.values()), [{"full": True}])
+        
+        self._receive("second.host")
+        self._check_synchronized()
+    
+    def test_changes(self):
+        self._send("first.host")
+        self._receive("second.host")
+        
+        with (self.drives[0] / "module" / "new").open("w") as fd:
+            fd.write("New file")
+        (self.drives[0] / "module" / "subdir" / "bar").unlink()
+        self._send("first.host")
+        
+        # The first bundle has been received by all hosts
+        self.assertEqual(
+            sneakersync.bundles.get_generations(self.sneakerdrive), [2])
+        bundle = sneakersync.bundles.Bundle.load(
+            sneakersync.bundles.get_directory(self.sneakerdrive) / "00000002")
+        module = {
+            "root": {
+                "first.host": self.drives[0] / "module",
+                "second.host": self.drives[1] / "module"}}
+        self.assertEqual(bundle.get_deleted(module), ["subdir/bar"])
+        self.assertFalse(
+            (bundle.path / (self.drives[0] / "module" / "foo").relative_to("/")
+            ).exists())
+        
+        self._receive("second.host")
+        self._check_synchronized()
+    
+    def test_round_trip(self):
+        self._send("first.host")
+        self._receive("second.host")
+        
+        # The received files are not sent back
+        self._send("second.host")
+        self.assertEqual(self._get_last_bundle().modules, {})
+        self._receive("first.host")
+        
+        with (self.drives[0] / "module" / "new").open("w") as fd:
+            fd.write("New file")
+        (self.drives[0] / "module" / "subdir" / "bar").unlink()
+        self._send("first.host")
+        self._receive("second.host")
+        self._check_synchronized()
+        
+        self._send("second.host")
+        self.assertEqual(self._get_last_bundle().modules, {})
+        
+        # Local changes are still sent
+        with (self.drives[1] / "module" / "foo").open("w") as fd:
+            fd.write("Modified on second host")
+        self._send("second.host")
+        self._receive("first.host")
+        self._check_synchronized()
+    
+    def test_missing_bundles(self):
+        self._send("first.host")
+        self._receive("second.host")
+        with (self.drives[0] / "module" / "new").open("w") as fd:
+            fd.write("New file")
+        self._send("first.host")
+        
+        with unittest.mock.patch("socket.gethostname", lambda: "third.host"):
+            configuration = sneakersync.operations.read_configuration(
+                self.sneakerdrive / "sneakersync.cfg")
+            state = sneakersync.State.load(
+                self.sneakerdrive / "sneakersync.dat")
+            with self.assertRaises(Exception):
+                sneakersync.bundles.receive(
+                    self.sneakerdrive, configuration, 
+                    configuration["modules"][0], state, False, 
+                    sneakersync.native)
+    
+    def _get_last_bundle(self):
+        generation = sneakersync.bundles.get_generations(self.sneakerdrive)[-1]
+        return sneakersync.bundles.Bundle.load(
+            sneakersync.bundles.get_directory(self.sneakerdrive)
+            / "{:08d}".format(generation))
+    
+    def _send(self, host):
+        with unittest.mock.patch("socket.gethostname", lambda: host):
+            sneakersync.operations.send(
+                self.sneakerdrive, False, sneakersync.native)
+    
+    def _receive(self, host):
+        with unittest.mock.patch("socket.gethostname", lambda: host):
+            sneakersync.operations.receive(
+                self.sneakerdrive, False, sneakersync.native)
+    
+    def _check_synchronized(self):
+        paths = [
+            sorted(
+                x.relative_to(drive) for x in (drive / "module").rglob("*"))
+            for drive in self.drives]
+        self.assertSequenceEqual(paths[0], paths[1])
+        for path in paths[0]:
+            path_1, path_2 = [drive / path for drive in self.drives]
+            if path_1.is_file():
+                self.assertEqual(path_1.read_text(), path_2.read_text())
+            self.assertEqual(
+                int(path_1.stat().st_mtime), int(path_2.stat().st_mtime))
+
+if __name__ == "__main__":
+    unittest.main()
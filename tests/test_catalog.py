@@ -0,0 +1,184 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import unittest
+import unittest.mock
+
+import sneakersync
+
+import test_layouts_base
+
+class TestCatalog(test_layouts_base.TestLayoutsBase):
+    options = [
+        "filters: ", "  - exclude: excluded", "manifest: true",
+        "checksums: true", "catalog: true"]
+    
+    def setUp(self):
+        super().setUp()
+        
+        self.source = self.drives[0] / "module"
+        (self.source / "subdir").mkdir(parents=True)
+        (self.source / "other").mkdir()
+        for index in range(10):
+            with (self.source / "subdir" / "{:02d}".format(index)).open(
+                    "w") as fd:
+                fd.write("Content of {}".format(index))
+        with (self.source / "other" / "file").open("w") as fd:
+            fd.write("Other")
+        with (self.source / "excluded").open("w") as fd:
+            fd.write("Excluded")
+    
+    def test_ls(self):
+        self._send()
+        
+        modules = sneakersync.catalog.get_modules(self.sneakerdrive)
+        self.assertEqual(len(modules), 1)
+        module = list(modules.values())[0]
+        self.assertEqual(module["root"], str(self.source))
+        self.assertEqual(module["host"], "first.host")
+        # Root, two directories and eleven files
+        self.assertEqual(module["entries"], 14)
+        
+        output = self._run(
+            sneakersync.operations.ls, self.sneakerdrive,
+            path=str(self.source))
+        self.assertEqual(
+            [x.split()[-1] for x in output.splitlines()], ["other", "subdir"])
+        self.assertTrue(output.startswith("d"))
+        
+        output = self._run(
+            sneakersync.operations.ls, self.sneakerdrive,
+            path=str(self.source / "subdir"))
+        self.assertEqual(len(output.splitlines()), 10)
+        
+        with self.assertRaises(Exception):
+            self._run(
+                sneakersync.operations.ls, self.sneakerdrive,
+                path=str(self.source / "excluded"))
+        
+        # Checksums of regular files are recorded
+        with sqlite3.connect(
+                str(sneakersync.catalog.get_path(self.sneakerdrive))) as db:
+            hashes = db.execute(
+                "SELECT COUNT(*) FROM entries WHERE hash IS NOT NULL")
+            self.assertEqual(hashes.fetchone()[0], 11)
+    
+    def test_find(self):
+        self._send()
+        
+        output = self._run(
+            sneakersync.operations.find, self.sneakerdrive, "0[12]")
+        self.assertEqual(
+            output.splitlines(),
+            [str(self.source / "subdir" / x) for x in ["01", "02"]])
+        
+        output = self._run(
+            sneakersync.operations.find, self.sneakerdrive, "*/file")
+        self.assertEqual(
+            output.splitlines(), [str(self.source / "other" / "file")])
+        
+        output = self._run(
+            sneakersync.operations.find, self.sneakerdrive, "excluded")
+        self.assertEqual(output, "")
+    
+    def test_diff(self):
+        self._send()
+        
+        output = self._run(sneakersync.operations.diff, self.sneakerdrive)
+        self.assertEqual(output, "")
+        
+        with (self.source / "subdir" / "00").open("w") as fd:
+            fd.write("Modified content")
+        (self.source / "subdir" / "01").unlink()
+        with (self.source / "new").open("w") as fd:
+            fd.write("New")
+        with (self.source / "excluded").open("w") as fd:
+            fd.write("Modified")
+        
+        output = self._run(
+            sneakersync.operations.diff, self.sneakerdrive,
+            path=str(self.source / "subdir"))
+        self.assertEqual(
+            output.splitlines(), [
+                "+ {}".format(self.source / "new"),
+                "M {}".format(self.source / "subdir" / "00"),
+                "- {}".format(self.source / "subdir" / "01")])
+    
+    def test_update(self):
+        self._send()
+        
+        # The second send only updates the modified paths of the catalog
+        with (self.source / "subdir" / "00").open("w") as fd:
+            fd.write("Modified content")
+        shutil.rmtree(self.source / "other")
+        with (self.source / "new").open("w") as fd:
+            fd.write("New")
+        with unittest.mock.patch.object(
+                sneakersync.catalog, "update",
+                wraps=sneakersync.catalog.update) as update:
+            self._send()
+        self.assertEqual(
+            sorted(update.call_args[0][3]),
+            ["", "new", "other", "other/file", "subdir", "subdir/00"])
+        incremental = self._get_entries()
+        
+        os.unlink(sneakersync.catalog.get_path(self.sneakerdrive))
+        self._send()
+        self.assertEqual(incremental, self._get_entries())
+        self.assertEqual(
+            self._run(sneakersync.operations.diff, self.sneakerdrive), "")
+        
+        # Modules removed from the configuration are removed from the catalog
+        with (self.sneakerdrive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules: []\ncatalog: true")
+        self._send()
+        self.assertEqual(
+            sneakersync.catalog.get_modules(self.sneakerdrive), {})
+    
+    def test_changes(self):
+        self._send()
+        
+        # The paths found by the manifest are used by the estimate, the
+        # checksums and the catalog, which do not scan the module again
+        with (self.source / "subdir" / "00").open("w") as fd:
+            fd.write("Modified content")
+        (self.source / "other" / "file").unlink()
+        with unittest.mock.patch.object(
+                sneakersync.scan, "walk", side_effect=AssertionError):
+            self._send()
+        
+        self.assertEqual(
+            self._run(sneakersync.operations.diff, self.sneakerdrive), "")
+        checksums = sneakersync.checksums.Checksums.load(
+            sneakersync.checksums.get_path(
+                self.sneakerdrive,
+                sneakersync.operations.read_configuration(
+                    self.sneakerdrive / "sneakersync.cfg")["modules"][0]))
+        self.assertEqual(
+            checksums.entries["subdir/00"][2],
+            sneakersync.checksums.hash_file(self.source / "subdir" / "00"))
+        self.assertNotIn("other/file", checksums.entries)
+    
+    def _send(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.operations.send(
+                self.sneakerdrive, False, sneakersync.native)
+    
+    def _run(self, function, *args, **kwargs):
+        output = io.StringIO()
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            with contextlib.redirect_stdout(output):
+                function(*args, False, sneakersync.native, **kwargs)
+        return output.getvalue()
+    
+    def _get_entries(self):
+        with sqlite3.connect(
+                str(sneakersync.catalog.get_path(self.sneakerdrive))) as db:
+            return db.execute(
+                "SELECT module, path, mode, size, mtime, hash FROM entries "
+                "ORDER BY module, path").fetchall()
+
+if __name__ == "__main__":
+    unittest.main()
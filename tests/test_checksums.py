@@ -0,0 +1,187 @@
+import contextlib
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+import types
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestChecksums(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        for path in ["foo", "subdir/bar", "subdir/excluded.pyc"]:
+            with (self.source / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+        os.link(self.source / "foo", self.source / "subdir" / "foo_link")
+        
+        self.configuration = {
+            "modules": [{
+                "root": {"host.name": self.source}, "filters": [],
+                "compression": "none"}],
+            "filters": [{"exclude": "*.pyc"}],
+            "mode": "mirror", "layout": "tree"
+        }
+        self.module = self.configuration["modules"][0]
+        
+        self.patch = unittest.mock.patch(
+            "socket.gethostname", lambda: "host.name")
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_save_load(self):
+        checksums = self._compute(None, "token")
+        self.assertEqual(
+            sorted(checksums.entries),
+            ["foo", "subdir/bar", "subdir/foo_link"])
+        self.assertEqual(
+            checksums.entries["foo"][2],
+            sneakersync.checksums.hash_file(self.source / "foo"))
+        checksums.save()
+        
+        other = sneakersync.checksums.Checksums.load(checksums.path)
+        self.assertEqual(other.token, "token")
+        self.assertEqual(other.entries, checksums.entries)
+    
+    def test_load_invalid(self):
+        path = self.root / "checksums"
+        self.assertIsNone(sneakersync.checksums.Checksums.load(path))
+        with path.open("w") as fd:
+            fd.write("foo")
+        self.assertIsNone(sneakersync.checksums.Checksums.load(path))
+    
+    def test_update(self):
+        self._compute(None, "first").save()
+        
+        with (self.source / "subdir" / "bar").open("w") as fd:
+            fd.write("Modified content, with a different size")
+        shutil.rmtree(self.source / "subdir")
+        with (self.source / "new").open("w") as fd:
+            fd.write("New file")
+        
+        with unittest.mock.patch(
+                "sneakersync.checksums.hash_file",
+                wraps=sneakersync.checksums.hash_file) as hash_file:
+            checksums = self._compute(
+                "first", "second", {"", "new", "subdir"})
+        # Only the new file is hashed
+        self.assertEqual(hash_file.call_count, 1)
+        self.assertEqual(sorted(checksums.entries), ["foo", "new"])
+        
+        # Previous checksums of another drive content: everything is scanned
+        checksums.save()
+        checksums = self._compute("other", "third", {"new"})
+        self.assertEqual(sorted(checksums.entries), ["foo", "new"])
+        self.assertEqual(checksums.token, "third")
+    
+    def test_verify(self):
+        checksums = self._compute(None, "token")
+        target = self.root / "target"
+        shutil.copytree(self.source, target)
+        self.assertEqual(sneakersync.checksums.verify(target, checksums), [])
+        
+        # Corrupt a file without changing its size and modification time
+        path = target / "subdir" / "bar"
+        path_stat = path.stat()
+        with path.open("r+b") as fd:
+            fd.write(b"X")
+        os.utime(path, ns=(path_stat.st_atime_ns, path_stat.st_mtime_ns))
+        (target / "foo").unlink()
+        with (target / "subdir" / "foo_link").open("a") as fd:
+            fd.write("modified")
+        
+        self.assertEqual(
+            sneakersync.checksums.verify(target, checksums),
+            [
+                "foo: missing", "subdir/bar: corrupted",
+                "subdir/foo_link: modified since it was sent"])
+    
+    def test_send_verify(self):
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+            fd.write("checksums: true\n")
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            sneakersync.operations.send(self.drive, False, sneakersync.native)
+            sneakersync.operations.verify(
+                self.drive, False, sneakersync.native)
+            
+            target = self.drive / self.source.relative_to(self.source.anchor)
+            with (target / "foo").open("r+b") as fd:
+                fd.write(b"X")
+            with self.assertRaises(Exception):
+                sneakersync.operations.verify(
+                    self.drive, False, sneakersync.native)
+    
+    def test_send_digests(self):
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+            fd.write("checksums: true\n")
+        
+        # The native backend hashes the files while it copies them
+        with contextlib.redirect_stdout(io.StringIO()), \
+                unittest.mock.patch(
+                    "sneakersync.checksums.hash_file",
+                    wraps=sneakersync.checksums.hash_file) as hash_file:
+            sneakersync.operations.send(self.drive, False, sneakersync.native)
+        self.assertEqual(hash_file.call_count, 0)
+        
+        path, = (self.drive / "sneakersync.checksums").iterdir()
+        checksums = sneakersync.checksums.Checksums.load(path)
+        self.assertEqual(
+            sorted(checksums.entries),
+            ["foo", "subdir/bar", "subdir/excluded.pyc", "subdir/foo_link"])
+        for path, (size, mtime, digest) in checksums.entries.items():
+            self.assertEqual(
+                digest, sneakersync.checksums.hash_file(self.source / path))
+    
+    def test_failed_send(self):
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+            fd.write("checksums: true\n")
+        
+        def send(*args, **kwargs):
+            raise Exception("Transfer failed")
+        def hash_file(path, compressed=False):
+            time.sleep(0.5)
+            return b"\0"*sneakersync.checksums.digest_size
+        
+        # The hashing stops when the transfer fails
+        futures = []
+        def start(*args, **kwargs):
+            futures.append(checksums_start(*args, **kwargs))
+            return futures[-1]
+        checksums_start = sneakersync.checksums.start
+        backend = types.SimpleNamespace(send=send)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                unittest.mock.patch.multiple(
+                    sneakersync.checksums, start=start, hash_file=hash_file):
+            with self.assertRaises(Exception):
+                sneakersync.operations.send(self.drive, False, backend)
+        self.assertEqual(len(futures), 1)
+        self.assertTrue(futures[0].done())
+        self.assertIsNotNone(futures[0].exception())
+    
+    def _compute(self, previous_token, token, files=None):
+        return sneakersync.checksums.compute(
+            self.drive, self.configuration, self.module, previous_token,
+            token, files)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+@unittest.skipIf(
+    sneakersync.compression.zstandard is None, "zstandard is not installed")
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.target = self.root / "target"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.target, self.drive]:
+            path.mkdir()
+        
+        self.text = b"".join(
+            "Line {} of the log\n".format(i).encode() for i in range(10000))
+        self.random = os.urandom(100000)
+        (self.source / "subdir").mkdir()
+        (self.source / "log.txt").write_bytes(self.text)
+        (self.source / "subdir" / "random").write_bytes(self.random)
+        (self.source / "archive.gz").write_bytes(self.text)
+        (self.source / "header").write_bytes(
+            sneakersync.compression._magic+self.text)
+        os.link(self.source / "log.txt", self.source / "subdir" / "log_link")
+        
+        self.configuration = {
+            "modules": [{
+                "root": {"first.host": self.source, "second.host": self.target},
+                "filters": [], "compression": "zstd"}],
+            "filters": []
+        }
+        self.state = sneakersync.State(
+            self.drive / "sneakersync.dat", "send", None, "first.host")
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_is_compressible(self):
+        self.assertTrue(
+            sneakersync.compression.is_compressible("log.txt", self.text))
+        self.assertFalse(
+            sneakersync.compression.is_compressible("random", self.random))
+        self.assertFalse(
+            sneakersync.compression.is_compressible("log.gz", self.text))
+        self.assertFalse(
+            sneakersync.compression.is_compressible("log.txt", b"small"))
+    
+    def test_round_trip(self):
+        for name in ["log.txt", "archive.gz", "header"]:
+            path = self.source / name
+            stored = self.root / "stored"
+            restored = self.root / "restored"
+            with path.open("rb", buffering=0) as source_fd, \
+                    stored.open("wb", buffering=0) as target_fd:
+                sneakersync.compression.compress(
+                    name, source_fd, target_fd, path.stat().st_size)
+            with stored.open("rb", buffering=0) as source_fd, \
+                    restored.open("wb", buffering=0) as target_fd:
+                size = sneakersync.compression.decompress(source_fd, target_fd)
+            
+            self.assertEqual(restored.read_bytes(), path.read_bytes())
+            self.assertEqual(size, path.stat().st_size)
+            self.assertEqual(
+                sneakersync.compression.get_size(stored), size)
+    
+    def test_send_receive(self):
+        self._send()
+        
+        stored = self.drive / self.source.relative_to("/")
+        self.assertLess(
+            (stored / "log.txt").stat().st_size, len(self.text)//2)
+        self.assertEqual(
+            (stored / "subdir" / "random").read_bytes(), self.random)
+        self.assertEqual((stored / "archive.gz").read_bytes(), self.text)
+        
+        # Unchanged files are not sent again
+        self.assertEqual(self._send(), [])
+        
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            sneakersync.native.receive(
+                self.drive, self.configuration, 
+                self.configuration["modules"][0], self.state)
+        for path in self.source.rglob("*"):
+            other = self.target / path.relative_to(self.source)
+            self.assertEqual(path.stat().st_mode, other.stat().st_mode)
+            self.assertEqual(path.stat().st_nlink, other.stat().st_nlink)
+            self.assertEqual(
+                int(path.stat().st_mtime), int(other.stat().st_mtime))
+            if path.is_file():
+                self.assertEqual(path.read_bytes(), other.read_bytes())
+    
+    def _send(self):
+        events = []
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.native.send(
+                self.drive, self.configuration, 
+                self.configuration["modules"][0], self.state,
+                callback=events.append)
+        # NOTE: the last event only holds the statistics of the transfer
+        self.assertIsNotNone(events[-1].statistics)
+        return events[:-1]
+
+if __name__ == "__main__":
+    unittest.main()
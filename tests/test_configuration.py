@@ -20,6 +20,64 @@ class TestConfiguration(unittest.TestCase):
         configuration = sneakersync.operations.read_configuration(self.path)
         self.assertSequenceEqual(configuration["modules"], [])
         self.assertSequenceEqual(configuration["filters"], [])
+        self.assertEqual(configuration["jobs"], 1)
+        self.assertFalse(configuration["log"])
+        self.assertFalse(configuration["preflight"])
+        self.assertFalse(configuration["checksums"])
+        self.assertFalse(configuration["catalog"])
+    
+    def test_jobs(self):
+        with self.path.open("w") as fd:
+            fd.write("jobs: 4")
+        configuration = sneakersync.operations.read_configuration(self.path)
+        self.assertEqual(configuration["jobs"], 4)
+        
+        for value in ["0", "-2", "foo"]:
+            with self.path.open("w") as fd:
+                fd.write("jobs: {}".format(value))
+            with self.assertRaises(Exception):
+                sneakersync.operations.read_configuration(self.path)
+        
+        # The number of jobs of the command line replaces the configured one
+        self.assertEqual(
+            sneakersync.operations.get_jobs(None, configuration), 4)
+        self.assertEqual(sneakersync.operations.get_jobs(2, configuration), 2)
+        with self.assertRaises(Exception):
+            sneakersync.operations.get_jobs(0, configuration)
+    
+    def test_compression(self):
+        with self.path.open("w") as fd:
+            fd.write("modules: [{root: /foo/bar, compression: foo}]")
+        with self.assertRaises(Exception):
+            sneakersync.operations.read_configuration(self.path)
+        
+        with self.path.open("w") as fd:
+            fd.write(
+                "modules: [{root: /foo/bar, compression: zstd}]\n"
+                "layout: dedup")
+        with self.assertRaises(Exception):
+            sneakersync.operations.read_configuration(self.path)
+    
+    def test_profile(self):
+        with self.path.open("w") as fd:
+            fd.write(
+                "modules:\n"
+                "  - root: /foo/bar\n"
+                "  - root: /foo/baz\n"
+                "    profile: {inplace: yes, delete: after}\n"
+                "profile: auto\n")
+        configuration = sneakersync.operations.read_configuration(self.path)
+        self.assertEqual(configuration["modules"][0]["profile"], "auto")
+        self.assertEqual(
+            configuration["modules"][1]["profile"],
+            {"inplace": "yes", "delete": "after"})
+        
+        for profile in ["foo", "{inplace: maybe}", "{delete: never}"]:
+            with self.path.open("w") as fd:
+                fd.write(
+                    "modules: [{{root: /foo/bar, profile: {}}}]".format(profile))
+            with self.assertRaises(Exception):
+                sneakersync.operations.read_configuration(self.path)
     
     def test_non_absolute_path(self):
         with self.path.open("w") as fd:
@@ -41,7 +99,9 @@ class TestConfiguration(unittest.TestCase):
             configuration = sneakersync.operations.read_configuration(self.path)
         self.assertSequenceEqual(
             configuration["modules"], 
-            [{"root": {"host.name": pathlib.Path("/foo/bar")}, "filters": []}])
+            [{"root": {"host.name": pathlib.Path("/foo/bar")}, "filters": [],
+             "compression": "none", "profile": "default",
+             "max_entries_per_batch": 0}])
         self.assertSequenceEqual(configuration["filters"], [])
         
         with self.path.open("w") as fd:
@@ -49,7 +109,9 @@ class TestConfiguration(unittest.TestCase):
         configuration = sneakersync.operations.read_configuration(self.path)
         self.assertSequenceEqual(
             configuration["modules"], 
-            [{"root": {"hostname": pathlib.Path("/foo/bar")}, "filters": []}])
+            [{"root": {"hostname": pathlib.Path("/foo/bar")}, "filters": [],
+             "compression": "none", "profile": "default",
+             "max_entries_per_batch": 0}])
         self.assertSequenceEqual(configuration["filters"], [])
     
     def test_module_filter(self):
@@ -86,7 +148,9 @@ class TestConfiguration(unittest.TestCase):
             configuration = sneakersync.operations.read_configuration(self.path)
         self.assertSequenceEqual(
             configuration["modules"], 
-            [{"root": {"host.name": pathlib.Path("/foo/bar")}, "filters": []}])
+            [{"root": {"host.name": pathlib.Path("/foo/bar")}, "filters": [],
+             "compression": "none", "profile": "default",
+             "max_entries_per_batch": 0}])
         self.assertSequenceEqual(
             configuration["filters"], [{"exclude": "foo.pyc"}])
         
@@ -97,7 +161,9 @@ class TestConfiguration(unittest.TestCase):
         configuration = sneakersync.operations.read_configuration(self.path)
         self.assertSequenceEqual(
             configuration["modules"], 
-            [{"root": {"hostname": pathlib.Path("/foo/bar")}, "filters": []}])
+            [{"root": {"hostname": pathlib.Path("/foo/bar")}, "filters": [],
+             "compression": "none", "profile": "default",
+             "max_entries_per_batch": 0}])
         self.assertSequenceEqual(
             configuration["filters"], [{"exclude": "foo.pyc"}])
 
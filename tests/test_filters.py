@@ -0,0 +1,90 @@
+import unittest
+
+import sneakersync
+
+class TestFilter(unittest.TestCase):
+    def test_name(self):
+        filter_ = sneakersync.filters.Filter([{"exclude": "*.pyc"}])
+        self.assertTrue(filter_.excluded("foo.pyc", False))
+        self.assertTrue(filter_.excluded("foo/bar.pyc", False))
+        self.assertFalse(filter_.excluded("foo.py", False))
+    
+    def test_anchored(self):
+        filter_ = sneakersync.filters.Filter([{"exclude": "/foo/bar"}])
+        self.assertTrue(filter_.excluded("foo/bar", False))
+        self.assertFalse(filter_.excluded("baz/foo/bar", False))
+    
+    def test_directory(self):
+        filter_ = sneakersync.filters.Filter([{"exclude": "cache/"}])
+        self.assertTrue(filter_.excluded("foo/cache", True))
+        self.assertFalse(filter_.excluded("foo/cache", False))
+    
+    def test_wildcards(self):
+        filter_ = sneakersync.filters.Filter([{"exclude": "/foo/*/bar"}])
+        self.assertTrue(filter_.excluded("foo/x/bar", False))
+        self.assertFalse(filter_.excluded("foo/x/y/bar", False))
+        
+        filter_ = sneakersync.filters.Filter([{"exclude": "/foo/**/bar"}])
+        self.assertTrue(filter_.excluded("foo/x/y/bar", False))
+    
+    def test_first_match(self):
+        filter_ = sneakersync.filters.Filter(
+            [{"include": "keep.pyc"}, {"exclude": "*.pyc"}])
+        self.assertFalse(filter_.excluded("keep.pyc", False))
+        self.assertTrue(filter_.excluded("other.pyc", False))
+    
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            sneakersync.filters.Filter([{"exclude": "foo", "include": "bar"}])
+        with self.assertRaises(Exception):
+            sneakersync.filters.Filter([{"foo": "bar"}])
+    
+    def test_priority(self):
+        # The first rule wins, even if a later rule matches a shorter prefix
+        filter_ = sneakersync.filters.Filter(
+            [{"include": "bar/*.pyc"}, {"exclude": "/foo/**"}])
+        self.assertFalse(filter_.excluded("foo/bar/baz.pyc", False))
+        self.assertTrue(filter_.excluded("foo/baz.pyc", False))
+    
+    def test_many(self):
+        filter_ = sneakersync.filters.Filter(
+            [{"exclude": "file_{}".format(i)} for i in range(5000)])
+        self.assertTrue(filter_.excluded("foo/file_4999", False))
+        self.assertFalse(filter_.excluded("foo/file_5000", False))
+    
+    def test_line_break(self):
+        with self.assertRaises(Exception):
+            sneakersync.filters.Filter([{"exclude": "foo\nbar"}])
+    
+    def test_to_rsync(self):
+        filter_ = sneakersync.filters.Filter(
+            [{"include": "keep.pyc"}, {"exclude": "*.pyc"}])
+        self.assertEqual(filter_.to_rsync(), "+ keep.pyc\n- *.pyc\n")
+    
+    def test_get_filter(self):
+        filters = [{"exclude": "*.pyc"}]
+        self.assertIs(
+            sneakersync.filters.get_filter(filters), 
+            sneakersync.filters.get_filter(list(filters)))
+    
+    def test_merge_file(self):
+        filters = [{"exclude": "*.pyc"}]
+        path = sneakersync.filters.get_merge_file(filters)
+        with open(path) as fd:
+            self.assertEqual(fd.read(), "- *.pyc\n")
+        self.assertEqual(sneakersync.filters.get_merge_file(filters), path)
+        
+        self.assertIsNone(sneakersync.filters.get_merge_file([]))
+    
+    def test_rsync_options(self):
+        options = sneakersync.rsync.get_filters(
+            [{"exclude": "*.pyc"}], [], [{"include": "foo"}])
+        self.assertEqual(
+            options, [
+                "--filter=merge {}".format(
+                    sneakersync.filters.get_merge_file([{"exclude": "*.pyc"}])),
+                "--filter=merge {}".format(
+                    sneakersync.filters.get_merge_file([{"include": "foo"}]))])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import contextlib
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestGenerations(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.drive = self.root / "drive"
+        self.drive.mkdir()
+        self.hosts = ["first", "second", "third"]
+        for host in self.hosts:
+            (self.root / host).mkdir()
+        
+        for path in ["foo", "bar"]:
+            with (self.root / "first" / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+        
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root:\n")
+            for host in self.hosts:
+                fd.write("      {}: {}\n".format(host, self.root / host))
+            fd.write("manifest: true\n")
+        self.module = sneakersync.operations.read_configuration(
+            self.drive / "sneakersync.cfg")["modules"][0]
+        
+        self.patch = unittest.mock.patch.dict(
+            os.environ, {"XDG_STATE_HOME": str(self.root / "state")})
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_get_changes(self):
+        module_id = sneakersync.get_module_id(self.module)
+        state = sneakersync.State(
+            self.drive / "sneakersync.dat", None, None, None,
+            module_generations={module_id: 3},
+            vectors={"first": {module_id: 3}, "second": {module_id: 1}})
+        sneakersync.generations.save_changes(self.drive, self.module, 2, {"a"})
+        sneakersync.generations.save_changes(self.drive, self.module, 3, {"b"})
+        
+        get_changes = sneakersync.generations.get_changes
+        self.assertEqual(
+            get_changes(self.drive, self.module, state, "first"), set())
+        self.assertEqual(
+            get_changes(self.drive, self.module, state, "second"), {"a", "b"})
+        self.assertIsNone(get_changes(self.drive, self.module, state, "third"))
+        
+        # Generation 2 was a send of the whole module
+        sneakersync.generations.save_changes(self.drive, self.module, 2, None)
+        self.assertIsNone(
+            get_changes(self.drive, self.module, state, "second"))
+        
+        # Changes before the last send of the whole module are useless
+        sneakersync.generations.save_changes(self.drive, self.module, 1, {"c"})
+        sneakersync.generations.prune(self.drive, self.module, state)
+        self.assertEqual(
+            sorted(
+                x.name for x in sneakersync.generations.get_directory(
+                    self.drive, self.module).iterdir()),
+            ["00000003"])
+        
+        # Changes received by all hosts are useless
+        state.vectors["second"][module_id] = 3
+        sneakersync.generations.prune(self.drive, self.module, state)
+        self.assertEqual(
+            list(
+                sneakersync.generations.get_directory(
+                    self.drive, self.module).iterdir()),
+            [])
+    
+    def test_rotation(self):
+        self._run("first", "send")
+        self._run("second", "receive")
+        # No confirmation: the third host did not receive the files yet
+        self._run("third", "receive")
+        for host in ["second", "third"]:
+            with (self.root / host / "bar").open() as fd:
+                self.assertEqual(fd.read(), "Content of bar")
+        
+        with (self.root / "first" / "foo").open("w") as fd:
+            fd.write("Modified content of foo")
+        with (self.root / "second" / "bar").open("w") as fd:
+            fd.write("Local content of bar")
+        # No confirmation: the first host has the current files
+        self._run("first", "send")
+        
+        # Only the changes of the new send are received
+        self._run("second", "receive")
+        with (self.root / "second" / "foo").open() as fd:
+            self.assertEqual(fd.read(), "Modified content of foo")
+        with (self.root / "second" / "bar").open() as fd:
+            self.assertEqual(fd.read(), "Local content of bar")
+        
+        # The second host already has the current files
+        self.assertTrue(self._run("second", "receive", False))
+        
+        # The third host would overwrite changes it did not receive
+        self.assertTrue(self._run("third", "send", False))
+        self._run("third", "receive")
+        self._run("third", "send")
+        
+        state = sneakersync.State.load(self.drive / "sneakersync.dat")
+        module_id = sneakersync.get_module_id(self.module)
+        self.assertEqual(state.module_generations, {module_id: 3})
+        self.assertEqual(
+            state.vectors, {
+                "first": {module_id: 2}, "second": {module_id: 2},
+                "third": {module_id: 3}})
+    
+    def _run(self, host, action, confirmed=None):
+        """Run an action from a host, return whether a confirmation was
+        asked. confirmed is the answer to the confirmation, if any.
+        """
+        
+        confirm = unittest.mock.Mock(return_value=confirmed)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                unittest.mock.patch("socket.gethostname", lambda: host))
+            stack.enter_context(
+                unittest.mock.patch("sneakersync.operations.confirm", confirm))
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            getattr(sneakersync.operations, action)(
+                self.drive, False, sneakersync.native)
+        if confirmed is None:
+            self.assertFalse(confirm.called)
+        return confirm.called
+
+if __name__ == "__main__":
+    unittest.main()
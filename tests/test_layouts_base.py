@@ -0,0 +1,32 @@
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+class TestLayoutsBase(unittest.TestCase):
+    """Two hard drives and a sneakerdrive. The configuration synchronizes
+    the modules of the first drive with the same directories of the second
+    one, and adds the options of the test case.
+    """
+    
+    modules = ["module"]
+    options = []
+    
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.drives = [self.root / "drive_1", self.root / "drive_2"]
+        self.sneakerdrive = self.root / "sneakerdrive"
+        for drive in self.drives+[self.sneakerdrive]:
+            drive.mkdir()
+        
+        lines = ["modules:"]
+        for module in self.modules:
+            lines += [
+                "  - root:",
+                "      first.host: {}/{}".format(self.drives[0], module),
+                "      second.host: {}/{}".format(self.drives[1], module)]
+        with (self.sneakerdrive / "sneakersync.cfg").open("w") as fd:
+            fd.write("\n".join(lines+self.options))
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
@@ -1,3 +1,5 @@
+import contextlib
+import io
 import socket
 import subprocess
 import sys
@@ -34,6 +36,15 @@ class TestMain(test_synchronize_base.TestSynchronizeBase):
             sneakersync.main.main()
         
         self._check_synchronized()
+    
+    def test_jobs(self):
+        for value in ["0", "-1", "foo"]:
+            sys.argv = [
+                sys.argv[0], "--jobs", value, "send", str(self.sneakerdrive)]
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit):
+                    sneakersync.main.main()
+        self.assertFalse((self.sneakerdrive / "sneakersync.dat").exists())
 
 if __name__ == "__main__":
     sys.exit(unittest.main())
@@ -0,0 +1,110 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        for path in ["foo", "subdir/bar", "subdir/excluded.pyc"]:
+            with (self.source / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+        os.link(self.source / "foo", self.source / "subdir" / "foo_link")
+        
+        self.configuration = {
+            "modules": [{
+                "root": {"host.name": self.source}, "filters": [],
+                "compression": "none"}],
+            "filters": [{"exclude": "*.pyc"}],
+            "mode": "mirror"
+        }
+        self.module = self.configuration["modules"][0]
+        self.state = sneakersync.State(
+            self.drive / "sneakersync.dat", "send", None, "host.name")
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_save_load(self):
+        manifest, _ = self._prepare()
+        manifest.save()
+        
+        other_manifest = sneakersync.manifest.Manifest.load(manifest.path)
+        self.assertEqual(other_manifest.host, "host.name")
+        self.assertEqual(other_manifest.checksum, manifest.checksum)
+        self.assertEqual(other_manifest.entries, manifest.entries)
+    
+    def test_load_invalid(self):
+        path = self.root / "manifest"
+        self.assertIsNone(sneakersync.manifest.Manifest.load(path))
+        with path.open("w") as fd:
+            fd.write("foo")
+        self.assertIsNone(sneakersync.manifest.Manifest.load(path))
+    
+    def test_scan(self):
+        manifest, files = self._prepare()
+        self.assertIsNone(files)
+        self.assertEqual(
+            sorted(manifest.entries), 
+            ["", "foo", "subdir", "subdir/bar", "subdir/foo_link"])
+    
+    def test_unchanged(self):
+        manifest, _ = self._prepare()
+        manifest.save()
+        
+        manifest, files = self._prepare()
+        self.assertEqual(files, set())
+    
+    def test_changes(self):
+        manifest, _ = self._prepare()
+        manifest.save()
+        
+        with (self.source / "foo").open("a") as fd:
+            fd.write("Modified")
+        (self.source / "subdir" / "bar").unlink()
+        (self.source / "new").mkdir()
+        with (self.source / "new" / "baz").open("w") as fd:
+            fd.write("New file")
+        
+        manifest, files = self._prepare()
+        self.assertEqual(
+            files, 
+            {
+                "", "foo", "subdir", "subdir/bar", "subdir/foo_link", 
+                "new", "new/baz"})
+    
+    def test_other_host(self):
+        manifest, _ = self._prepare()
+        manifest.save()
+        
+        self.state.previous_host = "other.host"
+        manifest, files = self._prepare()
+        self.assertIsNone(files)
+        self.assertFalse(manifest.path.exists())
+    
+    def test_other_configuration(self):
+        manifest, _ = self._prepare()
+        manifest.save()
+        
+        self.module["filters"].append({"exclude": "foo"})
+        manifest, files = self._prepare()
+        self.assertIsNone(files)
+        self.assertNotIn("foo", manifest.entries)
+    
+    def _prepare(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            return sneakersync.manifest.prepare(
+                self.drive, self.configuration, self.module, self.state)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import contextlib
+import io
+import json
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        for path in ["foo", "subdir/bar"]:
+            with (self.source / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+        
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+        
+        self.patch = unittest.mock.patch(
+            "socket.gethostname", lambda: "host.name")
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_send(self):
+        events = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            sneakersync.operations.send(
+                self.drive, False, sneakersync.native,
+                callback=lambda module, event: events.append(event),
+                metrics_json=self.root / "metrics.json")
+        # Events are still forwarded to the callback
+        self.assertEqual(events[-1].files_done, 2)
+        
+        history = sneakersync.metrics.load(self.drive)
+        self.assertEqual(len(history), 1)
+        record = history[0]
+        self.assertEqual(record["action"], "send")
+        self.assertEqual(record["host"], "host.name")
+        self.assertEqual(record["root"], str(self.source))
+        self.assertEqual(record["files"], 2)
+        self.assertEqual(record["bytes"], 35)
+        self.assertEqual(record["scanned"], 4)
+        
+        with (self.root / "metrics.json").open() as fd:
+            self.assertEqual(json.load(fd)["modules"], history)
+    
+    def test_regressions(self):
+        def make_record(size, rate):
+            return {
+                "module": "module", "action": "send", "root": "/foo",
+                "date": "2026-01-01 00:00:00", "host": "host.name",
+                "bytes": size, "files": 1, "scanned": None,
+                "duration": size/rate, "rate": rate}
+        
+        previous = [make_record(2**30, 2**25) for _ in range(5)]
+        get_regressions = sneakersync.metrics.get_regressions
+        self.assertEqual(get_regressions(previous[0], previous), [])
+        # Not enough previous runs
+        self.assertEqual(
+            get_regressions(make_record(2**31, 2**24), previous[:2]), [])
+        self.assertEqual(
+            get_regressions(make_record(2**31, 2**24), previous),
+            [
+                "transferred 2.0 times the usual size",
+                "throughput 50% lower than usual"])
+        # Small transfers do not give a meaningful throughput
+        self.assertEqual(
+            get_regressions(
+                make_record(2**20, 1), [make_record(2**20, 2**25)]*5),
+            [])
+        
+        report = sneakersync.metrics.report(
+            previous+[make_record(2**30, 2**24)])
+        self.assertEqual(
+            report.splitlines()[0], "/foo (send, 6 runs)")
+        self.assertIn("WARNING: throughput 50% lower than usual", report)
+    
+    def test_load_truncated(self):
+        sneakersync.metrics.append(self.drive, [{"bytes": 1}, {"bytes": 2}])
+        with sneakersync.metrics.get_path(self.drive).open("a") as fd:
+            fd.write("{\"bytes\"")
+        sneakersync.metrics.append(self.drive, [{"bytes": 3}])
+        with self.assertLogs(sneakersync.logger, "WARNING"):
+            self.assertEqual(
+                sneakersync.metrics.load(self.drive),
+                [{"bytes": 1}, {"bytes": 2}, {"bytes": 3}])
+
+if __name__ == "__main__":
+    unittest.main()
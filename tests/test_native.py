@@ -0,0 +1,263 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestNative(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.target = self.root / "target"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.target, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        with (self.source / "foo").open("w") as fd:
+            fd.write("Content of foo")
+        with (self.source / "subdir" / "bar").open("w") as fd:
+            fd.write("Content of bar")
+        with (self.source / "excluded.pyc").open("w") as fd:
+            fd.write("Content of excluded.pyc")
+        os.link(self.source / "foo", self.source / "subdir" / "foo_link")
+        os.symlink("foo", self.source / "foo_symlink")
+        os.utime(self.source / "subdir" / "bar", (1e9, 1e9))
+        (self.source / "subdir" / "bar").chmod(0o640)
+        
+        self.configuration = {
+            "modules": [{
+                "root": {"first.host": self.source, "second.host": self.target},
+                "filters": [], "compression": "none"}],
+            "filters": [{"exclude": "*.pyc"}]
+        }
+        self.state = sneakersync.State(
+            self.drive / "sneakersync.dat", "send", None, "first.host")
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_send_receive(self):
+        self._synchronize()
+        self._check_synchronized()
+    
+    def test_modify(self):
+        self._synchronize()
+        
+        with (self.source / "subdir" / "bar").open("w") as fd:
+            fd.write("Modified content of bar")
+        (self.source / "foo").unlink()
+        with (self.target / "excluded.pyc").open("w") as fd:
+            fd.write("Local content")
+        
+        self._synchronize()
+        self._check_synchronized()
+        self.assertTrue((self.target / "excluded.pyc").exists())
+    
+    def test_profile(self):
+        self.configuration["modules"][0]["profile"] = {
+            "preallocate": "yes", "delete": "before"}
+        self._synchronize()
+        
+        # Replace a directory by a file with the same name
+        shutil.rmtree(self.source / "subdir")
+        with (self.source / "subdir").open("w") as fd:
+            fd.write("Content of subdir")
+        
+        self._synchronize()
+        self._check_synchronized()
+    
+    def test_order(self):
+        self.configuration["modules"][0]["profile"] = {"order": "physical"}
+        with (self.source / "large").open("w") as fd:
+            fd.write(2**16*"x")
+        for index in range(5):
+            with (self.source / "subdir" / "small_{}".format(index)).open(
+                    "w") as fd:
+                fd.write("Content of small_{}".format(index))
+        os.utime(self.source / "subdir", (1e9, 1e9))
+        
+        # Copy large files alone, and small files by batches of two
+        with unittest.mock.patch.multiple(
+                sneakersync.ordering, large_size=2**10, batch_files=2):
+            self._synchronize()
+        self._check_synchronized()
+        self.assertTrue(
+            os.path.samefile(
+                self.target / "foo", self.target / "subdir" / "foo_link"))
+    
+    def test_sparse(self):
+        path = self.source / "sparse"
+        with path.open("wb") as fd:
+            fd.seek(2**20)
+            fd.write(b"data")
+            fd.truncate(8*2**20)
+        if not sneakersync.sparse.is_sparse(path.stat()):
+            self.skipTest("File system does not support sparse files")
+        
+        module = self.configuration["modules"][0]
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.native.send(
+                self.drive, self.configuration, module, self.state)
+        
+        # Fill the holes of the copy on the drive: the extent map is used
+        copy = self.drive / self.source.relative_to("/") / "sparse"
+        copy_stat = copy.stat()
+        copy.write_bytes(path.read_bytes())
+        os.utime(copy, ns=(copy_stat.st_atime_ns, copy_stat.st_mtime_ns))
+        self.assertFalse(sneakersync.sparse.is_sparse(copy.stat()))
+        
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            sneakersync.native.receive(
+                self.drive, self.configuration, module, self.state)
+        self._check_synchronized()
+        self.assertTrue(
+            sneakersync.sparse.is_sparse((self.target / "sparse").stat()))
+        
+        # The map forgets the files which are not sparse anymore
+        path.write_bytes(b"dense")
+        self._synchronize()
+        self._check_synchronized()
+        self.assertFalse(
+            sneakersync.sparse.get_path(self.drive, module).exists())
+    
+    def test_callback(self):
+        events = []
+        module = self.configuration["modules"][0]
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.native.send(
+                self.drive, self.configuration, module, self.state,
+                callback=events.append)
+        
+        # foo and subdir/bar, the hard link and symlink have no content
+        self.assertEqual(events[-1].files_done, 2)
+        self.assertEqual(events[-1].bytes_done, 28)
+    
+    def test_resume(self):
+        with (self.source / "large").open("wb") as fd:
+            fd.write(os.urandom(5*2**20))
+        source_stat = (self.source / "large").stat()
+        
+        # Partial copy of a previous version of the file, and of the current
+        # version, with garbage at the end.
+        target = self.drive / self.source.relative_to("/") / "large"
+        stale = sneakersync.native.get_partial_path(target, os.stat(self.root))
+        partial = sneakersync.native.get_partial_path(target, source_stat)
+        partial.parent.mkdir(parents=True)
+        stale.write_bytes(b"stale")
+        with (self.source / "large").open("rb") as fd:
+            partial.write_bytes(fd.read(3*2**20)+b"garbage")
+        
+        events = []
+        module = self.configuration["modules"][0]
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            with unittest.mock.patch.object(
+                    sneakersync.native, "resume_size", 2**20):
+                sneakersync.native.send(
+                    self.drive, self.configuration, module, self.state,
+                    callback=events.append)
+        
+        self.assertEqual(
+            target.read_bytes(), (self.source / "large").read_bytes())
+        self.assertFalse(partial.parent.exists())
+        # The last complete chunk of the partial copy is copied again
+        self.assertEqual(events[-1].bytes_done, 28+3*2**20)
+    
+    def test_resume_preallocated(self):
+        self.configuration["modules"][0]["profile"] = {"preallocate": "yes"}
+        with (self.source / "large").open("wb") as fd:
+            fd.write(os.urandom(8*2**20))
+        target = self.drive / self.source.relative_to("/") / "large"
+        partial = sneakersync.native.get_partial_path(
+            target, (self.source / "large").stat())
+        
+        # Interrupt the copy of the large file after 2 MiB
+        copy_contents_ = sneakersync.native.copy_contents
+        def copy_contents(source_fd, target_fd, length=None):
+            if os.fstat(source_fd).st_size < 2**20:
+                return copy_contents_(source_fd, target_fd, length)
+            os.write(target_fd, os.read(source_fd, 2*2**20))
+            raise RuntimeError("Interrupted")
+        
+        module = self.configuration["modules"][0]
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            with unittest.mock.patch.object(
+                    sneakersync.native, "resume_size", 2**20):
+                with unittest.mock.patch.object(
+                        sneakersync.native, "copy_contents", copy_contents):
+                    with self.assertRaises(RuntimeError):
+                        sneakersync.native.send(
+                            self.drive, self.configuration, module,
+                            self.state)
+                self.assertEqual(partial.stat().st_size, 2*2**20)
+                sneakersync.native.send(
+                    self.drive, self.configuration, module, self.state)
+        
+        self.assertEqual(
+            target.read_bytes(), (self.source / "large").read_bytes())
+    
+    def test_copy_contents(self):
+        with (self.source / "large").open("wb") as fd:
+            fd.write(os.urandom(3*2**20))
+        with (self.source / "large").open("rb") as source_fd, \
+                (self.target / "large").open("wb") as target_fd:
+            sneakersync.native.copy_contents(
+                source_fd.fileno(), target_fd.fileno())
+        with (self.source / "large").open("rb") as fd_1, \
+                (self.target / "large").open("rb") as fd_2:
+            self.assertEqual(fd_1.read(), fd_2.read())
+    
+    def test_missing_metadata(self):
+        modules = self.configuration["modules"]
+        with unittest.mock.patch.object(
+                sneakersync.native, "get_missing_metadata",
+                lambda: ["creation times"]):
+            with self.assertLogs(sneakersync.logger, "WARNING") as logs:
+                sneakersync.operations.check_metadata(
+                    sneakersync.native, modules)
+            self.assertIn("creation times", logs.output[0])
+            with self.assertNoLogs(sneakersync.logger, "WARNING"):
+                sneakersync.operations.check_metadata(
+                    sneakersync.rsync, modules)
+    
+    def _synchronize(self):
+        module = self.configuration["modules"][0]
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.native.send(
+                self.drive, self.configuration, module, self.state)
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            sneakersync.native.receive(
+                self.drive, self.configuration, module, self.state)
+    
+    def _check_synchronized(self):
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            for name in dirnames+filenames:
+                path_1 = pathlib.Path(dirpath, name)
+                path_2 = self.target / path_1.relative_to(self.source)
+                if name.endswith(".pyc"):
+                    self.assertFalse(
+                        path_2.exists() 
+                        and path_2.read_text() == path_1.read_text())
+                    continue
+                
+                stat_1 = path_1.lstat()
+                stat_2 = path_2.lstat()
+                self.assertEqual(stat_1.st_mode, stat_2.st_mode)
+                self.assertEqual(stat_1.st_nlink, stat_2.st_nlink)
+                self.assertEqual(int(stat_1.st_mtime), int(stat_2.st_mtime))
+                if path_1.is_file() and not path_1.is_symlink():
+                    self.assertEqual(path_1.read_text(), path_2.read_text())
+        
+        for dirpath, dirnames, filenames in os.walk(self.target):
+            for name in dirnames+filenames:
+                path = pathlib.Path(dirpath, name)
+                if not name.endswith(".pyc"):
+                    self.assertTrue(
+                        os.path.lexists(
+                            self.source / path.relative_to(self.target)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import contextlib
+import io
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestOperations(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.modules = [
+            {"root": {"host.name": self.root / "module_{}".format(i)}}
+            for i in range(4)]
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_run_modules_sequential(self):
+        processed = []
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            sneakersync.operations.run_modules(
+                self.modules, processed.append, "send", 1)
+        self.assertSequenceEqual(processed, self.modules)
+    
+    def test_run_modules_parallel(self):
+        threads = {}
+        def function(module):
+            threads[str(module["root"]["host.name"])] = threading.get_ident()
+        
+        devices = {
+            self.root / "module_{}".format(i): i%2 for i in range(4)}
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            with unittest.mock.patch(
+                    "sneakersync.operations.get_device", devices.get):
+                sneakersync.operations.run_modules(
+                    self.modules, function, "send", 4)
+        
+        self.assertEqual(len(threads), 4)
+        # Modules on the same device are processed by the same worker
+        for i in range(2):
+            self.assertEqual(
+                threads[str(self.root / "module_{}".format(i))], 
+                threads[str(self.root / "module_{}".format(i+2))])
+    
+    def test_run_modules_failure(self):
+        processed = []
+        def function(module):
+            if module is self.modules[0]:
+                raise Exception("failure")
+            time.sleep(0.01)
+            processed.append(module)
+        
+        devices = {self.root / "module_{}".format(i): i for i in range(4)}
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            with unittest.mock.patch(
+                    "sneakersync.operations.get_device", devices.get):
+                with self.assertRaises(sneakersync.Exception) as context:
+                    sneakersync.operations.run_modules(
+                        self.modules, function, "send", 2)
+        
+        self.assertEqual(context.exception.action, "send")
+        self.assertIs(context.exception.module, self.modules[0])
+        self.assertEqual(len(processed), 3)
+    
+    def test_resume_send(self):
+        drive = self.root / "drive"
+        drive.mkdir()
+        for index in range(3):
+            (self.root / "module_{}".format(index)).mkdir()
+        with (drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            for index in range(3):
+                fd.write("  - root: {}/module_{}\n".format(self.root, index))
+        
+        sent = []
+        def send(destination, configuration, module, *args, **kwargs):
+            name = module["root"]["host.name"].name
+            sent.append(name)
+            if name == "module_2" and sent.count(name) == 1:
+                raise OSError("Drive unplugged")
+        backend = unittest.mock.Mock(send=send)
+        
+        stdout = io.StringIO()
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"), \
+                contextlib.redirect_stdout(stdout):
+            # The transfer of the third module fails
+            with self.assertRaises(Exception):
+                sneakersync.operations.send(drive, False, backend)
+            state = sneakersync.State.load(drive / "sneakersync.dat")
+            self.assertEqual(len(state.checkpoints), 2)
+            self.assertNotEqual(state.previous_direction, "send")
+            
+            sneakersync.operations.send(drive, False, backend)
+        
+        self.assertEqual(sent, ["module_0", "module_1", "module_2", "module_2"])
+        self.assertIn(
+            "Skipping {}".format(self.root / "module_0"), stdout.getvalue())
+        
+        state = sneakersync.State.load(drive / "sneakersync.dat")
+        self.assertEqual(state.checkpoints, {})
+        self.assertEqual(state.previous_direction, "send")
+    
+    def test_get_device(self):
+        self.assertEqual(
+            sneakersync.operations.get_device(self.root / "foo" / "bar"),
+            self.root.stat().st_dev)
+
+if __name__ == "__main__":
+    unittest.main()
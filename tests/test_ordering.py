@@ -0,0 +1,63 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestOrdering(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.paths = []
+        for index, size in enumerate([10, 2**12, 20, 30, 40]):
+            path = self.root / "file_{}".format(index)
+            with path.open("wb") as fd:
+                fd.write(os.urandom(size))
+            self.paths.append(path)
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_get_key(self):
+        for path in self.paths:
+            stat_ = path.stat()
+            key = sneakersync.ordering.get_key(path, stat_)
+            self.assertEqual(key[0], stat_.st_dev)
+            if key[1] == 0:
+                self.assertEqual(key[2], stat_.st_ino)
+        
+        # Unknown offsets fall back to the inode number
+        with unittest.mock.patch.object(
+                sneakersync.ordering, "get_physical_offset",
+                lambda *args: None):
+            stat_ = self.paths[0].stat()
+            self.assertEqual(
+                sneakersync.ordering.get_key(self.paths[0], stat_),
+                (stat_.st_dev, 0, stat_.st_ino))
+    
+    def test_schedule(self):
+        entries = [(x, "target", x.name, x.stat()) for x in self.paths]
+        with unittest.mock.patch.multiple(
+                sneakersync.ordering, large_size=2**10, batch_size=50,
+                batch_files=2):
+            large, batches = sneakersync.ordering.schedule(entries)
+        
+        self.assertEqual([x[0] for x in large], [self.paths[1]])
+        # Batches are limited by their size and number of files
+        self.assertTrue(all(len(x) <= 2 for x in batches))
+        self.assertTrue(
+            all(sum(y[-1].st_size for y in x) <= 50 for x in batches))
+        self.assertEqual(
+            sorted(y[0] for x in batches for y in x),
+            sorted(self.paths[:1]+self.paths[2:]))
+        
+        # Files are in physical order within and across batches
+        keys = [
+            sneakersync.ordering.get_key(y[0], y[-1])
+            for x in batches for y in x]
+        self.assertEqual(keys, sorted(keys))
+
+if __name__ == "__main__":
+    unittest.main()
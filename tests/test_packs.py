@@ -0,0 +1,125 @@
+import os
+import unittest
+import unittest.mock
+
+import sneakersync
+
+import test_layouts_base
+
+class TestPacks(test_layouts_base.TestLayoutsBase):
+    options = ["filters: ", "  - exclude: excluded", "layout: pack"]
+    
+    def setUp(self):
+        super().setUp()
+        
+        self.source = self.drives[0] / "module"
+        (self.source / "subdir").mkdir(parents=True)
+        for index in range(10):
+            with (self.source / "subdir" / "{:02d}".format(index)).open(
+                    "w") as fd:
+                fd.write("Content of {}".format(index))
+        with (self.source / "large").open("w") as fd:
+            fd.write(100*"large")
+        with (self.source / "excluded").open("w") as fd:
+            fd.write("Excluded")
+        os.link(self.source / "large", self.source / "subdir" / "large_link")
+        os.symlink("large", self.source / "symlink")
+        os.utime(self.source / "subdir", (1e9, 1e9))
+        
+        self.packs = self.sneakerdrive / "sneakersync.packs"
+        self.patch = unittest.mock.patch.object(
+            sneakersync.packs, "small_size", 100)
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        super().tearDown()
+    
+    def test_send_receive(self):
+        self._synchronize()
+        self._check_synchronized()
+        
+        # Small files are in a single pack, large files are stored separately
+        self.assertEqual(len(list(self.packs.glob("*/packs/*"))), 1)
+        self.assertEqual(len(list(self.packs.glob("*/files/*/*"))), 1)
+        
+        stat_1 = (self.drives[1] / "module" / "large").stat()
+        stat_2 = (self.drives[1] / "module" / "subdir" / "large_link").stat()
+        self.assertEqual(stat_1.st_ino, stat_2.st_ino)
+    
+    def test_modify(self):
+        self._synchronize()
+        
+        # Unchanged files are not stored again
+        with (self.source / "subdir" / "00").open("w") as fd:
+            fd.write("Modified content")
+        with (self.drives[1] / "module" / "excluded").open("w") as fd:
+            fd.write("Local content")
+        self._synchronize()
+        self._check_synchronized()
+        packs = sorted(self.packs.glob("*/packs/*"))
+        self.assertEqual(len(packs), 2)
+        self.assertEqual(packs[1].stat().st_size, len("Modified content"))
+        self.assertTrue((self.drives[1] / "module" / "excluded").exists())
+        
+        # Mostly unused packs are compacted, and unused files removed
+        for index in range(1, 9):
+            (self.source / "subdir" / "{:02d}".format(index)).unlink()
+        with (self.source / "large").open("a") as fd:
+            fd.write("more")
+        self._synchronize()
+        self._check_synchronized()
+        self.assertEqual(
+            [x.name for x in sorted(self.packs.glob("*/packs/*"))],
+            ["00000002.pack", "00000003.pack"])
+        self.assertEqual(len(list(self.packs.glob("*/files/*/*"))), 1)
+    
+    def test_chunks(self):
+        # Large files are stored in chunks, below the size limit of FAT32
+        with unittest.mock.patch.object(sneakersync.packs, "chunk_size", 200):
+            self._synchronize()
+            self._check_synchronized()
+            self.assertEqual(
+                sorted(x.suffix for x in self.packs.glob("*/files/*/*")),
+                ["", ".1", ".2"])
+            self.assertTrue(
+                all(
+                    x.stat().st_size <= 200
+                    for x in self.packs.glob("*/files/*/*")))
+            
+            # The size of the file is a multiple of the size of the chunks
+            with (self.source / "large").open("w") as fd:
+                fd.write(400*"x")
+            self._synchronize()
+            self._check_synchronized()
+            self.assertEqual(
+                sorted(x.suffix for x in self.packs.glob("*/files/*/*")),
+                ["", ".1"])
+    
+    def _synchronize(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.operations.send(
+                self.sneakerdrive, False, sneakersync.rsync)
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            sneakersync.operations.receive(
+                self.sneakerdrive, False, sneakersync.rsync)
+    
+    def _check_synchronized(self):
+        roots = [drive / "module" for drive in self.drives]
+        paths = [
+            sorted(
+                x.relative_to(root) for x in root.rglob("*") 
+                if x.name != "excluded")
+            for root in roots]
+        self.assertSequenceEqual(paths[0], paths[1])
+        for path in paths[0]:
+            path_1, path_2 = [root / path for root in roots]
+            self.assertEqual(path_1.is_symlink(), path_2.is_symlink())
+            if path_1.is_file():
+                self.assertEqual(path_1.read_text(), path_2.read_text())
+            self.assertEqual(
+                int(path_1.lstat().st_mtime), int(path_2.lstat().st_mtime))
+            self.assertEqual(path_1.lstat().st_mode, path_2.lstat().st_mode)
+
+if __name__ == "__main__":
+    unittest.main()
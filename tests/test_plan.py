@@ -0,0 +1,107 @@
+import io
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        with (self.source / "foo").open("w") as fd:
+            fd.write("Content of foo")
+        with (self.source / "subdir" / "bar").open("w") as fd:
+            fd.write("Content of bar")
+        with (self.source / "excluded.pyc").open("w") as fd:
+            fd.write("Content of excluded.pyc")
+        os.link(self.source / "foo", self.source / "subdir" / "foo_link")
+        
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("\n".join([
+                "modules:",
+                "  - root: {}".format(self.source),
+                "filters:",
+                "  - exclude: \"*.pyc\""]))
+        
+        self.stdout = sys.stdout
+        sys.stdout = io.StringIO()
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.root)
+    
+    def test_mirror(self):
+        self.assertEqual(self._estimate(), (2, 28, 28))
+        
+        self._send()
+        self.assertEqual(self._estimate(), (0, 0, 0))
+        
+        with (self.source / "foo").open("w") as fd:
+            fd.write("Modified content of foo")
+        self.assertEqual(self._estimate(), (1, 23, 9))
+    
+    def test_incremental(self):
+        with (self.drive / "sneakersync.cfg").open("a") as fd:
+            fd.write("\nmode: incremental")
+        self.assertEqual(self._estimate(), (2, 28, 28))
+        
+        self._send()
+        self.assertEqual(self._estimate(), (0, 0, 0))
+        
+        with (self.source / "subdir" / "bar").open("w") as fd:
+            fd.write("Modified content of bar")
+        self.assertEqual(self._estimate(), (1, 23, 23))
+    
+    def test_plan(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            sneakersync.operations.plan(
+                self.drive, False, sneakersync.native)
+        self.assertIn(
+            "{}: 2 files, 28.0 B".format(self.source), 
+            sys.stdout.getvalue())
+        self.assertFalse((self.drive / str(self.source)[1:]).exists())
+    
+    def test_not_enough_space(self):
+        # Without preflight, the send does not check the free space
+        with unittest.mock.patch(
+                "sneakersync.plan.get_free_space",
+                unittest.mock.Mock(side_effect=AssertionError)):
+            self._send()
+        shutil.rmtree(self.drive / str(self.source)[1:].split("/")[0])
+        (self.drive / "sneakersync.dat").unlink()
+        
+        with (self.drive / "sneakersync.cfg").open("a") as fd:
+            fd.write("\npreflight: true")
+        with unittest.mock.patch(
+                "sneakersync.plan.get_free_space", lambda drive: 10):
+            with unittest.mock.patch(
+                    "sneakersync.operations.confirm", lambda x: False):
+                self._send()
+        self.assertFalse((self.drive / str(self.source)[1:]).exists())
+        self.assertFalse((self.drive / "sneakersync.dat").exists())
+    
+    def _estimate(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            configuration = sneakersync.operations.read_configuration(
+                self.drive / "sneakersync.cfg")
+            state = sneakersync.State.load(self.drive / "sneakersync.dat")
+            estimate = sneakersync.plan.estimate(
+                self.drive, configuration, configuration["modules"][0], state)
+        return estimate.files, estimate.size, estimate.space
+    
+    def _send(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            sneakersync.operations.send(self.drive, False, sneakersync.native)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestProfiles(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_parse(self):
+        self.assertIs(
+            sneakersync.profiles.parse("large-files"),
+            sneakersync.profiles.profiles["large-files"])
+        self.assertIsNone(sneakersync.profiles.parse("auto"))
+        
+        profile = sneakersync.profiles.parse(
+            {
+                "whole_file": "no", "sparse": "yes", "delete": "delay",
+                "order": "physical"})
+        self.assertEqual(profile.name, "custom")
+        self.assertFalse(profile.whole_file)
+        self.assertTrue(profile.sparse)
+        self.assertFalse(profile.inplace)
+        self.assertEqual(profile.delete, "delay")
+        self.assertEqual(profile.order, "physical")
+    
+    def test_rsync_options(self):
+        profile = sneakersync.profiles.profiles["default"]
+        self.assertEqual(
+            profile.get_rsync_options(),
+            ["--partial-dir=.sneakersync-partial", "--sparse"])
+        self.assertEqual(profile.get_rsync_delete_options(), ["--delete"])
+        
+        profile = sneakersync.profiles.parse(
+            {"whole_file": "no", "inplace": "yes", "sparse": "yes",
+                "preallocate": "yes", "delete": "after"})
+        self.assertEqual(
+            profile.get_rsync_options((3, 2, 7)),
+            ["--no-whole-file", "--inplace", "--sparse", "--preallocate"])
+        # Older versions of rsync reject --sparse with --inplace
+        with self.assertLogs(sneakersync.logger, "WARNING"):
+            self.assertEqual(
+                profile.get_rsync_options((3, 1, 2)),
+                ["--no-whole-file", "--inplace", "--preallocate"])
+        self.assertEqual(
+            sneakersync.profiles.profiles["large-files"].get_rsync_options(),
+            ["--no-whole-file", "--inplace", "--preallocate"])
+        self.assertEqual(
+            profile.get_rsync_delete_options(),
+            ["--delete", "--delete-after"])
+    
+    def test_choose(self):
+        profiles = sneakersync.profiles.profiles
+        self.assertIs(sneakersync.profiles.choose([]), profiles["default"])
+        self.assertIs(
+            sneakersync.profiles.choose([2**34]+100*[1000]),
+            profiles["large-files"])
+        self.assertIs(
+            sneakersync.profiles.choose(100*[1000]+[2**20]),
+            profiles["small-files"])
+        self.assertIs(
+            sneakersync.profiles.choose(100*[2**20]), profiles["default"])
+    
+    def test_sample(self):
+        for directory in ["a", "a/b", "c"]:
+            (self.root / directory).mkdir()
+        for index, path in enumerate(["a/b/foo", "a/bar", "c/baz.pyc", "d"]):
+            with (self.root / path).open("wb") as fd:
+                fd.write(index*b"x")
+        
+        filter_ = sneakersync.filters.Filter([{"exclude": "*.pyc"}])
+        self.assertEqual(
+            sorted(sneakersync.profiles.sample(self.root, filter_, "")),
+            [0, 1, 3])
+        self.assertEqual(
+            len(sneakersync.profiles.sample(self.root, filter_, "", 2)), 2)
+    
+    def test_auto(self):
+        with (self.root / "foo").open("wb") as fd:
+            fd.write(b"x")
+        module = {
+            "root": {"host.name": self.root}, "filters": [],
+            "profile": "auto"}
+        configuration = {"filters": [], "modules": [module]}
+        with unittest.mock.patch("socket.gethostname", lambda: "host.name"):
+            profile = sneakersync.profiles.get_profile(
+                configuration, module, self.root)
+        self.assertIs(profile, sneakersync.profiles.profiles["small-files"])
+    
+    def test_receive(self):
+        source, target, drive = [
+            self.root / x for x in ["source", "target", "drive"]]
+        for path in [source, target, drive]:
+            path.mkdir()
+        with (source / "foo").open("wb") as fd:
+            fd.write(b"x")
+        with (drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("\n".join([
+                "modules:",
+                "  - root:",
+                "      first.host: {}".format(source),
+                "      second.host: {}".format(target),
+                "profile: auto"]))
+        
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.operations.send(drive, False, sneakersync.native)
+        # The profile used by the transfer is recorded without sampling the
+        # drive again.
+        with unittest.mock.patch(
+                "sneakersync.profiles.sample",
+                wraps=sneakersync.profiles.sample) as sample:
+            with unittest.mock.patch(
+                    "socket.gethostname", lambda: "second.host"):
+                sneakersync.operations.receive(
+                    drive, False, sneakersync.native)
+        self.assertEqual(sample.call_count, 1)
+        self.assertTrue((target / "foo").is_file())
+        
+        state = sneakersync.State.load(drive / "sneakersync.dat")
+        transfer, = state.transfers.values()
+        self.assertEqual(transfer["direction"], "receive")
+        self.assertEqual(transfer["profile"], "small-files")
+
+if __name__ == "__main__":
+    unittest.main()
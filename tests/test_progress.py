@@ -0,0 +1,67 @@
+import io
+import unittest
+
+import sneakersync
+
+class TestProgress(unittest.TestCase):
+    def test_parse_progress(self):
+        event = sneakersync.rsync.parse_progress(
+            "      1,238,099  50%   11.80MB/s    0:01:02 (xfr#5, to-chk=3/7)")
+        self.assertEqual(
+            event, 
+            sneakersync.progress.Progress(
+                1238099, 2476198, 4, 7, 11.8*2**20, 62))
+        
+        event = sneakersync.rsync.parse_progress(
+            "         32,768   0%    0.00kB/s    0:00:00  ")
+        self.assertEqual(
+            event, sneakersync.progress.Progress(32768, None, rate=0, eta=0))
+        
+        self.assertIsNone(sneakersync.rsync.parse_progress("foo/bar"))
+    
+    def test_parse_statistics(self):
+        statistics = {}
+        lines = [
+            "Number of files: 7 (reg: 5, dir: 2)",
+            "Total transferred file size: 1,234 bytes",
+            "File list generation time: 0.001 seconds",
+            "",
+            "sent 1,480 bytes  received 111 bytes  3,182.00 bytes/sec",
+        ]
+        for line in lines:
+            self.assertTrue(
+                sneakersync.rsync.parse_statistics(line, statistics))
+        self.assertEqual(
+            statistics, {
+                "Number of files": 7, "Total transferred file size": 1234,
+                "File list generation time": 0.001})
+        
+        self.assertFalse(
+            sneakersync.rsync.parse_statistics("foo/bar", statistics))
+    
+    def test_tracker(self):
+        events = []
+        tracker = sneakersync.progress.Tracker(events.append)
+        tracker.update(10)
+        tracker.update(20)
+        self.assertEqual(
+            [(x.bytes_done, x.files_done) for x in events], [(10, 1), (30, 2)])
+    
+    def test_progress_bar(self):
+        stream = io.StringIO()
+        progress_bar = sneakersync.progress.ProgressBar(stream, 10, 0)
+        progress_bar(
+            "module_1", sneakersync.progress.Progress(256, 1024, rate=2048))
+        progress_bar(
+            "module_2", 
+            sneakersync.progress.Progress(256, 1024, rate=1024, eta=65))
+        progress_bar.close()
+        
+        lines = stream.getvalue().split("\r")
+        self.assertEqual(
+            lines[2].strip(), 
+            "[##--------]  25% 512.0 B/2.0 kB 3.0 kB/s ETA 0:01:05")
+        self.assertTrue(stream.getvalue().endswith("\n"))
+
+if __name__ == "__main__":
+    unittest.main()
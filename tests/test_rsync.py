@@ -115,6 +115,25 @@ class TestRsync(test_synchronize_base.TestSynchronizeBase):
         self._synchronize()
         self._check_synchronized()
     
+    def test_batches(self):
+        with (self.sneakerdrive / "sneakersync.cfg").open("a") as fd:
+            fd.write("\nmax_entries_per_batch: 2\n")
+        (self.drives[0] / "module_1" / "foo.1").unlink()
+        (self.drives[0] / "module_1" / "other").mkdir()
+        for i in range(5):
+            with (self.drives[0] / "module_1" / "other" / str(i)).open(
+                    "w") as fd:
+                fd.write("Content of {}".format(i))
+        os.link(
+            self.drives[0] / "module_1" / "other" / "0",
+            self.drives[0] / "module_1" / "subdir" / "link")
+        
+        self._synchronize()
+        self._check_synchronized()
+        self.assertEqual(
+            (self.drives[1] / "module_1" / "other" / "0").stat().st_ino,
+            (self.drives[1] / "module_1" / "subdir" / "link").stat().st_ino)
+    
     def _synchronize(self):
         with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
             configuration = sneakersync.operations.read_configuration(
@@ -0,0 +1,105 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestScan(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.modules = [self.root / "module_1", self.root / "module_2"]
+        for module in self.modules:
+            (module / "subdir").mkdir(parents=True)
+            (module / "excluded").mkdir()
+            for path in ["foo", "subdir/bar", "excluded/baz", "foo.pyc"]:
+                with (module / path).open("w") as fd:
+                    fd.write("Content of {}".format(path))
+        
+        self.configuration = {
+            "modules": [
+                {"root": {"host.name": x}, "filters": []}
+                for x in self.modules],
+            "filters": [{"exclude": "*.pyc"}, {"exclude": "excluded/"}]
+        }
+        self.patch = unittest.mock.patch(
+            "socket.gethostname", lambda: "host.name")
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_walk(self):
+        filter_ = sneakersync.filters.get_filter(
+            self.configuration["filters"])
+        
+        # Excluded directories are not entered
+        scandir = unittest.mock.Mock(wraps=os.scandir)
+        with unittest.mock.patch("os.scandir", scandir):
+            entries = list(sneakersync.scan.walk(self.modules[0], filter_))
+        self.assertEqual(
+            sorted(x.path for x in entries), ["", "foo", "subdir", "subdir/bar"])
+        self.assertNotIn(
+            os.path.join(self.modules[0], "excluded"),
+            [x[0][0] for x in scandir.call_args_list])
+        
+        entry = [x for x in entries if x.path == "foo"][0]
+        stat_ = (self.modules[0] / "foo").stat()
+        self.assertEqual(
+            entry.get_manifest_entry(),
+            sneakersync.manifest.get_entry(stat_))
+        self.assertEqual(entry.nlink, 1)
+    
+    def test_walk_options(self):
+        filter_ = sneakersync.filters.get_filter([])
+        (self.modules[0] / "subdir" / "deep").mkdir()
+        
+        entries = sneakersync.scan.walk(
+            self.modules[0], filter_, breadth_first=True)
+        paths = [x.path for x in entries]
+        self.assertLess(paths.index("foo"), paths.index("subdir/bar"))
+        self.assertLess(paths.index("excluded"), paths.index("subdir/bar"))
+        self.assertEqual(paths[-1], "subdir/deep")
+        
+        # Directories which cannot be listed are skipped if errors is a list
+        def scandir(path, scandir=os.scandir):
+            if str(path).endswith("subdir"):
+                raise PermissionError("Permission denied")
+            return scandir(path)
+        with unittest.mock.patch("os.scandir", scandir):
+            with self.assertRaises(PermissionError):
+                list(sneakersync.scan.walk(self.modules[0], filter_))
+            errors = []
+            entries = sneakersync.scan.walk(
+                self.modules[0], filter_, errors=errors)
+            self.assertNotIn("subdir/bar", [x.path for x in entries])
+        self.assertEqual(errors, ["subdir: Permission denied"])
+    
+    def test_spill(self):
+        entries = [
+            sneakersync.scan.Entry("{:04d}".format(x), x, 0, 0, x, 0o100644, 1)
+            for x in reversed(range(1000))]
+        with unittest.mock.patch.multiple(
+                sneakersync.scan, chunk_size=64, buffer_size=100):
+            with sneakersync.scan.Spill() as spill:
+                spill.extend(iter(entries))
+                self.assertEqual(len(spill.runs), 16)
+                self.assertEqual(len(spill), 1000)
+                self.assertEqual(list(spill), list(reversed(entries)))
+    
+    def test_scan_modules(self):
+        spills = sneakersync.scan.scan_modules(self.configuration, jobs=2)
+        try:
+            self.assertEqual(len(spills), 2)
+            for spill in spills.values():
+                self.assertEqual(
+                    [x.path for x in spill], ["", "foo", "subdir", "subdir/bar"])
+        finally:
+            for spill in spills.values():
+                spill.close()
+
+if __name__ == "__main__":
+    unittest.main()
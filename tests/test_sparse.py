@@ -0,0 +1,78 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+import sneakersync
+
+class TestSparse(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.path = self.root / "sparse"
+        with self.path.open("wb") as fd:
+            fd.seek(2**20)
+            fd.write(b"first")
+            fd.seek(4*2**20)
+            fd.write(b"second")
+            fd.truncate(8*2**20)
+        if not sneakersync.sparse.is_sparse(self.path.stat()):
+            self.skipTest("File system does not support sparse files")
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def test_extents(self):
+        with self.path.open("rb") as fd:
+            extents = sneakersync.sparse.get_extents(
+                fd.fileno(), self.path.stat().st_size)
+            self.assertEqual(fd.tell(), 0)
+        
+        # Extents are aligned on the blocks of the file system
+        self.assertEqual(len(extents), 2)
+        self.assertTrue(extents[0][0] <= 2**20 < sum(extents[0]))
+        self.assertTrue(extents[1][0] <= 4*2**20 < sum(extents[1]))
+        self.assertLess(sum(x[1] for x in extents), 2**20)
+        
+        self.assertEqual(
+            sneakersync.sparse.clip([(0, 10), (20, 10)], 5),
+            [(5, 5), (20, 10)])
+        self.assertEqual(
+            sneakersync.sparse.clip([(0, 10), (20, 10)], 25), [(25, 5)])
+    
+    def test_copy(self):
+        target = self.root / "target"
+        size = self.path.stat().st_size
+        with self.path.open("rb") as source_fd, target.open("wb") as target_fd:
+            extents = sneakersync.sparse.get_extents(source_fd.fileno(), size)
+            sneakersync.sparse.copy_extents(
+                source_fd.fileno(), target_fd.fileno(), extents, size)
+        
+        self.assertEqual(target.read_bytes(), self.path.read_bytes())
+        self.assertTrue(sneakersync.sparse.is_sparse(target.stat()))
+    
+    def test_map(self):
+        path_stat = self.path.stat()
+        extent_map = sneakersync.sparse.ExtentMap(
+            self.root / "maps" / "module", {
+                "sparse": (path_stat.st_size, path_stat.st_mtime_ns, [(0, 1)]),
+                "deleted": (1, 0, [(0, 1)])})
+        extent_map.save(self.root)
+        
+        other = sneakersync.sparse.ExtentMap.load(extent_map.path)
+        self.assertEqual(list(other.entries), ["sparse"])
+        self.assertEqual(other.get("sparse", path_stat), [(0, 1)])
+        self.assertIsNone(other.get("other", path_stat))
+        
+        with self.path.open("ab") as fd:
+            fd.write(b"modified")
+        self.assertIsNone(other.get("sparse", self.path.stat()))
+        
+        other.entries = {}
+        other.save(self.root)
+        self.assertFalse(extent_map.path.exists())
+        self.assertEqual(
+            sneakersync.sparse.ExtentMap.load(extent_map.path).entries, {})
+
+if __name__ == "__main__":
+    unittest.main()
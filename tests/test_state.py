@@ -42,6 +42,42 @@ class TestState(unittest.TestCase):
             self.assertEqual(
                 state.previous_direction, other_state.previous_direction)
             self.assertEqual(state.previous_host, other_state.previous_host)
+            self.assertEqual(other_state.generation, 0)
+            self.assertEqual(other_state.generations, {})
+            self.assertIsNone(other_state.throughput)
+            self.assertEqual(other_state.checkpoints, {})
+        finally:
+            path.unlink()
+    
+    def test_save_generations(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        path = pathlib.Path(path)
+        
+        try:
+            state = sneakersync.state.State(
+                path, "send", "now", "myself", 3, {"myself": 3, "other": 1})
+            state.save()
+            
+            other_state = sneakersync.state.State.load(path)
+            self.assertEqual(other_state.generation, 3)
+            self.assertEqual(
+                other_state.generations, {"myself": 3, "other": 1})
+        finally:
+            path.unlink()
+    
+    def test_save_throughput(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        path = pathlib.Path(path)
+        
+        try:
+            state = sneakersync.state.State(
+                path, "send", "now", "myself", throughput=1.5e8)
+            state.save()
+            
+            other_state = sneakersync.state.State.load(path)
+            self.assertEqual(other_state.throughput, 1.5e8)
         finally:
             path.unlink()
 
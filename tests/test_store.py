@@ -0,0 +1,148 @@
+import concurrent.futures
+import hashlib
+import os
+import sys
+import unittest
+import unittest.mock
+
+import sneakersync
+
+import test_layouts_base
+
+class TestStore(test_layouts_base.TestLayoutsBase):
+    modules = ["module_1", "module_2"]
+    options = ["filters: ", "  - exclude: excluded", "layout: dedup"]
+    
+    def setUp(self):
+        super().setUp()
+        
+        for module in ["module_1", "module_2"]:
+            (self.drives[0] / module / "subdir").mkdir(parents=True)
+            with (self.drives[0] / module / "foo").open("w") as fd:
+                fd.write("Shared content")
+            with (self.drives[0] / module / "subdir" / "bar").open("w") as fd:
+                fd.write("Content of {}".format(module))
+            with (self.drives[0] / module / "excluded").open("w") as fd:
+                fd.write("Excluded")
+        os.link(
+            self.drives[0] / "module_1" / "foo", 
+            self.drives[0] / "module_1" / "subdir" / "foo_link")
+        os.symlink("foo", self.drives[0] / "module_2" / "foo_symlink")
+    
+    def test_send_receive(self):
+        self._synchronize()
+        self._check_synchronized()
+        
+        # One object per distinct content
+        objects = list(
+            (self.sneakerdrive / "sneakersync.store" / "objects").glob("*/*"))
+        self.assertEqual(len(objects), 3)
+        
+        stat_1 = (self.drives[1] / "module_1" / "foo").stat()
+        stat_2 = (self.drives[1] / "module_1" / "subdir" / "foo_link").stat()
+        self.assertEqual(stat_1.st_ino, stat_2.st_ino)
+    
+    def test_concurrent_add(self):
+        store = sneakersync.store.Store(self.sneakerdrive)
+        path = self.drives[0] / "module_1" / "foo"
+        hash_ = hashlib.sha256(path.read_bytes()).hexdigest()
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(
+                executor.map(lambda x: store.add(path, "0"*64), range(32)))
+        self.assertEqual([x for x, _ in results], 32*[hash_])
+        self.assertEqual(store.add(path), (hash_, False))
+        self.assertEqual(
+            store.get_object(hash_).read_bytes(), path.read_bytes())
+        self.assertEqual(
+            [x.name for x in store.objects.iterdir()], [hash_[:2]])
+        
+        # Nothing to collect in a store without trees
+        store.collect_garbage({"modules": []})
+        self.assertFalse(store.get_object(hash_).exists())
+    
+    def test_read_once(self):
+        # The new files are hashed while they are stored
+        reads = []
+        def open_(path, *args, **kwargs):
+            if isinstance(path, (str, os.PathLike)):
+                reads.append(os.fspath(path))
+            return open(path, *args, **kwargs)
+        with unittest.mock.patch("sneakersync.store.open", open_, create=True):
+            with unittest.mock.patch(
+                    "socket.gethostname", lambda: "first.host"):
+                sneakersync.operations.send(
+                    self.sneakerdrive, False, sneakersync.rsync)
+        path = str(self.drives[0] / "module_2" / "subdir" / "bar")
+        self.assertEqual(reads.count(path), 1)
+        
+        objects = list(
+            (self.sneakerdrive / "sneakersync.store" / "objects").glob("*/*"))
+        self.assertEqual(len(objects), 3)
+        for object_ in objects:
+            self.assertEqual(
+                object_.parent.name+object_.name,
+                hashlib.sha256(object_.read_bytes()).hexdigest())
+    
+    def test_deep_tree(self):
+        path = self.drives[0] / "deep"
+        path.mkdir()
+        for index in range(300):
+            path = path / "d"
+            os.mkdir(path)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            paths = [
+                x for x, _ in sneakersync.store.walk(
+                    self.drives[0] / "deep",
+                    sneakersync.filters.get_filter([]), "", [])]
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(len(paths), 301)
+        self.assertEqual(paths[:3], ["", "d", "d/d"])
+    
+    def test_modify(self):
+        self._synchronize()
+        
+        (self.drives[0] / "module_2" / "subdir" / "bar").unlink()
+        with (self.drives[0] / "module_1" / "subdir" / "bar").open("w") as fd:
+            fd.write("Modified content")
+        with (self.drives[1] / "module_1" / "excluded").open("w") as fd:
+            fd.write("Local content")
+        
+        self._synchronize()
+        self._check_synchronized()
+        
+        # Unreferenced objects are removed
+        objects = list(
+            (self.sneakerdrive / "sneakersync.store" / "objects").glob("*/*"))
+        self.assertEqual(len(objects), 2)
+        self.assertTrue((self.drives[1] / "module_1" / "excluded").exists())
+    
+    def _synchronize(self):
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"):
+            sneakersync.operations.send(
+                self.sneakerdrive, False, sneakersync.rsync)
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            sneakersync.operations.receive(
+                self.sneakerdrive, False, sneakersync.rsync)
+    
+    def _check_synchronized(self):
+        for module in ["module_1", "module_2"]:
+            roots = [drive / module for drive in self.drives]
+            paths = [
+                sorted(
+                    x.relative_to(root) for x in root.rglob("*") 
+                    if x.name != "excluded")
+                for root in roots]
+            self.assertSequenceEqual(paths[0], paths[1])
+            for path in paths[0]:
+                path_1, path_2 = [root / path for root in roots]
+                self.assertEqual(path_1.is_symlink(), path_2.is_symlink())
+                if path_1.is_file():
+                    self.assertEqual(path_1.read_text(), path_2.read_text())
+                self.assertEqual(
+                    int(path_1.lstat().st_mtime), int(path_2.lstat().st_mtime))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import io
+import pathlib
+import shutil
+import sys
+import tempfile
+import unittest
+
+import sneakersync
+
+class TestSubprocess(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.stdout = sys.stdout
+        sys.stdout = io.StringIO()
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.root)
+    
+    def test_progress(self):
+        events = []
+        output = (
+            "foo\\n"
+            "  100  10%  1.00kB/s  0:00:09 (xfr#1, to-chk=1/2)\\r"
+            "  1,000  100%  1.00kB/s  0:00:00 (xfr#2, to-chk=0/2)\\n"
+            "Total transferred file size: 1,000 bytes\\n"
+            "Number of regular files transferred: 2\\n")
+        
+        sneakersync.rsync.call_subprocess(
+            ["printf", "%b", output], "send", {"root": {}}, events.append)
+        self.assertEqual(sys.stdout.getvalue(), "foo\n")
+        
+        self.assertEqual(
+            events, [
+                sneakersync.progress.Progress(100, 1000, 1, 2, 1024, 9),
+                sneakersync.progress.Progress(1000, 1000, 2, 2, 1024, 0),
+                sneakersync.progress.Progress(
+                    1000, 1000, 2, 2, None, 0, {
+                        "Total transferred file size": 1000,
+                        "Number of regular files transferred": 2})])
+    
+    def test_failure(self):
+        with self.assertRaises(sneakersync.Exception) as context:
+            sneakersync.rsync.call_subprocess(
+                ["sh", "-c", "printf error; exit 1"], "send", {"root": {}})
+        self.assertEqual(context.exception.text, "error")
+    
+    def test_bounded_output(self):
+        command = ["sh", "-c", "seq 1000; exit 1"]
+        with self.assertRaises(sneakersync.Exception) as context:
+            sneakersync.rsync.call_subprocess(command, "send", {"root": {}})
+        
+        lines = context.exception.text.splitlines()
+        self.assertEqual(
+            len(lines), 1+sneakersync.rsync.output_lines)
+        self.assertEqual(
+            lines[0], 
+            "[{} lines omitted]".format(
+                1000-sneakersync.rsync.output_lines))
+        self.assertEqual(lines[-1], "1000")
+    
+    def test_log(self):
+        log = self.root / "sneakersync.logs" / "module.send.log"
+        command = ["sh", "-c", "seq 1000; exit 1"]
+        with self.assertRaises(sneakersync.Exception) as context:
+            sneakersync.rsync.call_subprocess(
+                command, "send", {"root": {}}, log=log)
+        
+        self.assertTrue(context.exception.text.endswith(str(log)))
+        self.assertEqual(
+            log.read_text().splitlines(), [str(x) for x in range(1, 1001)])
+    
+    def test_log_batches(self):
+        # The commands of a module append to its log, which is emptied once
+        log = self.root / "sneakersync.logs" / "module.send.log"
+        for _ in range(2):
+            sneakersync.rsync.reset_log(log)
+            for batch in ["1", "2"]:
+                sneakersync.rsync.call_subprocess(
+                    ["echo", batch], "send", {"root": {}}, log=log)
+            self.assertEqual(log.read_text().splitlines(), ["1", "2"])
+    
+    def test_decode(self):
+        # Multi-byte characters split across reads and invalid file names
+        command = [
+            "sh", "-c", "printf '\\303'; sleep 0.1; printf '\\251\\n\\377\\n'"]
+        sneakersync.rsync.call_subprocess(command, "send", {"root": {}})
+        self.assertEqual(sys.stdout.getvalue(), "é\n�\n")
+    
+    def test_get_log(self):
+        module = {"root": {"first.host": pathlib.Path("/foo")}}
+        self.assertIsNone(
+            sneakersync.rsync.get_log(self.root, {"log": False}, module, "send"))
+        self.assertEqual(
+            sneakersync.rsync.get_log(self.root, {"log": True}, module, "send"),
+            self.root / "sneakersync.logs" / "{}.send.log".format(
+                sneakersync.get_module_id(module)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+class TestVolumes(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.hosts = [self.root / "first", self.root / "second"]
+        self.drives = [self.root / "drive_{}".format(x) for x in range(3)]
+        for directory in self.hosts+self.drives:
+            directory.mkdir()
+        
+        with (self.drives[0] / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            for name in ["big", "small"]:
+                fd.write("  - root:\n")
+                fd.write(
+                    "      first.host: {}\n".format(self.hosts[0] / name))
+                fd.write(
+                    "      second.host: {}\n".format(self.hosts[1] / name))
+            fd.write("filters:\n  - exclude: excluded\n")
+        
+        # The big module uses 23 blocks, the small one 4
+        for directory in ["a", "b"]:
+            (self.hosts[0] / "big" / directory).mkdir(parents=True)
+            for index in range(10):
+                path = self.hosts[0] / "big" / directory / "{:02d}".format(
+                    index)
+                with path.open("w") as fd:
+                    fd.write("Content of {}".format(path.name))
+        (self.hosts[0] / "small").mkdir()
+        for name in ["foo", "bar", "baz"]:
+            with (self.hosts[0] / "small" / name).open("w") as fd:
+                fd.write("Content of {}".format(name))
+        with (self.hosts[0] / "small" / "excluded").open("w") as fd:
+            fd.write("Excluded")
+        
+        self.patch = unittest.mock.patch.dict(
+            os.environ, {"XDG_STATE_HOME": str(self.root / "state")})
+        self.patch.start()
+    
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_assign(self):
+        get_entries = lambda x: [
+            ("{:02d}".format(x), 1) for x in range(sizes[x])]
+        
+        # Modules are kept whole, on as few drives as possible
+        sizes = {"a": 5, "b": 3, "c": 8}
+        volumes = sneakersync.volumes.assign(sizes, [10, 4, 10], get_entries)
+        self.assertEqual(
+            [[(x["module"], x["volume"], x["shards"]) for x in y]
+                for y in volumes],
+            [[("c", 1, 1)], [], [("a", 2, 1), ("b", 2, 1)]])
+        
+        # Modules larger than a drive are split in few shards
+        sizes = {"a": 12}
+        volumes = sneakersync.volumes.assign(sizes, [10, 4, 10], get_entries)
+        self.assertEqual(
+            [[(x["start"], x["end"], x["size"]) for x in y] for y in volumes],
+            [[("", "10", 10)], [], [("10", "", 2)]])
+        
+        sizes = {"a": 30}
+        self.assertIsNone(
+            sneakersync.volumes.assign(sizes, [10, 4, 10], get_entries))
+    
+    def test_send_receive(self):
+        block = sneakersync.volumes.block_size
+        free_space = {
+            self.drives[0]: 14*block, self.drives[1]: 14*block,
+            self.drives[2]: 8*block}
+        self._send(free_space)
+        
+        # The small module and the end of the big one are on the first drive
+        state = sneakersync.State.load(self.drives[0] / "sneakersync.dat")
+        self.assertEqual(state.volume["number"], 1)
+        self.assertEqual(state.volume["count"], 2)
+        self.assertTrue(state.volume["complete"])
+        self.assertEqual(
+            [
+                (x["volume"], x["shard"], x["shards"], x["size"])
+                for x in state.volume["shards"]],
+            [(1, 1, 1, 4*block), (1, 2, 2, 9*block), (2, 1, 2, 14*block)])
+        self.assertFalse(
+            (self.drives[2] / "sneakersync.dat").exists())
+        self.assertTrue((self.drives[1] / "sneakersync.cfg").exists())
+        
+        # Volumes are received in any order
+        self.assertEqual(self._receive(self.drives[1]), [1])
+        self.assertEqual(self._receive(self.drives[0]), [])
+        self._check_synchronized()
+        
+        # The next send moves the boundaries of the shards
+        (self.hosts[0] / "big" / "a" / "00").unlink()
+        (self.hosts[0] / "big" / "b" / "09").unlink()
+        with (self.hosts[0] / "big" / "b" / "new").open("w") as fd:
+            fd.write("New")
+        with (self.hosts[0] / "big" / "a" / "05").open("w") as fd:
+            fd.write("Modified")
+        self._send({x: 0 for x in self.drives})
+        self.assertEqual(self._receive(self.drives[0]), [2])
+        self.assertEqual(self._receive(self.drives[1]), [])
+        self._check_synchronized()
+        
+        # A volume which was not completely sent cannot be received
+        state = sneakersync.State.load(self.drives[0] / "sneakersync.dat")
+        state.volume["complete"] = False
+        state.save()
+        with self.assertRaises(Exception):
+            self._receive(self.drives[0])
+    
+    def test_not_fitting(self):
+        block = sneakersync.volumes.block_size
+        with self.assertRaises(Exception):
+            self._send({x: 8*block for x in self.drives})
+        self.assertFalse((self.drives[0] / "sneakersync.dat").exists())
+    
+    def _send(self, free_space):
+        with unittest.mock.patch("socket.gethostname", lambda: "first.host"), \
+                unittest.mock.patch.object(
+                    sneakersync.plan, "get_free_space", free_space.get):
+            sneakersync.operations.send(
+                self.drives[0], False, sneakersync.native,
+                confirmation=True, volumes=self.drives[1:])
+    
+    def _receive(self, drive):
+        with unittest.mock.patch("socket.gethostname", lambda: "second.host"):
+            return sneakersync.operations.receive(
+                drive, False, sneakersync.native, confirmation=True)
+    
+    def _check_synchronized(self):
+        for name in ["big", "small"]:
+            roots = [host / name for host in self.hosts]
+            paths = [
+                sorted(
+                    x.relative_to(root) for x in root.rglob("*")
+                    if x.name != "excluded")
+                for root in roots]
+            self.assertSequenceEqual(paths[0], paths[1])
+            for path in paths[0]:
+                path_1, path_2 = [root / path for root in roots]
+                if path_1.is_file():
+                    self.assertEqual(path_1.read_text(), path_2.read_text())
+                    self.assertEqual(
+                        int(path_1.stat().st_mtime),
+                        int(path_2.stat().st_mtime))
+
+if __name__ == "__main__":
+    unittest.main()
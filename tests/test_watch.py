@@ -0,0 +1,161 @@
+import contextlib
+import io
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import sneakersync
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is required")
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path(tempfile.mkdtemp())
+        self.source = self.root / "source"
+        self.drive = self.root / "drive"
+        for path in [self.source, self.drive]:
+            path.mkdir()
+        
+        (self.source / "subdir").mkdir()
+        for path in ["foo", "subdir/bar"]:
+            with (self.source / path).open("w") as fd:
+                fd.write("Content of {}".format(path))
+        
+        with (self.drive / "sneakersync.cfg").open("w") as fd:
+            fd.write("modules:\n")
+            fd.write("  - root: {}\n".format(self.source))
+            fd.write("filters:\n")
+            fd.write("  - exclude: \"*.pyc\"\n")
+        
+        self.patches = [
+            unittest.mock.patch("socket.gethostname", lambda: "host.name"),
+            unittest.mock.patch.dict(
+                os.environ, {"XDG_STATE_HOME": str(self.root / "state")})]
+        for patch in self.patches:
+            patch.start()
+        
+        self.configuration = sneakersync.operations.read_configuration(
+            self.drive / "sneakersync.cfg")
+        self.module = self.configuration["modules"][0]
+        self.watcher = sneakersync.watch.Watcher(
+            self.configuration, self.module)
+    
+    def tearDown(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        for patch in reversed(self.patches):
+            patch.stop()
+        shutil.rmtree(self.root)
+    
+    def test_journal(self):
+        state = sneakersync.State(
+            self.drive / "sneakersync.dat", None, None, None,
+            tokens={sneakersync.get_module_id(self.module): "token"})
+        position = sneakersync.watch.get_position(
+            self.configuration, self.module)
+        sneakersync.watch.set_baseline(self.module, position, "token")
+        
+        with (self.source / "subdir" / "bar").open("a") as fd:
+            fd.write("modified")
+        (self.source / "foo").unlink()
+        (self.source / "new" / "deep").mkdir(parents=True)
+        with (self.source / "new" / "deep" / "file").open("w") as fd:
+            fd.write("new")
+        with (self.source / "excluded.pyc").open("w") as fd:
+            fd.write("excluded")
+        while self.watcher.process():
+            pass
+        
+        position = sneakersync.watch.get_position(
+            self.configuration, self.module)
+        self.assertEqual(
+            sneakersync.watch.get_changes(
+                self.configuration, self.module, state, position),
+            {"", "subdir", "subdir/bar", "foo", "new", "new/deep",
+                "new/deep/file"})
+        
+        # Another send modified the drive
+        state.tokens = {sneakersync.get_module_id(self.module): "other"}
+        self.assertIsNone(
+            sneakersync.watch.get_changes(
+                self.configuration, self.module, state, position))
+    
+    def test_hard_links(self):
+        os.link(self.source / "foo", self.source / "subdir" / "foo_link")
+        while self.watcher.process():
+            pass
+        position = sneakersync.watch.get_position(
+            self.configuration, self.module)
+        journal = sneakersync.watch.Journal(self.module)
+        
+        with (self.source / "foo").open("a") as fd:
+            fd.write("modified")
+        while self.watcher.process():
+            pass
+        
+        self.assertEqual(
+            journal.read(
+                position[0], position[1],
+                sneakersync.watch.get_position(
+                    self.configuration, self.module)[1]),
+            {"foo", "subdir/foo_link"})
+    
+    def test_new_session(self):
+        position = sneakersync.watch.get_position(
+            self.configuration, self.module)
+        self.assertIsNotNone(position)
+        
+        # Events may have been lost
+        self.watcher.start()
+        self.assertNotEqual(
+            sneakersync.watch.get_position(
+                self.configuration, self.module)[0],
+            position[0])
+        
+        # The watcher is not running anymore
+        self.watcher.close()
+        self.watcher = None
+        self.assertIsNone(
+            sneakersync.watch.get_position(self.configuration, self.module))
+    
+    def test_already_watched(self):
+        with self.assertRaises(Exception):
+            sneakersync.watch.Watcher(self.configuration, self.module)
+    
+    def test_send(self):
+        sent = []
+        send = sneakersync.native.send
+        def backend_send(*args, **kwargs):
+            sent.append(args[5] if len(args) > 5 else None)
+            return send(*args, **kwargs)
+        backend = unittest.mock.Mock(
+            send=backend_send, receive=sneakersync.native.receive)
+        
+        with contextlib.redirect_stdout(io.StringIO()):
+            # No baseline: the whole module is sent
+            sneakersync.operations.send(self.drive, False, backend)
+            
+            with (self.source / "subdir" / "bar").open("w") as fd:
+                fd.write("modified")
+            (self.source / "foo").unlink()
+            while self.watcher.process():
+                pass
+            
+            # NOTE: do not ask to confirm the re-send
+            state = sneakersync.State.load(self.drive / "sneakersync.dat")
+            state.previous_direction = "receive"
+            state.save()
+            sneakersync.operations.send(self.drive, False, backend)
+        
+        self.assertEqual(sent, [None, {"", "foo", "subdir", "subdir/bar"}])
+        
+        target = self.drive / self.source.relative_to(self.source.anchor)
+        self.assertFalse((target / "foo").exists())
+        with (target / "subdir" / "bar").open() as fd:
+            self.assertEqual(fd.read(), "modified")
+
+if __name__ == "__main__":
+    unittest.main()